@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'debug_toolbar',
     'sass_processor',
     'rest_framework',
@@ -88,6 +89,16 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+# Per process memory cache, use a shared backend (file, database, memcached, redis...) with several workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -177,13 +188,86 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 JSON_DIR_NAME = 'cached_json_files'
 JSON_DIR_PATH = os.path.join(BASE_DIR, JSON_DIR_NAME)
 
-LAST_PAGE_HISTORY_PATH = os.path.join(BASE_DIR, 'update_history')
-if os.getenv('LAST_PAGE_HISTORY_PATH'):
-    LAST_PAGE_HISTORY_PATH = os.getenv('LAST_PAGE_HISTORY_PATH')
+# 'json' caches each api page in its own json file, 'ndjson' caches only fields read by imports in a gzip file
+# indexed by page (convert_api_cache command converts a json cache)
+API_CACHE_FORMAT = 'json'
+if os.getenv('API_CACHE_FORMAT'):
+    API_CACHE_FORMAT = os.getenv('API_CACHE_FORMAT')
+
+# An ndjson cache is compacted at the end of an import once its replaced pages take more than this ratio of its
+# data file
+API_CACHE_MAX_DEAD_RATIO = 0.2
+
+# Number of api data elements read then written into database at once by imports
+IMPORT_BATCH_SIZE = 500
+
+# PostgreSQL schema of tables written by api_to_db --staging before they replace live ones
+IMPORT_STAGING_SCHEMA = 'import_staging'
+
+# Number of Open Food Facts api pages recovered in parallel by api_to_db
+API_CONCURRENCY = 1
+if os.getenv('API_CONCURRENCY'):
+    API_CONCURRENCY = int(os.getenv('API_CONCURRENCY'))
+
+# Max number of requests started each second on an api host (0 for no limit)
+API_MAX_REQUESTS_PER_SECOND = 5
+
+# Api requests connect and read timeouts (seconds), retries of failed requests and backoff factor between them
+API_TIMEOUT = (5, 60)
+API_MAX_RETRIES = 3
+API_RETRY_BACKOFF = 0.5
 
 # SEARCH SETTINGS
 MAX_RESULT_PER_PAGE = 15
 
+# 'icontains' works with any database, 'fulltext' needs PostgreSQL, 'trigram' needs PostgreSQL pg_trgm extension,
+# 'inverted_index' works with any database and keeps product names in memory
+SEARCH_ENGINE = 'icontains'
+if os.getenv('SEARCH_ENGINE'):
+    SEARCH_ENGINE = os.getenv('SEARCH_ENGINE')
+
+# Seconds search results stay in cache, they are also dropped by a new catalogue version after an import
+SEARCH_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Seconds search results (kept in session through their id) stay stored in database after their last use
+SEARCH_RESULT_TIMEOUT = 60 * 60 * 24
+
+# Seconds catalogue metadata (nutrition grades, counts...) stay in cache, they are refreshed by an import
+CATALOGUE_METADATA_CACHE_TIMEOUT = 60
+
+# Seconds between two refreshes of 'inverted_index' search engine from products last_updated
+SEARCH_INDEX_REFRESH_INTERVAL = 60
+
+# AUTOCOMPLETE SETTINGS
+AUTOCOMPLETE_INDEX_PATH = os.path.join(BASE_DIR, 'autocomplete', 'autocomplete.idx')
+if os.getenv('AUTOCOMPLETE_INDEX_PATH'):
+    AUTOCOMPLETE_INDEX_PATH = os.getenv('AUTOCOMPLETE_INDEX_PATH')
+# max number of suggestions returned for a prefix (65535 at most)
+AUTOCOMPLETE_MAX_SUGGESTIONS = 10
+AUTOCOMPLETE_MAX_WORDS = 3
+# most frequent n-grams kept as suggestions, bounds memory used to build suggestions file
+AUTOCOMPLETE_MAX_STORED_SUGGESTIONS = 200000
+AUTOCOMPLETE_PREFIX_CACHE_LENGTH = 3
+
+# SUBSTITUTES SETTINGS
+SUBSTITUTES_MAX_PER_PRODUCT = 100
+
+# Weight of each nutrient in distance between a product and its healthier alternatives, alternatives have no more
+# sugars, salt and saturated fat than the product
+SUBSTITUTE_NUTRIENT_WEIGHTS = {
+    'sugars_100g': 1.0,
+    'salt_100g': 1.0,
+    'saturated_fat_100g': 1.0,
+    'energy_100g': 0.5,
+}
+
+# Max number of healthier alternatives shown on product page
+HEALTHIER_ALTERNATIVES_MAX = 4
+
+# Seconds nutrient matrices of categories stay in cache, they are also dropped by a new catalogue version after an
+# import
+NUTRIENT_MATRIX_CACHE_TIMEOUT = 60 * 60 * 24
+
 # LOGIN
 LOGIN_URL = reverse_lazy('substitute_finder:login')
 
@@ -37,5 +37,7 @@ EMAIL_BACKEND = 'sendgrid_backend.SendgridBackend'
 
 SENDGRID_API_KEY = os.environ.get("SENDGRID_API_KEY")
 
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'fulltext')
+
 if os.environ.get('ADMIN'):
     ADMINS = os.environ.get('ADMIN').split(";")
@@ -48,5 +48,7 @@ DATABASES = {
     }
 }
 
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'fulltext')
+
 if os.environ.get('ADMIN'):
     ADMINS = os.environ.get('ADMIN').split(";")
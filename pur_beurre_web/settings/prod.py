@@ -41,5 +41,7 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'fulltext')
+
 if os.environ.get('ADMIN'):
     ADMINS = os.environ.get('ADMIN').split(";")
@@ -2,3 +2,10 @@ from . import *
 
 JSON_DIR_NAME = 'test_cached_json_files'
 JSON_DIR_PATH = os.path.join(BASE_DIR, JSON_DIR_NAME)
+
+# Tests enable cache when they need it: test database is reset between tests, not cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
@@ -13,3 +13,10 @@ DATABASES = {
         'PORT': '5432'
     }
 }
+
+# Tests enable cache when they need it: test database is reset between tests, not cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
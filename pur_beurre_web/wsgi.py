@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pur_beurre_web.settings")
 
 application = get_wsgi_application()
+
+# Build in memory search index at worker start instead of on first search
+from django.conf import settings  # noqa: E402
+
+if settings.SEARCH_ENGINE == 'inverted_index':
+    from substitute_finder.inverted_index import get_product_index  # noqa: E402
+
+    get_product_index()
@@ -5,7 +5,7 @@ substitute_finder admin
 from django.contrib import admin
 
 from substitute_finder.models import Comment
-from .models import Category, CustomUser, Product
+from .models import Catalogue, Category, CustomUser, ImportPage, ImportRun, Product
 
 
 # Register your models here.
@@ -37,13 +37,29 @@ class CategoryInline(admin.TabularInline):
     verbose_name_plural = 'Catégories'
 
 
+class NutritionGradeListFilter(admin.SimpleListFilter):
+    """
+    Nutrition grade filter whose choices are read from catalogue metadata instead of scanning products.
+    """
+    title = 'note nutritionnelle'
+    parameter_name = 'nutrition_grade_fr'
+
+    def lookups(self, request, model_admin):
+        return [(grade, grade.upper()) for grade in Catalogue.get_metadata()['nutrition_grades']]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(nutrition_grade_fr=self.value())
+        return queryset
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     """
     Product admin config.
     """
     search_fields = ['code', 'product_name', 'generic_name']
-    list_filter = ['nutrition_grade_fr', 'categories_tags']
+    list_filter = [NutritionGradeListFilter, 'categories_tags']
     inlines = [CustomUserInline, CategoryInline]
     exclude = ('users', 'categories_tags')
 
@@ -71,3 +87,48 @@ class CommentAdmin(admin.ModelAdmin):
     """
     list_display = ['user', 'product']
     search_fields = ['user__username', 'product__product_name']
+
+
+@admin.register(Catalogue)
+class CatalogueAdmin(admin.ModelAdmin):
+    """
+    Catalogue admin config, read only: catalogue is updated by api_to_db and compute_substitutes commands.
+    """
+    list_display = ['__str__', 'last_import', 'nb_products', 'nb_categories', 'nutrition_grades',
+                    'substitutes_updated']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ImportPageInline(admin.TabularInline):
+    """
+    Checkpointed pages for import runs inline admin config.
+    """
+    model = ImportPage
+    fields = ['page', 'status', 'nb_elements', 'duration', 'started', 'finished']
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ImportRun)
+class ImportRunAdmin(admin.ModelAdmin):
+    """
+    Import run admin config, read only: runs are checkpointed by api_to_db command.
+    """
+    list_display = ['__str__', 'status', 'started', 'finished']
+    list_filter = ['status']
+    inlines = [ImportPageInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,370 @@
+"""
+Caches of api data lists, read by imports run with --from_cache and used to send conditional requests.
+
+'json' format stores each page in its own file as the json list of its elements, with response validators and
+pagination data in a '.meta' file beside.
+'ndjson' format only stores fields read by imports, one element by line. All pages of a model are gzip members of a
+single file and an index file maps each page to the offset of its member and to its metadata. Both files are
+changed under a file lock, shared with other import processes.
+"""
+import fcntl
+import gzip
+import io
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .json_stream import iter_file_chunks, iter_json_list
+
+INDEX_LOCKS = {}
+INDEX_LOCKS_LOCK = threading.Lock()
+
+
+def get_index_lock(index_path: str):
+    """
+    Return lock of an ndjson cache index, shared by import threads.
+        :param index_path: index file path
+        :type index_path: str
+    """
+    with INDEX_LOCKS_LOCK:
+        if index_path not in INDEX_LOCKS:
+            INDEX_LOCKS[index_path] = threading.Lock()
+        return INDEX_LOCKS[index_path]
+
+
+class JsonListWriter:
+    """
+    Write elements of a data list into a json file as they are provided.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.nb_elements = 0
+        self.meta = {}
+        file.write('[')
+
+    def write(self, element: dict):
+        """
+        Write an element.
+        """
+        self.file.write('%s%s' % (', ' if self.nb_elements else '', json.dumps(element)))
+        self.nb_elements += 1
+
+
+class JsonListCache:
+    """
+    Cache each data list page of a model in its own json file.
+    """
+
+    def __init__(self, model):
+        """
+        :param model: model using FromApiUpdateMixin
+        """
+        self.model = model
+
+    def exists(self, custom_suffix: str = ''):
+        """
+        Return True if data list is cached.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        return os.path.exists(self.model.get_list_file_path(custom_suffix))
+
+    def get_meta(self, custom_suffix: str = ''):
+        """
+        Return response validators and pagination data of cached data list, an empty dict if they are unknown.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        file_path = self.model.get_list_file_path(custom_suffix)
+        meta_path = '%s.meta' % file_path
+        if not (os.path.exists(file_path) and os.path.exists(meta_path)):
+            return {}
+        with open(meta_path, 'r') as file:
+            return json.loads(file.read())
+
+    def iter_elements(self, custom_suffix: str = ''):
+        """
+        Yield elements of cached data list one at a time.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        with open(self.model.get_list_file_path(custom_suffix), 'r') as file:
+            yield from iter_json_list(iter_file_chunks(file))
+
+    @contextmanager
+    def writer(self, custom_suffix: str = ''):
+        """
+        Context manager giving a writer of data list elements. Cached data list and writer meta dict replace
+        previous ones when context is left without error.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        os.makedirs(settings.JSON_DIR_PATH, exist_ok=True)
+        file_path = self.model.get_list_file_path(custom_suffix)
+        temp_path = '%s.tmp' % file_path
+        try:
+            with open(temp_path, 'w') as file:
+                writer = JsonListWriter(file)
+                yield writer
+                file.write(']')
+            os.replace(temp_path, file_path)
+            with open('%s.meta' % file_path, 'w') as file:
+                file.write(json.dumps(writer.meta))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+class NdjsonListWriter:
+    """
+    Compress fields of data list elements read by imports into a gzip member, one element by line.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.buffer = io.BytesIO()
+        self.file = gzip.GzipFile(fileobj=self.buffer, mode='wb')
+        self.nb_elements = 0
+        self.meta = {}
+
+    def write(self, element: dict):
+        """
+        Write projected fields of an element.
+        """
+        self.file.write(json.dumps(self.model.project_data_element(element), separators=(',', ':')).encode('utf-8'))
+        self.file.write(b'\n')
+        self.nb_elements += 1
+
+    def get_member(self):
+        """
+        Return compressed elements.
+        """
+        self.file.close()
+        return self.buffer.getvalue()
+
+
+class NdjsonListCache:
+    """
+    Cache data list pages of a model in a single gzip file indexed by page.
+    A page written again is appended to data file, compact() drops replaced pages from it.
+    """
+
+    def __init__(self, model):
+        """
+        :param model: model using FromApiUpdateMixin
+        """
+        self.model = model
+        name = '%s_list' % model._meta.model_name
+        self.data_path = os.path.join(settings.JSON_DIR_PATH, '%s.ndjson.gz' % name)
+        self.index_path = os.path.join(settings.JSON_DIR_PATH, '%s.index.json' % name)
+        self.lock_path = os.path.join(settings.JSON_DIR_PATH, '%s.index.lock' % name)
+        self.lock = get_index_lock(self.index_path)
+
+    @contextmanager
+    def locked(self):
+        """
+        Context manager holding index lock of import threads, then an exclusive lock on lock file for other import
+        processes (index and data files are replaced, so they can't be locked themselves).
+        """
+        with self.lock:
+            os.makedirs(settings.JSON_DIR_PATH, exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_index(self):
+        """
+        Return index of cached pages: a dict of offset, length, nb_elements and meta by page.
+        """
+        if not (os.path.exists(self.index_path) and os.path.exists(self.data_path)):
+            return {}
+        with open(self.index_path, 'r') as file:
+            return json.loads(file.read())
+
+    def write_index(self, index: dict):
+        """
+        Replace index of cached pages.
+        """
+        temp_path = '%s.tmp' % self.index_path
+        with open(temp_path, 'w') as file:
+            file.write(json.dumps(index, sort_keys=True))
+        os.replace(temp_path, self.index_path)
+
+    def get_entry(self, custom_suffix: str = ''):
+        """
+        Return index entry of a page, None if page isn't cached.
+        """
+        with self.locked():
+            return self.read_index().get(str(custom_suffix))
+
+    def exists(self, custom_suffix: str = ''):
+        """
+        Return True if data list is cached.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        return self.get_entry(custom_suffix) is not None
+
+    def get_meta(self, custom_suffix: str = ''):
+        """
+        Return response validators and pagination data of cached data list, an empty dict if they are unknown.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        entry = self.get_entry(custom_suffix)
+        return dict(entry['meta']) if entry else {}
+
+    def read_member(self, entry: dict):
+        """
+        Return compressed elements of an index entry.
+        """
+        with open(self.data_path, 'rb') as file:
+            file.seek(entry['offset'])
+            return file.read(entry['length'])
+
+    def iter_elements(self, custom_suffix: str = ''):
+        """
+        Yield projected elements of cached data list one at a time, only its gzip member is read.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        with self.locked():
+            member = self.read_member(self.read_index()[str(custom_suffix)])
+        with gzip.GzipFile(fileobj=io.BytesIO(member), mode='rb') as file:
+            for line in file:
+                yield json.loads(line.decode('utf-8'))
+
+    def append(self, custom_suffix: str, member: bytes, nb_elements: int, meta: dict):
+        """
+        Append a compressed page to data file and index it.
+        """
+        with self.locked():
+            index = self.read_index()
+            if not index and os.path.exists(self.data_path):
+                os.remove(self.data_path)
+            with open(self.data_path, 'ab') as file:
+                offset = file.seek(0, os.SEEK_END)
+                file.write(member)
+            index[str(custom_suffix)] = {'offset': offset, 'length': len(member), 'nb_elements': nb_elements,
+                                         'meta': meta}
+            self.write_index(index)
+
+    @contextmanager
+    def writer(self, custom_suffix: str = ''):
+        """
+        Context manager giving a writer of data list elements. Cached data list and writer meta dict replace
+        previous ones when context is left without error.
+            :param custom_suffix: page number for paginated data list
+            :type custom_suffix: str
+        """
+        os.makedirs(settings.JSON_DIR_PATH, exist_ok=True)
+        writer = NdjsonListWriter(self.model)
+        yield writer
+        self.append(custom_suffix, writer.get_member(), writer.nb_elements, writer.meta)
+
+    def compact(self):
+        """
+        Rewrite data file without replaced pages. Return data file size.
+        """
+        with self.locked():
+            index = self.read_index()
+            temp_path = '%s.tmp' % self.data_path
+            with open(temp_path, 'wb') as file:
+                for page in sorted(index, key=lambda page: index[page]['offset']):
+                    member = self.read_member(index[page])
+                    index[page]['offset'] = file.tell()
+                    file.write(member)
+            os.replace(temp_path, self.data_path)
+            self.write_index(index)
+            return os.path.getsize(self.data_path)
+
+    def get_dead_size(self):
+        """
+        Return size of data file taken by replaced pages.
+        """
+        with self.locked():
+            index = self.read_index()
+            if not index:
+                return 0
+            return os.path.getsize(self.data_path) - sum(entry['length'] for entry in index.values())
+
+
+def convert_json_cache(model, delete: bool = False):
+    """
+    Copy json cache pages of a model into its ndjson cache. Return number of converted pages, size of json files
+    and size of ndjson data file.
+        :param model: model using FromApiUpdateMixin
+        :param delete: if True, json files are deleted once converted
+        :type delete: bool
+    """
+    json_cache = JsonListCache(model)
+    ndjson_cache = NdjsonListCache(model)
+    file_name_regex = re.compile(r'^%s_list(?:_(\w+))?\.json$' % model._meta.model_name)
+    file_names = os.listdir(settings.JSON_DIR_PATH) if os.path.exists(settings.JSON_DIR_PATH) else []
+
+    nb_pages = 0
+    json_size = 0
+    for file_name in sorted(file_names):
+        match = file_name_regex.match(file_name)
+        if not match:
+            continue
+        custom_suffix = match.group(1) or ''
+        file_path = os.path.join(settings.JSON_DIR_PATH, file_name)
+        with ndjson_cache.writer(custom_suffix) as writer:
+            for element in json_cache.iter_elements(custom_suffix):
+                writer.write(element)
+            writer.meta = json_cache.get_meta(custom_suffix)
+
+        nb_pages += 1
+        json_size += os.path.getsize(file_path)
+        if delete:
+            os.remove(file_path)
+            if os.path.exists('%s.meta' % file_path):
+                os.remove('%s.meta' % file_path)
+
+    ndjson_size = ndjson_cache.compact() if nb_pages else 0
+    return nb_pages, json_size, ndjson_size
+
+
+def compact_list_cache(model, max_dead_ratio: float = None):
+    """
+    Compact ndjson cache of a model once replaced pages take more than max_dead_ratio of its data file. Return
+    number of freed bytes.
+        :param model: model using FromApiUpdateMixin
+        :param max_dead_ratio: API_CACHE_MAX_DEAD_RATIO setting by default
+        :type max_dead_ratio: float
+    """
+    if settings.API_CACHE_FORMAT != 'ndjson':
+        return 0
+    if max_dead_ratio is None:
+        max_dead_ratio = settings.API_CACHE_MAX_DEAD_RATIO
+    cache = NdjsonListCache(model)
+    dead_size = cache.get_dead_size()
+    size = os.path.getsize(cache.data_path) if dead_size else 0
+    if not dead_size or dead_size <= max_dead_ratio * size:
+        return 0
+    return size - cache.compact()
+
+
+CACHE_FORMATS = {
+    'json': JsonListCache,
+    'ndjson': NdjsonListCache,
+}
+
+
+def get_list_cache(model, cache_format: str = None):
+    """
+    Return data list cache of a model.
+        :param model: model using FromApiUpdateMixin
+        :param cache_format: 'json' or 'ndjson', API_CACHE_FORMAT setting by default
+        :type cache_format: str
+    """
+    return CACHE_FORMATS[cache_format or settings.API_CACHE_FORMAT](model)
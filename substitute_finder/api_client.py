@@ -0,0 +1,132 @@
+"""
+Http client used to get data from Open Food Facts api, shared by import threads.
+A single session keeps connections alive, retries failed requests with backoff and sends conditional requests.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'PurBeurre - Web - https://github.com/tomlemeuch/pur_beurre_web'
+
+
+class RateLimiter:
+    """
+    Space out requests sent to a host so that there are at most max_per_second requests started each second.
+    Thread safe: concurrent callers are given successive time slots.
+    """
+
+    def __init__(self, max_per_second: float):
+        self.interval = 1 / max_per_second if max_per_second else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until a request can be sent.
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+# Number of import processes sharing API_MAX_REQUESTS_PER_SECOND
+NB_PROCESSES = 1
+
+
+def get_rate_limiter(url: str):
+    """
+    Return rate limiter of url host, limited by API_MAX_REQUESTS_PER_SECOND setting shared by import processes.
+        :param url: requested url
+        :type url: str
+    """
+    host = urlsplit(url).netloc
+    with RATE_LIMITERS_LOCK:
+        if host not in RATE_LIMITERS:
+            RATE_LIMITERS[host] = RateLimiter(settings.API_MAX_REQUESTS_PER_SECOND / NB_PROCESSES)
+        return RATE_LIMITERS[host]
+
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """
+    Return http session shared by import threads, with a connection pool sized for API_CONCURRENCY threads
+    and API_MAX_RETRIES retries of connection errors and server errors.
+    """
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            retry = Retry(total=settings.API_MAX_RETRIES, backoff_factor=settings.API_RETRY_BACKOFF,
+                          status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+            adapter = HTTPAdapter(pool_maxsize=max(settings.API_CONCURRENCY, 10), max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'})
+            SESSION = session
+        return SESSION
+
+
+def init_process(nb_processes: int = 1):
+    """
+    Reset http client in a forked import process: session and rate limiters inherited from parent process are
+    dropped, so that its connections aren't shared, and hosts rate limits are shared by nb_processes processes.
+        :param nb_processes: number of import processes sending requests at the same time
+        :type nb_processes: int
+    """
+    global SESSION, NB_PROCESSES
+    with SESSION_LOCK:
+        SESSION = None
+    with RATE_LIMITERS_LOCK:
+        RATE_LIMITERS.clear()
+        NB_PROCESSES = nb_processes
+
+
+def get(url: str, etag: str = None, last_modified: str = None, stream: bool = False):
+    """
+    Request url once its host rate limit allows it and return response, raise HTTPError on error status.
+    With etag or last_modified validators of a previous response, response status is 304 if data didn't change.
+        :param url: requested url
+        :type url: str
+        :param etag: ETag header of previous response
+        :type etag: str
+        :param last_modified: Last-Modified header of previous response
+        :type last_modified: str
+        :param stream: if True, response body is downloaded while it's read, response must be closed after
+        :type stream: bool
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    get_rate_limiter(url).wait()
+    response = get_session().get(url, headers=headers, timeout=settings.API_TIMEOUT, stream=stream)
+    if response.status_code >= 400:
+        response.close()
+    response.raise_for_status()
+    return response
+
+
+def get_json(url: str):
+    """
+    Request url and return decoded json response.
+        :param url: requested url
+        :type url: str
+    """
+    return get(url).json()
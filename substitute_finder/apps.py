@@ -1,6 +1,11 @@
 # pylint: skip-file
 from django.apps import AppConfig
+from django.db.models import CharField
 
 
 class SubstituteFinderConfig(AppConfig):
     name = 'substitute_finder'
+
+    def ready(self):
+        from .lookups import TrigramWordSimilar
+        CharField.register_lookup(TrigramWordSimilar)
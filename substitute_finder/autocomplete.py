@@ -0,0 +1,270 @@
+"""
+Product names auto completion: suggestions are products names n-grams weighted by their frequency.
+
+Suggestions are stored in a file, sorted so that a prefix can be found with a binary search,
+and read by workers through mmap:
+    - header: magic, number of suggestions, number of cached prefixes, max length of cached prefixes
+    - suggestions offsets then cached prefixes offsets (uint32)
+    - suggestion records: frequency (uint32), length (uint16), utf-8 text
+    - cached prefix records: length (uint16), number of suggestions (uint16), utf-8 prefix, suggestion indexes (uint32)
+Best suggestions of short prefixes (AUTOCOMPLETE_PREFIX_CACHE_LENGTH chars or less), which match a lot of
+suggestions, are precomputed. Longer prefixes match few suggestions which are ranked at request time.
+"""
+import heapq
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from django.conf import settings
+
+from .helpers import clear_text, get_top_ngrams, iter_corpus
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'PBAC0002'
+HEADER = struct.Struct('<8sIII')
+OFFSET = struct.Struct('<I')
+SUGGESTION = struct.Struct('<IH')
+PREFIX = struct.Struct('<HH')
+# Max number of suggestions kept for a cached prefix
+MAX_PREFIX_SUGGESTIONS = 0xffff
+
+
+def clean_prefix(text: str):
+    """
+    Clean typed text to compare it to suggestions.
+    """
+    return ' '.join(clear_text(text).split())
+
+
+def count_suggestions(corpus, max_words: int, max_suggestions: int):
+    """
+    Get frequency of the most frequent n-grams of corpus, from unigrams to max_words-grams.
+        :param corpus: iterable of cleaned products names
+        :param max_words: max number of words in a suggestion
+        :type max_words: int
+        :param max_suggestions: max number of suggestions
+        :type max_suggestions: int
+    """
+    return dict(get_top_ngrams(corpus, max_words, max_suggestions))
+
+
+def get_prefixes_suggestions(encoded: list, nb_best: int, prefix_cache_length: int):
+    """
+    Return sorted (prefix, best suggestions indexes) of short prefixes.
+        :param encoded: sorted (utf-8 text, frequency) of suggestions
+        :type encoded: list
+        :param nb_best: number of suggestions kept for cached prefixes, MAX_PREFIX_SUGGESTIONS at most
+        :type nb_best: int
+        :param prefix_cache_length: max length of cached prefixes
+        :type prefix_cache_length: int
+    """
+    if nb_best > MAX_PREFIX_SUGGESTIONS:
+        raise ValueError("%s suggestions can't be kept for a prefix, max is %s" % (nb_best, MAX_PREFIX_SUGGESTIONS))
+    best_suggestions = {}
+    for index in sorted(range(len(encoded)), key=lambda i: (-encoded[i][1], encoded[i][0])):
+        text = encoded[index][0].decode('utf-8')
+        for length in range(1, min(len(text), prefix_cache_length) + 1):
+            best = best_suggestions.setdefault(text[:length].encode('utf-8'), [])
+            if len(best) < nb_best:
+                best.append(index)
+    return sorted(best_suggestions.items())
+
+
+def write_autocomplete_file(file_path: str, suggestions: dict, nb_best: int, prefix_cache_length: int):
+    """
+    Write suggestions file. The file is replaced atomically so that workers never read a partial file.
+        :param file_path: path of written file
+        :type file_path: str
+        :param suggestions: dict of suggestion: frequency
+        :type suggestions: dict
+        :param nb_best: number of suggestions kept for cached prefixes, MAX_PREFIX_SUGGESTIONS at most
+        :type nb_best: int
+        :param prefix_cache_length: max length of cached prefixes
+        :type prefix_cache_length: int
+    """
+    encoded = sorted((text.encode('utf-8'), frequency) for text, frequency in suggestions.items())
+    prefixes = get_prefixes_suggestions(encoded, nb_best, prefix_cache_length)
+
+    def iter_records():
+        for text, frequency in encoded:
+            yield SUGGESTION.pack(frequency, len(text)) + text
+        for prefix, indexes in prefixes:
+            yield PREFIX.pack(len(prefix), len(indexes)) + prefix + struct.pack('<%sI' % len(indexes), *indexes)
+
+    directory = os.path.dirname(file_path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    # mkstemp creates a file only readable by its owner, workers may run as another user
+    os.chmod(temp_path, 0o644)
+    with os.fdopen(file_descriptor, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(encoded), len(prefixes), prefix_cache_length))
+
+        # offsets are computed from records sizes, then records are written one by one
+        offset = HEADER.size + OFFSET.size * (len(encoded) + len(prefixes))
+        for record in iter_records():
+            file.write(OFFSET.pack(offset))
+            offset += len(record)
+        for record in iter_records():
+            file.write(record)
+    os.replace(temp_path, file_path)
+    return file_path
+
+
+def build_autocomplete_file(file_path: str = None):
+    """
+    Compute suggestions from products names and write them into suggestions file.
+        :param file_path: path of written file, AUTOCOMPLETE_INDEX_PATH setting by default
+        :type file_path: str
+    """
+    file_path = file_path or settings.AUTOCOMPLETE_INDEX_PATH
+    start = time.perf_counter()
+    suggestions = count_suggestions(iter_corpus(), settings.AUTOCOMPLETE_MAX_WORDS,
+                                    settings.AUTOCOMPLETE_MAX_STORED_SUGGESTIONS)
+    write_autocomplete_file(file_path, suggestions, settings.AUTOCOMPLETE_MAX_SUGGESTIONS,
+                            settings.AUTOCOMPLETE_PREFIX_CACHE_LENGTH)
+    LOGGER.info("AUTOCOMPLETE %s suggestions written in %s in %.3fs", len(suggestions), file_path,
+                time.perf_counter() - start)
+    return file_path
+
+
+class AutocompleteIndex:
+    """
+    Read only access to a suggestions file through mmap.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            self.mtime = os.fstat(file.fileno()).st_mtime_ns
+            if os.fstat(file.fileno()).st_size < HEADER.size or file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not an autocomplete file of this version" % file_path)
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self.nb_suggestions, self.nb_prefixes, self.prefix_cache_length = HEADER.unpack_from(self.data, 0)
+
+    def _offset(self, index: int):
+        return OFFSET.unpack_from(self.data, HEADER.size + OFFSET.size * index)[0]
+
+    def suggestion(self, index: int):
+        """
+        Return (text, frequency) of suggestion at index.
+        """
+        offset = self._offset(index)
+        frequency, length = SUGGESTION.unpack_from(self.data, offset)
+        start = offset + SUGGESTION.size
+        return self.data[start:start + length].decode('utf-8'), frequency
+
+    def _suggestion_text(self, index: int):
+        offset = self._offset(index)
+        _, length = SUGGESTION.unpack_from(self.data, offset)
+        start = offset + SUGGESTION.size
+        return self.data[start:start + length]
+
+    def _prefix_text(self, index: int):
+        offset = self._offset(self.nb_suggestions + index)
+        length, _ = PREFIX.unpack_from(self.data, offset)
+        start = offset + PREFIX.size
+        return self.data[start:start + length]
+
+    def _prefix_suggestions(self, index: int):
+        offset = self._offset(self.nb_suggestions + index)
+        length, nb_indexes = PREFIX.unpack_from(self.data, offset)
+        return struct.unpack_from('<%sI' % nb_indexes, self.data, offset + PREFIX.size + length)
+
+    @staticmethod
+    def _bisect_left(get_text, size: int, searched: bytes):
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            if get_text(middle) < searched:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def suggest(self, text: str, limit: int):
+        """
+        Return most frequent suggestions starting with text as (text, frequency) tuples.
+            :param text: typed text
+            :type text: str
+            :param limit: max number of suggestions
+            :type limit: int
+        """
+        prefix = clean_prefix(text).encode('utf-8')
+        if not prefix:
+            return []
+
+        # short prefix: precomputed suggestions
+        index = self._bisect_left(self._prefix_text, self.nb_prefixes, prefix)
+        if index < self.nb_prefixes and self._prefix_text(index) == prefix:
+            return [self.suggestion(i) for i in self._prefix_suggestions(index)[:limit]]
+        if len(prefix.decode('utf-8')) <= self.prefix_cache_length:
+            return []
+
+        # long prefix: suggestions range, utf-8 never contains byte 0xff
+        low = self._bisect_left(self._suggestion_text, self.nb_suggestions, prefix)
+        high = self._bisect_left(self._suggestion_text, self.nb_suggestions, prefix + b'\xff')
+        suggestions = (self.suggestion(i) for i in range(low, high))
+        return heapq.nsmallest(limit, suggestions, key=lambda suggestion: (-suggestion[1], suggestion[0]))
+
+    def close(self):
+        """
+        Close mmap.
+        """
+        self.data.close()
+
+
+LOADED_INDEXES = {}
+MISSING_INDEXES = set()
+# mtime of files which aren't autocomplete files, by path
+INVALID_INDEXES = {}
+
+
+def get_autocomplete_index():
+    """
+    Return the worker autocomplete index, reloaded when its file changes. Return None while file hasn't been built
+    by build_autocomplete_index command: building it would scan all products during a request.
+    A replaced index isn't closed, threads may still read it: its mmap is closed once it's garbage collected.
+    """
+    file_path = settings.AUTOCOMPLETE_INDEX_PATH
+    if not os.path.exists(file_path):
+        if file_path not in MISSING_INDEXES:
+            MISSING_INDEXES.add(file_path)
+            LOGGER.warning("AUTOCOMPLETE %s doesn't exist, no suggestion is served until build_autocomplete_index "
+                           "command is run", file_path)
+        return None
+    MISSING_INDEXES.discard(file_path)
+
+    index = LOADED_INDEXES.get(file_path)
+    mtime = os.stat(file_path).st_mtime_ns
+    if index is None or index.mtime != mtime:
+        if INVALID_INDEXES.get(file_path) == mtime:
+            return None
+        try:
+            index = AutocompleteIndex(file_path)
+        except ValueError as error:
+            INVALID_INDEXES[file_path] = mtime
+            LOGGER.warning("AUTOCOMPLETE %s, no suggestion is served until build_autocomplete_index command is run",
+                           error)
+            return None
+        LOADED_INDEXES[file_path] = index
+    return index
+
+
+def autocomplete(text: str, limit: int = None):
+    """
+    Return most frequent products names n-grams starting with text.
+        :param text: typed text
+        :type text: str
+        :param limit: max number of suggestions, AUTOCOMPLETE_MAX_SUGGESTIONS setting by default
+        :type limit: int
+    """
+    limit = max(1, min(limit or settings.AUTOCOMPLETE_MAX_SUGGESTIONS, settings.AUTOCOMPLETE_MAX_SUGGESTIONS))
+    index = get_autocomplete_index()
+    if index is None:
+        return []
+    return index.suggest(text, limit)
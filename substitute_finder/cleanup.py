@@ -0,0 +1,280 @@
+"""
+Set-based cleanup of products and categories: rows to delete are selected by SQL, by batches of primary keys in
+primary key order (keyset pagination), then deleted with rows referencing them without loading any instance.
+Favorite and commented products are never deleted.
+A dry run only counts rows to delete: keys of rows which previous steps would delete are kept in temporary tables,
+so that following steps read tables without them, and no row of the database is written or locked.
+"""
+import logging
+import time
+
+from django.db import connection, transaction
+
+from .models import Category, Comment, Product
+
+LOGGER = logging.getLogger(__name__)
+
+SELECT_KEYS_SQL = """
+SELECT t.{pk} FROM {table} t
+WHERE ({condition}){after_key}
+ORDER BY t.{pk}
+LIMIT %s
+"""
+
+DELETE_SQL = "DELETE FROM {table} WHERE {column} IN ({placeholders})"
+
+COUNT_SQL = "SELECT count(*) FROM {source} t WHERE {condition}"
+
+DRY_RUN_TABLE = 'cleanup_dry_run_{table}'
+
+
+def quote(name: str):
+    """
+    Return quoted table or column name.
+    """
+    return connection.ops.quote_name(name)
+
+
+def get_source(table: str, sources: dict = None):
+    """
+    Return SQL source of table rows in a condition: the quoted table, or a subquery given by sources.
+        :param table: table name
+        :type table: str
+        :param sources: SQL sources by table name, see get_dry_run_sources
+        :type sources: dict
+    """
+    return (sources or {}).get(table, quote(table))
+
+
+def get_referencing_columns(model):
+    """
+    Return (table, column) pairs of rows referencing model rows: many to many tables first, then foreign keys.
+        :param model: deleted rows model
+    """
+    columns = [(field.remote_field.through._meta.db_table, field.m2m_column_name())
+               for field in model._meta.many_to_many]
+    for relation in model._meta.related_objects:
+        if relation.many_to_many:
+            columns.insert(0, (relation.through._meta.db_table, relation.field.m2m_reverse_name()))
+        else:
+            columns.append((relation.related_model._meta.db_table, relation.field.column))
+    return columns
+
+
+def get_protected_product_condition(sources: dict = None):
+    """
+    Return SQL condition on products table (aliased t) true for products which can be deleted:
+    products neither favorite nor commented.
+        :param sources: SQL sources by table name, see get_source
+        :type sources: dict
+    """
+    users_field = Product._meta.get_field('users')
+    return ("NOT EXISTS (SELECT 1 FROM {users} u WHERE u.{users_product} = t.{pk}) "
+            "AND NOT EXISTS (SELECT 1 FROM {comment} c WHERE c.{comment_product} = t.{pk})").format(
+                users=get_source(users_field.remote_field.through._meta.db_table, sources),
+                users_product=quote(users_field.m2m_column_name()),
+                comment=get_source(Comment._meta.db_table, sources),
+                comment_product=quote(Comment._meta.get_field('product').column),
+                pk=quote(Product._meta.pk.column))
+
+
+def get_categories_condition(model, exists: bool = True, sources: dict = None):
+    """
+    Return SQL condition on model table (aliased t) true for rows with (or without) a product category link.
+        :param model: Product or Category
+        :param exists: if False, condition is true for rows without any link
+        :type exists: bool
+        :param sources: SQL sources by table name, see get_source
+        :type sources: dict
+    """
+    field = Product._meta.get_field('categories_tags')
+    column = field.m2m_column_name() if model is Product else field.m2m_reverse_name()
+    return "{not_}EXISTS (SELECT 1 FROM {through} pc WHERE pc.{column} = t.{pk})".format(
+        not_='' if exists else 'NOT ', through=get_source(field.remote_field.through._meta.db_table, sources),
+        column=quote(column), pk=quote(model._meta.pk.column))
+
+
+def get_single_product_categories_condition(sources: dict = None):
+    """
+    Return SQL condition on categories table (aliased t) true for categories of less than two products.
+        :param sources: SQL sources by table name, see get_source
+        :type sources: dict
+    """
+    field = Product._meta.get_field('categories_tags')
+    return ("NOT EXISTS (SELECT 1 FROM {through} pc1 INNER JOIN {through} pc2 "
+            "ON pc2.{category} = pc1.{category} AND pc2.{product} <> pc1.{product} "
+            "WHERE pc1.{category} = t.{pk})").format(
+                through=get_source(field.remote_field.through._meta.db_table, sources),
+                category=quote(field.m2m_reverse_name()), product=quote(field.m2m_column_name()),
+                pk=quote(Category._meta.pk.column))
+
+
+def get_incomplete_products_condition(sources: dict = None):  # pylint: disable=unused-argument
+    """
+    Return SQL condition on products table (aliased t) true for products with an empty strict required field:
+    NULL, or an empty string for text fields.
+        :param sources: unused, conditions of steps take SQL sources
+        :type sources: dict
+    """
+    fields = [Product._meta.get_field(name) for name in dict.fromkeys(Product.strict_required_field)]
+    return ' OR '.join(("t.{0} IS NULL OR t.{0} = ''" if field.get_internal_type() in ('CharField', 'TextField')
+                        else "t.{0} IS NULL").format(quote(field.column)) for field in fields)
+
+
+def delete_rows(model, condition: str, params: list = None, batch_size: int = 500, tables: list = None):
+    """
+    Delete model rows matching an SQL condition by batches of primary keys, rows referencing them being deleted
+    first. Each batch is deleted in its own transaction. Return number of deleted rows.
+        :param model: Product or Category
+        :param condition: SQL condition on model table aliased t
+        :type condition: str
+        :param params: condition parameters
+        :type params: list
+        :param batch_size: number of rows deleted by each query
+        :type batch_size: int
+        :param tables: if given, referencing rows are only deleted from these tables
+        :type tables: list
+    """
+    pk = quote(model._meta.pk.column)
+    referencing_columns = [(table, column) for table, column in get_referencing_columns(model)
+                           if tables is None or table in tables]
+    nb_rows = 0
+    last_key = None
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            after_key = '' if last_key is None else ' AND t.%s > %%s' % pk
+            sql = SELECT_KEYS_SQL.format(pk=pk, table=quote(model._meta.db_table), condition=condition,
+                                         after_key=after_key)
+            cursor.execute(sql, list(params or []) + ([] if last_key is None else [last_key]) + [batch_size])
+            keys = [row[0] for row in cursor.fetchall()]
+            if not keys:
+                return nb_rows
+
+            placeholders = ', '.join(['%s'] * len(keys))
+            for table, column in referencing_columns:
+                cursor.execute(DELETE_SQL.format(table=quote(table), column=quote(column),
+                                                 placeholders=placeholders), keys)
+            cursor.execute(DELETE_SQL.format(table=quote(model._meta.db_table), column=pk,
+                                             placeholders=placeholders), keys)
+        nb_rows += len(keys)
+        last_key = keys[-1]
+
+
+def get_dry_run_sources(models: list):
+    """
+    Return SQL sources by table name of rows kept by a cleanup whose deleted rows keys are in dry run tables:
+    rows of models not deleted, and rows not referencing deleted ones.
+        :param models: models whose deleted rows keys are in dry run tables
+        :type models: list
+    """
+    conditions = {}
+    for model in models:
+        dry_run_table = quote(DRY_RUN_TABLE.format(table=model._meta.db_table))
+        columns = [(model._meta.db_table, model._meta.pk.column)] + get_referencing_columns(model)
+        for table, column in columns:
+            conditions.setdefault(table, []).append(
+                'NOT EXISTS (SELECT 1 FROM %s d WHERE d.pk = s.%s)' % (dry_run_table, quote(column)))
+    return {table: '(SELECT * FROM %s s WHERE %s)' % (quote(table), ' AND '.join(table_conditions))
+            for table, table_conditions in conditions.items()}
+
+
+def count_steps(steps: list):
+    """
+    Count rows deletion steps would delete, without deleting anything, and return them by step name.
+        :param steps: list of (step name, model, SQL condition builder) tuples, see run_steps
+        :type steps: list
+    """
+    models = list(dict.fromkeys(model for _, model, _ in steps))
+    sources = get_dry_run_sources(models)
+    counts = {}
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute('CREATE TEMPORARY TABLE %s (pk %s)' % (
+                quote(DRY_RUN_TABLE.format(table=model._meta.db_table)), model._meta.pk.db_type(connection)))
+        try:
+            for index, (name, model, get_condition) in enumerate(steps):
+                start = time.perf_counter()
+                condition = get_condition(sources)
+                source = sources[model._meta.db_table]
+                cursor.execute(COUNT_SQL.format(source=source, condition=condition))
+                counts[name] = cursor.fetchone()[0]
+                if index < len(steps) - 1:
+                    cursor.execute('INSERT INTO {dry_run_table} (pk) SELECT t.{pk} FROM {source} t WHERE {condition}'
+                                   .format(dry_run_table=quote(DRY_RUN_TABLE.format(table=model._meta.db_table)),
+                                           pk=quote(model._meta.pk.column), source=source, condition=condition))
+                LOGGER.info("CLEANUP DRY RUN %s: %s rows in %.3fs", name, counts[name], time.perf_counter() - start)
+        finally:
+            for model in models:
+                cursor.execute('DROP TABLE %s' % quote(DRY_RUN_TABLE.format(table=model._meta.db_table)))
+    return counts
+
+
+def run_steps(steps: list, dry_run: bool = False, batch_size: int = 500, tables: list = None):
+    """
+    Run deletion steps in order and return number of deleted rows by step name.
+        :param steps: list of (step name, model, SQL condition builder) tuples, a builder returning the SQL condition
+        on model table from SQL sources of tables (see get_source)
+        :type steps: list
+        :param dry_run: if True, nothing is deleted: only numbers of rows to delete are computed, see count_steps
+        :type dry_run: bool
+        :param batch_size: number of rows deleted by each query
+        :type batch_size: int
+        :param tables: if given, referencing rows are only deleted from these tables, see delete_rows
+        :type tables: list
+    """
+    if dry_run:
+        return count_steps(steps)
+    counts = {}
+    for name, model, get_condition in steps:
+        start = time.perf_counter()
+        counts[name] = delete_rows(model, get_condition(None), batch_size=batch_size, tables=tables)
+        LOGGER.info("CLEANUP %s: %s rows in %.3fs", name, counts[name], time.perf_counter() - start)
+    return counts
+
+
+def database_cleanup(grumpy_mode: bool = False, dry_run: bool = False, batch_size: int = 500, tables: list = None):
+    """
+    Delete products without nutrition grade (or with any missing strict required field in grumpy mode),
+    then categories of less than two products, then products left without category.
+    Return number of deleted rows by step.
+        :param grumpy_mode: delete products with a missing strict required field
+        :type grumpy_mode: bool
+        :param dry_run: if True, nothing is deleted, numbers of rows to delete are returned
+        :type dry_run: bool
+        :param batch_size: number of rows deleted by each query
+        :type batch_size: int
+        :param tables: if given, referencing rows are only deleted from these tables, see delete_rows
+        :type tables: list
+    """
+    grade_column = quote(Product._meta.get_field('nutrition_grade_fr').column)
+    steps = []
+    if grumpy_mode:
+        steps.append(('incomplete products', Product, lambda sources: '(%s) AND %s' % (
+            get_incomplete_products_condition(sources), get_protected_product_condition(sources))))
+    steps += [
+        ('products without nutrition grade', Product, lambda sources: "t.%s = '' AND %s" % (
+            grade_column, get_protected_product_condition(sources))),
+        ('categories of less than two products', Category, get_single_product_categories_condition),
+        ('products without category', Product, lambda sources: '%s AND %s' % (
+            get_categories_condition(Product, exists=False, sources=sources),
+            get_protected_product_condition(sources))),
+    ]
+    return run_steps(steps, dry_run=dry_run, batch_size=batch_size, tables=tables)
+
+
+def hard_reset(dry_run: bool = False, batch_size: int = 500, tables: list = None):
+    """
+    Delete products neither favorite nor commented, then categories without product.
+    Return number of deleted rows by step.
+        :param dry_run: if True, nothing is deleted, numbers of rows to delete are returned
+        :type dry_run: bool
+        :param batch_size: number of rows deleted by each query
+        :type batch_size: int
+        :param tables: if given, referencing rows are only deleted from these tables, see delete_rows
+        :type tables: list
+    """
+    return run_steps([
+        ('products', Product, get_protected_product_condition),
+        ('categories without product', Category,
+         lambda sources: get_categories_condition(Category, exists=False, sources=sources)),
+    ], dry_run=dry_run, batch_size=batch_size, tables=tables)
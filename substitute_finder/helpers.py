@@ -5,15 +5,31 @@ Helpers module for product search, auto completion
 from itertools import zip_longest
 
 import collections
-from django.db.models import Q
-from pprint import pprint
-
-from .models import Product
+import hashlib
+import heapq
+import logging
+import re
+from array import array
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, FloatField, Func, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .inverted_index import get_product_index
+from .models import Catalogue, Product, SearchResult, SearchResultProduct
+
+LOGGER = logging.getLogger(__name__)
 
 # Product search helpers
 
 STOP_WORDS = ['de', 'à', 'le', 'la', 'aux']
 
+# PostgreSQL text search configuration created by migration 0013
+SEARCH_CONFIG = 'pur_beurre'
+
 
 def clean_search_result(result_list: list):
     """
@@ -41,9 +57,10 @@ def remove_none(list_to_clean: list):
     return [value for value in list_to_clean if value is not None]
 
 
-def search_product(terms: str):
+def search_product_icontains(terms: str):
     """
-    Use provided terms to return a list of product with relevancy weigth
+    Use provided terms to return a list of product with relevancy weigth.
+    Works on any database but runs two queries per terms combination.
         :param terms: searched terms in products table
         :type terms: str
     """
@@ -92,6 +109,284 @@ def search_product(terms: str):
     return sorted_result
 
 
+class FunctionSearchQuery(SearchQuery):
+    """
+    SearchQuery whose text is parsed by function, a PostgreSQL function returning a tsquery from a text search
+    configuration and a query text.
+    """
+    function = 'plainto_tsquery'
+
+    def get_query_text(self):
+        """
+        Return text given to function.
+        """
+        return self.value
+
+    def as_sql(self, compiler, connection):
+        params = [self.get_query_text()]
+        if self.config:
+            config_sql, config_params = compiler.compile(self.config)
+            template = '%s(%s::regconfig, %%s)' % (self.function, config_sql)
+            params = config_params + params
+        else:
+            template = '%s(%%s)' % self.function
+        if self.invert:
+            template = '!!(%s)' % template
+        return template, params
+
+
+class PhraseSearchQuery(FunctionSearchQuery):
+    """
+    SearchQuery matching terms as a phrase (words in the same order, side by side). Requires PostgreSQL 9.6.
+    """
+    function = 'phraseto_tsquery'
+
+
+class PrefixSearchQuery(FunctionSearchQuery):
+    """
+    SearchQuery matching words starting with provided word, like icontains does for "coca" in "cocacola".
+    """
+    function = 'to_tsquery'
+
+    def get_query_text(self):
+        return ' & '.join('%s:*' % token for token in re.findall(r'\w+', self.value))
+
+
+def search_product_fulltext(terms: str):
+    """
+    Use provided terms to return a list of product with relevancy weigth in a single indexed query.
+    Weights follow search_product_icontains: exact phrase gets 2 x nb of terms,
+    otherwise 2 x nb of matching terms - 1. Requires PostgreSQL.
+        :param terms: searched terms in products table
+        :type terms: str
+    """
+    words = [word for word in terms.split(' ') if re.search(r'\w', word) and word.lower() not in STOP_WORDS]
+
+    if not words:
+        return []
+
+    word_queries = [PrefixSearchQuery(word, config=SEARCH_CONFIG) for word in words]
+
+    any_word_query = word_queries[0]
+    for word_query in word_queries[1:]:
+        any_word_query = any_word_query | word_query
+
+    # count matching words in database
+    matching_words = Value(0, output_field=IntegerField())
+    for word_query in word_queries:
+        matching_words = matching_words + Case(
+            When(search_vector=word_query, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()
+        )
+
+    products = Product.objects.filter(search_vector=any_word_query).exclude(nutrition_grade_fr='').annotate(
+        weigth=Case(
+            When(search_vector=PhraseSearchQuery(terms, config=SEARCH_CONFIG), then=Value(len(terms.split()) * 2)),
+            default=matching_words * 2 - 1,
+            output_field=IntegerField()
+        ),
+        rank=SearchRank(F('search_vector'), any_word_query)
+    ).order_by('-weigth', '-rank', 'pk')
+
+    return [(product, product.weigth) for product in products]
+
+
+class TrigramWordSimilarity(Func):
+    """
+    pg_trgm word_similarity() of searched value and field value.
+    """
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
+
+
+# pg_trgm extension installation by database name, checked once by worker
+PG_TRGM_INSTALLED = {}
+
+
+def pg_trgm_is_installed():
+    """
+    Return True if pg_trgm extension is installed in PostgreSQL database: migration 0014 skips it on servers which
+    don't ship it. Word similarity needs pg_trgm 1.2 (PostgreSQL 9.6).
+    """
+    name = connection.settings_dict['NAME']
+    if name not in PG_TRGM_INSTALLED:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'pg_trgm'")
+            row = cursor.fetchone()
+        PG_TRGM_INSTALLED[name] = row is not None and tuple(int(number) for number in row[0].split('.')) >= (1, 2)
+        if not PG_TRGM_INSTALLED[name]:
+            LOGGER.warning("SEARCH pg_trgm 1.2 extension isn't installed, trigram search falls back to icontains")
+    return PG_TRGM_INSTALLED[name]
+
+
+def search_product_trigram(terms: str):
+    """
+    Use provided terms to return a list of product with relevancy weigth (between 0 and 1)
+    according to trigram similarity, so that misspelt terms still find products.
+    Requires PostgreSQL pg_trgm extension, falls back to search_product_icontains on other databases or without
+    pg_trgm.
+        :param terms: searched terms in products table
+        :type terms: str
+    """
+    terms = terms.strip()
+
+    if not terms:
+        return []
+
+    if connection.vendor != 'postgresql' or not pg_trgm_is_installed():
+        return search_product_icontains(terms)
+
+    products = Product.objects.filter(
+        Q(product_name__icontains=terms) | Q(product_name__trigram_word_similar=terms) |
+        Q(product_name__trigram_similar=terms)
+    ).exclude(nutrition_grade_fr='').annotate(
+        word_similarity=TrigramWordSimilarity(terms, 'product_name'),
+        similarity=TrigramSimilarity('product_name', terms)
+    ).order_by('-word_similarity', '-similarity', 'pk')
+
+    return [(product, product.word_similarity) for product in products]
+
+
+def search_product_inverted_index(terms: str):
+    """
+    Use provided terms to return a list of product with relevancy weigth, as search_product_icontains does,
+    but matching terms against the worker in memory inverted index. Only one query is used to get products.
+        :param terms: searched terms in products table
+        :type terms: str
+    """
+    result = []
+
+    # transform terms to list
+    base_terms_list = terms.split(' ')
+
+    if base_terms_list == ['']:
+        return []
+
+    index = get_product_index()
+
+    # create combination of terms, sorted by length
+    temp_terms_groups = zip_longest(*[base_terms_list[i:] for i in range(len(base_terms_list))])
+    sorted_terms_groups = sorted(map(remove_none, temp_terms_groups), key=len, reverse=True)
+
+    phrase_matches = None
+    for terms_list in sorted_terms_groups:
+
+        weigth = len(terms_list)
+
+        if ' '.join(terms_list) not in STOP_WORDS:
+            # search exact terms
+            if phrase_matches is None:
+                phrase_matches = index.phrase_matches(terms)
+                result += [(doc_id, weigth * 2) for doc_id in phrase_matches]
+
+            # search unordered terms combination
+            result += [(doc_id, (weigth * 2) - 1) for doc_id in index.all_words_matches(terms_list)]
+
+    # remove duplicate values and sort results
+    sorted_result = sorted(clean_search_result(result), key=lambda x: (-x[1], x[0]))
+
+    codes = index.get_codes([doc_id for doc_id, _ in sorted_result])
+    products = Product.objects.in_bulk(codes)
+
+    # products deleted since last index refresh
+    for code in set(codes) - set(products):
+        index.remove(code)
+
+    return [(products[code], weigth) for code, (_, weigth) in zip(codes, sorted_result) if code in products]
+
+
+SEARCH_ENGINES = {
+    'icontains': search_product_icontains,
+    'fulltext': search_product_fulltext,
+    'trigram': search_product_trigram,
+    'inverted_index': search_product_inverted_index,
+}
+
+
+def clean_search_terms(terms: str):
+    """
+    Normalise searched terms: lower case words separated by one space.
+        :param terms: searched terms
+        :type terms: str
+    """
+    return ' '.join(terms.lower().split())
+
+
+def get_search_cache_key(terms: str):
+    """
+    Return cache key of search result for normalised terms, search engine and catalogue version.
+        :param terms: normalised searched terms
+        :type terms: str
+    """
+    terms_hash = hashlib.md5(terms.encode('utf-8')).hexdigest()
+    return 'search:%s:%s:%s' % (Catalogue.get_version(), settings.SEARCH_ENGINE, terms_hash)
+
+
+def search_product(terms: str):
+    """
+    Use provided terms to return a list of product with relevancy weigth,
+    with the search engine defined by SEARCH_ENGINE setting.
+    Ranked products pks are cached until next catalogue version (see api_to_db command).
+        :param terms: searched terms in products table
+        :type terms: str
+    """
+    terms = clean_search_terms(terms)
+    cache_key = get_search_cache_key(terms)
+    cached_result = cache.get(cache_key)
+
+    if cached_result is None:
+        result = SEARCH_ENGINES[settings.SEARCH_ENGINE](terms)
+        cache.set(cache_key, [(product.pk, weigth) for product, weigth in result], settings.SEARCH_CACHE_TIMEOUT)
+        return result
+
+    products = Product.objects.in_bulk([pk for pk, _ in cached_result])
+    return [(products[pk], weigth) for pk, weigth in cached_result if pk in products]
+
+
+def evict_search_results():
+    """
+    Delete stored search results unused for SEARCH_RESULT_TIMEOUT seconds and return their number.
+    """
+    expiry = timezone.now() - timedelta(seconds=settings.SEARCH_RESULT_TIMEOUT)
+    deleted = SearchResult.objects.filter(last_used__lt=expiry).delete()[1]
+    return deleted.get(SearchResult._meta.label, 0)
+
+
+def store_search_result(terms: str, result: list):
+    """
+    Store search result in database and return it. A result already stored for same terms is reused.
+    Views keep its id in session and join products to it, instead of keeping products pks.
+        :param terms: searched terms
+        :type terms: str
+        :param result: list of tuple like (product, weight) returned by search_product
+        :type result: list
+    """
+    cache_key = get_search_cache_key(clean_search_terms(terms))
+    search_id = hashlib.md5(cache_key.encode('utf-8')).hexdigest()[:16]
+
+    if SearchResult.objects.filter(pk=search_id).update(last_used=timezone.now()):
+        return SearchResult(pk=search_id, terms=terms)
+
+    evict_search_results()
+    try:
+        with transaction.atomic():
+            search_result = SearchResult.objects.create(pk=search_id, terms=terms)
+            SearchResultProduct.objects.bulk_create([
+                SearchResultProduct(search=search_result, product=product, position=position, weight=weight)
+                for position, (product, weight) in enumerate(result)
+            ])
+    except IntegrityError:
+        # same search stored at the same time by another request
+        search_result = SearchResult.objects.get(pk=search_id)
+    return search_result
+
+
 # Autocompletion helpers
 
 def clear_text(text):
@@ -102,40 +397,45 @@ def clear_text(text):
     return text.lower()
 
 
+def iter_corpus(chunk_size: int = 2000):
+    """
+    Yield cleaned products names, read from database by chunks (server side cursor on PostgreSQL).
+        :param chunk_size: number of products names read at once
+        :type chunk_size: int
+    """
+    for element in Product.objects.all().values_list('product_name').iterator(chunk_size=chunk_size):
+        yield clear_text(element[0])
+
+
 def create_corpus():
     """
     Create corpus from products names.
     """
-    corpus = [clear_text(element[0]) for element in Product.objects.all().values_list('product_name')]
+    corpus = list(iter_corpus())
     return corpus
 
 
 def get_unigrams(corpus):
     """
-    Get all unigrams from corpus.
+    Get all unigrams from corpus with their frequency, most frequent first.
     """
     unigrams = {}
     for element in corpus:
-        print(element)
         for unigram in element.split(' '):
             if unigram in unigrams:
                 unigrams[unigram] += 1
             else:
                 unigrams[unigram] = 1
     unigrams = collections.OrderedDict(sorted(unigrams.items(), key=lambda t: t[1], reverse=True))
-    pprint(unigrams)
+    return unigrams
 
 
 def get_ngrams(corpus, n):
     """
-    Get ngrams from provided corpus according to provided value of n.
+    Get ngrams from provided corpus according to provided value of n, with their frequency, most frequent first.
     """
-    words = []
     ngrams = {}
     for word_list in [elt.split(' ') for elt in corpus]:
-        # print(word_list)
-        #     for word in word_list:
-        #         words.append(word)
         words = [' '.join(name) for name in zip(*[word_list[i:] for i in range(n)])]
         for ngram in words:
             if ngram in ngrams:
@@ -144,6 +444,111 @@ def get_ngrams(corpus, n):
                 ngrams[ngram] = 1
 
     ngrams = collections.OrderedDict(sorted(ngrams.items(), key=lambda t: t[1], reverse=True))
-    # for el in words:
-    #     print(el)
-    pprint(ngrams)
+    return ngrams
+
+
+def iter_ngrams(text: str, n: int):
+    """
+    Yield ngrams of a text, ignoring those with empty words (several following spaces).
+    """
+    words = text.split(' ')
+    for i in range(len(words) - n + 1):
+        ngram_words = words[i:i + n]
+        if '' not in ngram_words:
+            yield ' '.join(ngram_words)
+
+
+class CountMinSketch:
+    """
+    Approximate counter using a fixed amount of memory (width x depth counters).
+    Counts are never under estimated, conservative update limits over estimation.
+    """
+
+    def __init__(self, width: int = 2 ** 18, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('I', [0]) * width for _ in range(depth)]
+
+    def _indexes(self, item):
+        # One independent 32 bits hash by row: hashes of (seed, item) tuples collide for all seeds at once
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[row * 4:row * 4 + 4], 'little') % self.width for row in range(self.depth)]
+
+    def add(self, item, count: int = 1):
+        """
+        Increment item count and return its new estimated count.
+        """
+        indexes = self._indexes(item)
+        estimate = min(row[index] for row, index in zip(self.rows, indexes)) + count
+        for row, index in zip(self.rows, indexes):
+            if row[index] < estimate:
+                row[index] = estimate
+        return estimate
+
+    def estimate(self, item):
+        """
+        Return estimated count of item.
+        """
+        return min(row[index] for row, index in zip(self.rows, self._indexes(item)))
+
+
+class TopNgramsCounter:
+    """
+    Keep the most frequent items of a stream in bounded memory: a count-min sketch estimates all counts,
+    a min heap keeps the size best ones.
+    """
+
+    def __init__(self, size: int, sketch: CountMinSketch = None):
+        self.size = size
+        self.sketch = sketch or CountMinSketch()
+        self.top = {}
+        self.heap = []
+
+    def add(self, item):
+        """
+        Count one occurrence of item.
+        """
+        estimate = self.sketch.add(item)
+        if item in self.top:
+            self.top[item] = estimate
+        elif len(self.top) < self.size:
+            self.top[item] = estimate
+            heapq.heappush(self.heap, (estimate, item))
+        elif estimate > self._min_count():
+            del self.top[heapq.heappop(self.heap)[1]]
+            self.top[item] = estimate
+            heapq.heappush(self.heap, (estimate, item))
+
+    def _min_count(self):
+        """
+        Return smallest count in top items, updating outdated heap entries.
+        """
+        while True:
+            count, item = self.heap[0]
+            if self.top[item] == count:
+                return count
+            heapq.heapreplace(self.heap, (self.top[item], item))
+
+    def most_common(self):
+        """
+        Return (item, count) tuples, most frequent first.
+        """
+        return sorted(self.top.items(), key=lambda t: (-t[1], t[0]))
+
+
+def get_top_ngrams(corpus, max_words: int, size: int):
+    """
+    Get size most frequent ngrams of 1 to max_words words from corpus with their frequency, most frequent first.
+    Corpus can be any iterable (iter_corpus for instance): memory use only depends on size.
+        :param corpus: iterable of cleaned texts
+        :param max_words: max number of words in a ngram
+        :type max_words: int
+        :param size: number of kept ngrams
+        :type size: int
+    """
+    counter = TopNgramsCounter(size)
+    for text in corpus:
+        for n in range(1, max_words + 1):
+            for ngram in iter_ngrams(text, n):
+                counter.add(ngram)
+    return collections.OrderedDict(counter.most_common())
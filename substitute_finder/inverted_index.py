@@ -0,0 +1,294 @@
+"""
+In memory inverted index of product names, for deployments without PostgreSQL search extensions.
+"""
+import bisect
+import logging
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Product
+
+LOGGER = logging.getLogger(__name__)
+
+# Length of tokens substrings mapped to the tokens containing them
+NGRAM_LENGTH = 3
+
+
+def intersect_sorted(first: array, second: array):
+    """
+    Intersection of two sorted integer arrays.
+        :param first: sorted array
+        :type first: array
+        :param second: sorted array
+        :type second: array
+    """
+    if len(first) > len(second):
+        first, second = second, first
+
+    result = array('I')
+    low = 0
+    for value in first:
+        # gallop in the biggest array from last found position
+        low = bisect.bisect_left(second, value, low)
+        if low == len(second):
+            break
+        if second[low] == value:
+            result.append(value)
+    return result
+
+
+def get_token_ngrams(token: str):
+    """
+    Return distinct substrings of NGRAM_LENGTH characters of a token.
+        :param token: indexed token or searched word
+        :type token: str
+    """
+    return {token[start:start + NGRAM_LENGTH] for start in range(len(token) - NGRAM_LENGTH + 1)}
+
+
+def union_sorted(arrays: list):
+    """
+    Union of many sorted integer arrays.
+        :param arrays: list of sorted arrays
+        :type arrays: list
+    """
+    values = set()
+    for values_array in arrays:
+        values.update(values_array)
+    return array('I', sorted(values))
+
+
+class ProductInvertedIndex:
+    """
+    Index lower cased product names words (split on spaces like searched terms) to sorted arrays of document ids.
+    A document id is the position of product code in codes list.
+    Tokens are also indexed by their n-grams, so that tokens containing a searched word are found without scanning
+    the vocabulary.
+    Only products with a nutrition grade are indexed, as search results never contain the others.
+    Searches hold the lock too, so that a refresh by another thread never changes the index they read.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        """
+        Empty index.
+        """
+        self.codes = []
+        self.names = []
+        self.doc_ids = {}
+        self.postings = {}
+        self.ngrams = {}
+        self.last_updated = None
+        self.last_refresh = None
+        self.build_time = 0.0
+
+    @staticmethod
+    def tokenize(name: str):
+        """
+        Return distinct words of a product name.
+            :param name: product name
+            :type name: str
+        """
+        return set(name.lower().split(' '))
+
+    def _add(self, code: str, name: str):
+        """
+        Add or replace a product in index.
+        """
+        self._remove(code)
+        doc_id = self.doc_ids.get(code)
+        if doc_id is None:
+            doc_id = len(self.codes)
+            self.doc_ids[code] = doc_id
+            self.codes.append(code)
+            self.names.append(None)
+        self.names[doc_id] = name.lower()
+        for token in self.tokenize(name):
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = array('I')
+                for ngram in get_token_ngrams(token):
+                    self.ngrams.setdefault(ngram, set()).add(token)
+            if not postings or postings[-1] < doc_id:
+                postings.append(doc_id)
+            else:
+                bisect.insort(postings, doc_id)
+
+    def _remove(self, code: str):
+        """
+        Remove a product from index. Its document id is kept for a later add.
+        """
+        doc_id = self.doc_ids.get(code)
+        if doc_id is None or self.names[doc_id] is None:
+            return
+        for token in self.tokenize(self.names[doc_id]):
+            postings = self.postings[token]
+            del postings[bisect.bisect_left(postings, doc_id)]
+            if not postings:
+                del self.postings[token]
+                for ngram in get_token_ngrams(token):
+                    self.ngrams[ngram].discard(token)
+                    if not self.ngrams[ngram]:
+                        del self.ngrams[ngram]
+        self.names[doc_id] = None
+
+    def build(self):
+        """
+        Build index from all products.
+        """
+        start = time.perf_counter()
+        with self.lock:
+            self._reset()
+            refresh_time = timezone.now()
+            products = Product.objects.exclude(nutrition_grade_fr='').order_by('pk')
+            for code, name in products.values_list('pk', 'product_name').iterator():
+                self._add(code, name)
+            self.last_updated = Product.objects.aggregate(Max('last_updated'))['last_updated__max']
+            self.last_refresh = refresh_time
+            self.build_time = time.perf_counter() - start
+        LOGGER.info("INVERTED INDEX built in %.3fs: %s", self.build_time, self.metrics())
+
+    def refresh(self):
+        """
+        Update index with products modified since last build or refresh.
+        """
+        with self.lock:
+            refresh_time = timezone.now()
+            products = Product.objects.all()
+            if self.last_updated:
+                products = products.filter(last_updated__gte=self.last_updated)
+            nb_updated = 0
+            for code, name, grade, last_updated in products.values_list(
+                    'pk', 'product_name', 'nutrition_grade_fr', 'last_updated').iterator():
+                if grade:
+                    self._add(code, name)
+                else:
+                    self._remove(code)
+                if self.last_updated is None or last_updated > self.last_updated:
+                    self.last_updated = last_updated
+                nb_updated += 1
+            self.last_refresh = refresh_time
+        if nb_updated:
+            LOGGER.debug("INVERTED INDEX refreshed with %s products", nb_updated)
+
+    def refresh_if_needed(self):
+        """
+        Build or refresh index according to SEARCH_INDEX_REFRESH_INTERVAL setting (seconds).
+        """
+        if self.last_refresh is None:
+            self.build()
+        elif (timezone.now() - self.last_refresh).total_seconds() >= settings.SEARCH_INDEX_REFRESH_INTERVAL:
+            self.refresh()
+
+    def remove(self, code: str):
+        """
+        Remove a product from index (used when a product has been deleted from database).
+            :param code: product code
+            :type code: str
+        """
+        with self.lock:
+            self._remove(code)
+
+    def word_matches(self, word: str):
+        """
+        Return sorted array of document ids whose name contains word (like icontains lookup).
+            :param word: searched word, without space
+            :type word: str
+        """
+        word = word.lower()
+        with self.lock:
+            if not word:
+                return array('I', sorted(doc_id for doc_id, name in enumerate(self.names) if name is not None))
+            return union_sorted([self.postings[token] for token in self._word_tokens(word)])
+
+    def _word_tokens(self, word: str):
+        """
+        Return tokens containing word, lock being held: candidates are tokens sharing all n-grams of word,
+        vocabulary is only scanned for words shorter than an n-gram.
+        """
+        if len(word) < NGRAM_LENGTH:
+            return [token for token in self.postings if word in token]
+        candidates = sorted((self.ngrams.get(ngram, set()) for ngram in get_token_ngrams(word)), key=len)
+        tokens = candidates[0].intersection(*candidates[1:])
+        return [token for token in tokens if word in token]
+
+    def all_words_matches(self, words: list):
+        """
+        Return sorted array of document ids whose name contains all words.
+            :param words: list of searched words
+            :type words: list
+        """
+        with self.lock:
+            word_matches = sorted((self.word_matches(word) for word in words), key=len)
+        result = word_matches[0]
+        for matches in word_matches[1:]:
+            if not result:
+                break
+            result = intersect_sorted(result, matches)
+        return result
+
+    def phrase_matches(self, terms: str):
+        """
+        Return sorted array of document ids whose name contains terms.
+            :param terms: searched terms
+            :type terms: str
+        """
+        terms = terms.lower()
+        with self.lock:
+            candidates = self.all_words_matches(terms.split(' '))
+            return array('I', [doc_id for doc_id in candidates if terms in self.names[doc_id]])
+
+    def get_codes(self, doc_ids: list):
+        """
+        Return product codes of document ids.
+            :param doc_ids: document ids returned by matches methods
+            :type doc_ids: list
+        """
+        with self.lock:
+            return [self.codes[doc_id] for doc_id in doc_ids]
+
+    def metrics(self):
+        """
+        Return index size and build time metrics.
+        """
+        with self.lock:
+            return self._metrics()
+
+    def _metrics(self):
+        """
+        Return index metrics, lock being held.
+        """
+        memory = sys.getsizeof(self.postings) + sys.getsizeof(self.doc_ids) + sys.getsizeof(self.ngrams)
+        memory += sys.getsizeof(self.codes) + sys.getsizeof(self.names)
+        memory += sum(sys.getsizeof(token) + sys.getsizeof(postings) for token, postings in self.postings.items())
+        memory += sum(sys.getsizeof(ngram) + sys.getsizeof(tokens) for ngram, tokens in self.ngrams.items())
+        memory += sum(sys.getsizeof(code) for code in self.codes)
+        memory += sum(sys.getsizeof(name) for name in self.names if name is not None)
+        return {
+            'nb_products': sum(1 for name in self.names if name is not None),
+            'nb_tokens': len(self.postings),
+            'nb_ngrams': len(self.ngrams),
+            'memory_bytes': memory,
+            'build_time': self.build_time,
+            'last_refresh': self.last_refresh,
+        }
+
+
+PRODUCT_INDEX = ProductInvertedIndex()
+
+
+def get_product_index():
+    """
+    Return the worker product index, built or refreshed when needed.
+    """
+    PRODUCT_INDEX.refresh_if_needed()
+    return PRODUCT_INDEX
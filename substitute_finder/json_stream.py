@@ -0,0 +1,138 @@
+"""
+Incremental parsing of json documents read by chunks: items of a json list are decoded one at a time,
+so that memory use depends on the size of an item instead of the size of the document.
+"""
+import json
+from functools import partial
+
+CHUNK_SIZE = 64 * 1024
+
+DECODER = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+NUMBER_START = '-0123456789'
+NUMBER_PART = '0123456789.eE+-'
+
+
+class JsonStream:
+    """
+    Decode successive json values of a document provided as an iterable of text chunks.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+
+    def read_more(self, min_length: int = 1):
+        """
+        Append next chunks to buffer until it holds min_length characters not decoded yet,
+        dropping decoded part of buffer. Return False at end of document.
+        """
+        chunks = [self.buffer[self.pos:]]
+        length = len(chunks[0])
+        for chunk in self.chunks:
+            chunks.append(chunk)
+            length += len(chunk)
+            if length >= min_length and chunk:
+                break
+        if len(chunks) == 1:
+            return False
+        self.buffer = ''.join(chunks)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Return next non whitespace character without consuming it, an empty string at end of document.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return ''
+
+    def expect(self, characters: str):
+        """
+        Consume and return next non whitespace character, raise ValueError if it isn't one of characters.
+        """
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError("Expecting one of %r at position %s, got %r" % (characters, self.pos, character))
+        self.pos += 1
+        return character
+
+    def decode(self):
+        """
+        Decode and return next json value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Value may be incomplete, buffer size is doubled so that a value isn't decoded too many times
+                if not self.read_more(2 * (len(self.buffer) - self.pos)):
+                    raise
+                continue
+            # A number may go on in next chunk
+            if self.buffer[self.pos] in NUMBER_START and (end == len(self.buffer) or self.buffer[end] in NUMBER_PART) \
+                    and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+    def iter_items(self):
+        """
+        Yield decoded items of the json list starting at current position.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_json_list(chunks, list_key: str = None, values: dict = None):
+    """
+    Yield items of a json list read by chunks. Document is the list itself, or a json object when list_key is given.
+    In that case, other members of the object are decoded and stored in values.
+        :param chunks: iterable of text chunks of json document
+        :param list_key: key of the list in json object
+        :type list_key: str
+        :param values: dict receiving other members of json object
+        :type values: dict
+    """
+    stream = JsonStream(chunks)
+    if list_key is None:
+        yield from stream.iter_items()
+        return
+
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.decode()
+        stream.expect(':')
+        if key == list_key and stream.peek() == '[':
+            yield from stream.iter_items()
+        else:
+            value = stream.decode()
+            if values is not None:
+                values[key] = value
+        if stream.expect(',}') == '}':
+            return
+
+
+def iter_file_chunks(file, chunk_size: int = CHUNK_SIZE):
+    """
+    Return an iterator of successive chunks of an opened file.
+        :param file: file opened in text mode
+        :param chunk_size: number of characters of a chunk
+        :type chunk_size: int
+    """
+    return iter(partial(file.read, chunk_size), '')
@@ -0,0 +1,12 @@
+"""
+substitute_finder custom lookups.
+"""
+from django.contrib.postgres.lookups import PostgresSimpleLookup
+
+
+class TrigramWordSimilar(PostgresSimpleLookup):
+    """
+    True if searched value is similar to a continuous extent of ordered words in field value (pg_trgm %> operator).
+    """
+    lookup_name = 'trigram_word_similar'
+    operator = '%%>'
@@ -3,15 +3,84 @@ substitute_finder custom command to get data from OpenFoodFacts API and insert t
 """
 import logging
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 from django.conf import settings
-from django.core.management.base import BaseCommand
-from django.db.models import Count, Q
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
 
-from substitute_finder.models import Category, Product
+from substitute_finder import api_client, cleanup
+from substitute_finder.api_cache import compact_list_cache
+from substitute_finder.models import Catalogue, Category, ImportRun, Product
+from substitute_finder.pipeline import ImportPipeline
+from substitute_finder.staging import StagingImport, use_schema
 
 LOGGER = logging.getLogger(__name__)
 
 
+def import_product_page(run: ImportRun, page: int, data, options: dict):
+    """
+    Import products of a page and checkpoint it in import run. Return number of products data elements read.
+    :param run: import run of page
+    :type run: ImportRun
+    :param page: page number
+    :type page: int
+    :param data: page data list, or an iterable of its data elements
+    :param options: grumpy_mode, filters and bulk options
+    :type options: dict
+    """
+    run.page_started(page)
+    start = time.perf_counter()
+    nb_data_elements = Product.insert_data(data, strict_required_field_mode=options['grumpy_mode'],
+                                           data_filters=options['filters'], bulk=options['bulk'])
+    run.page_done(page, nb_data_elements, time.perf_counter() - start)
+    return nb_data_elements
+
+
+@contextmanager
+def default_schema():
+    """
+    Context manager keeping default tables, used by workers without staging schema (like nullcontext of Python 3.7).
+    """
+    yield
+
+
+def import_products_shard(run_id: int, first_page: int, last_page: int, options: dict):
+    """
+    Import products of a range of pages in a worker process, skipping pages already written in import run.
+    Return number of products data elements read.
+    :param run_id: import run primary key
+    :type run_id: int
+    :param first_page: first page of range
+    :type first_page: int
+    :param last_page: last page of range
+    :type last_page: int
+    :param options: from_cache, grumpy_mode, filters, bulk, staging_schema and nb_workers options
+    :type options: dict
+    """
+    api_client.init_process(options['nb_workers'])
+    nb_data_elements = 0
+    try:
+        with use_schema(options['staging_schema']) if options['staging_schema'] else default_schema():
+            run = ImportRun.objects.get(pk=run_id)
+            done_pages = run.get_done_pages()
+            for page in range(first_page, last_page + 1):
+                if page in done_pages:
+                    continue
+                data = Product.iter_api_data_page(page, from_cache=options['from_cache'])
+                nb_page_elements = import_product_page(run, page, data, options)
+                LOGGER.info("WORKER %s imported page %s", os.getpid(), page)
+                if not nb_page_elements:
+                    break
+                nb_data_elements += nb_page_elements
+    finally:
+        connection.close()
+    return nb_data_elements
+
+
 class Command(BaseCommand):
     """
     Custom command to get data from OpenFoodFacts API and insert them into database
@@ -65,148 +134,294 @@ class Command(BaseCommand):
             help='allow to filter categories'
         )
 
+        parser.add_argument(
+            '--concurrency',
+            action='store',
+            dest='concurrency',
+            type=int,
+            help='number of pages recovered in parallel, API_CONCURRENCY setting by default'
+        )
+
+        parser.add_argument(
+            '--pipeline',
+            action='store_true',
+            dest='pipeline',
+            help='download, normalise and insert products pages concurrently'
+        )
+
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            dest='bulk',
+            help='insert or update each page of products with a few bulk queries'
+        )
+
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            help='only get products modified since last incremental import and only write changed ones'
+        )
+
+        parser.add_argument(
+            '--workers',
+            action='store',
+            dest='workers',
+            type=int,
+            help='number of processes importing products, each one a part of the pages range'
+        )
+
+        parser.add_argument(
+            '--staging',
+            action='store_true',
+            dest='staging',
+            help='write into copies of catalogue tables which replace live ones at the end (PostgreSQL only)'
+        )
+
         parser.add_argument(
             '--hard_reset',
             action='store_true',
             dest='hard_reset',
-            help='delete categories and product except those registered as favorites'
+            help='delete categories and product except those registered as favorites or commented'
         )
 
     @staticmethod
-    def hard_reset():
+    def hard_reset(tables: list = None):
         """
-        delete categories and product except those registered as favorites
+        delete categories and product except those registered as favorites or commented
+        :param tables: if given, rows referencing deleted ones are only deleted from these tables
+        :type tables: list
         """
-        Product.objects.filter(users=None, comment__isnull=True).delete()
-        Category.objects.filter(product__isnull=True).delete()
+        cleanup.hard_reset(tables=tables)
 
         # Count initial data
         LOGGER.info("Nb products after hard reset: %s", Product.objects.all().count())
         LOGGER.info("Nb categories after hard reset: %s", Category.objects.all().count())
 
     @staticmethod
-    def get_categories(from_cache: bool = False):
+    def get_categories(from_cache: bool = False, bulk: bool = False):
         """
         method in charge of getting categories.
         :param from_cache: indicates if data should be recovered from cache or not
         :type from_cache: bool
+        :param bulk: insert data with bulk queries
+        :type bulk: bool
         """
 
-        data = Category.get_api_data_list(from_cache=from_cache)
-        Category.insert_data(data)
+        data = Category.iter_api_data_list(from_cache=from_cache)
+        Category.insert_data(data, bulk=bulk)
 
     @staticmethod
-    def get_product(actual_page: int = 1, from_cache: bool = False, grumpy_mode: bool = False, filters: dict = None):
+    def database_cleanup(grumpy_mode: bool = False, tables: list = None):
         """
-        get products data and insert them into Product table.
-        :param actual_page: start page.
-        :param from_cache: get data from cache or online
-        :param grumpy_mode: activate strict mode
-        :param filters: filter to apply to products data data
-        :return:
+        Clean database Product and Category tables after data recovery, see cleanup.database_cleanup
+        :param grumpy_mode: indicates if database should be cleaned with a strict control on important Product fields
+        :type grumpy_mode: bool
+        :param tables: if given, rows referencing deleted ones are only deleted from these tables
+        :type tables: list
         """
-        data = Product.get_api_data_list(nb_pages=1, start_page=actual_page, from_cache=from_cache)
-        Product.insert_data(data, strict_required_field_mode=grumpy_mode, data_filters=filters)
-        return bool(data)
+        cleanup.database_cleanup(grumpy_mode=grumpy_mode, tables=tables)
 
     @staticmethod
-    def database_cleanup(grumpy_mode: bool = False):
+    def compact_api_caches():
         """
-        Clean database Product and Category tables after data recovery
-        :param grumpy_mode: indicates if database should be cleaned with a strict control on important Product fields
-        :type grumpy_mode: bool
+        Drop pages replaced during import from ndjson api caches, see api_cache.compact_list_cache
         """
-
-        if grumpy_mode:
-            Product.objects.filter(
-                Q(generic_name=None) | Q(energy_100g=None) | Q(sugars_100g=None) | Q(sodium_100g=None) |
-                Q(carbohydrates_100g=None) | Q(salt_100g=None) | Q(proteins_100g=None) |
-                Q(fat_100g=None) | Q(fiber_100g=None) | Q(saturated_fat_100g=None) |
-                Q(nutrition_grade_fr=None) | Q(generic_name='') | Q(energy_100g='') | Q(sugars_100g='') |
-                Q(sodium_100g='') | Q(carbohydrates_100g='') | Q(salt_100g='') |
-                Q(proteins_100g='') | Q(fat_100g='') | Q(fiber_100g='') |
-                Q(saturated_fat_100g='') | Q(nutrition_grade_fr='')).delete()
-
-        Product.objects.filter(nutrition_grade_fr='').delete()
-        Category.objects.annotate(product_count=Count('product')).filter(product_count__lte=1).delete()
-        Category.objects.filter(product__isnull=True).delete()
-        Product.objects.filter(categories_tags=None).delete()
+        for model in [Category, Product]:
+            nb_bytes = compact_list_cache(model)
+            if nb_bytes:
+                LOGGER.info("COMPACT %s api cache: %s bytes freed", model._meta.model_name, nb_bytes)
 
     @staticmethod
-    def get_recovery_state():
+    def get_products(run: ImportRun, from_cache: bool = False, grumpy_mode: bool = False, filters: dict = None,
+                     concurrency: int = 1, bulk: bool = False):
         """
-        get recovery state from state file.
+        Get products of import run pages not written yet, from its first unfinished page until its last page
+        or until there are no more data. Each page is checkpointed once written.
+        :param run: import run
+        :param from_cache: get data from cache or online
+        :param grumpy_mode: activate strict mode
+        :param filters: filter to apply to products data data
+        :param concurrency: number of pages recovered in parallel, a single page is inserted while it's read
+        :param bulk: insert data with bulk queries
         """
-        last_page_path = os.path.join(settings.LAST_PAGE_HISTORY_PATH, 'last_page.txt')
-        state = 1
-        if os.path.exists(last_page_path):
-            with open(last_page_path, 'r') as lp_file:
-                state = int(lp_file.read())
-        return state
+        options = {'grumpy_mode': grumpy_mode, 'filters': filters, 'bulk': bulk}
+        done_pages = run.get_done_pages()
+        page = run.get_first_unfinished_page()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while run.last_page is None or page <= run.last_page:
+                # Pages are recovered by batches of concurrent requests
+                batch_end = page + concurrency - 1
+                if run.last_page is not None:
+                    batch_end = min(batch_end, run.last_page)
+                pages = [batch_page for batch_page in range(page, batch_end + 1) if batch_page not in done_pages]
+                page = batch_end + 1
+
+                if concurrency > 1:
+                    pages_data = executor.map(partial(Product.get_api_data_page, from_cache=from_cache), pages)
+                    for batch_page, (data, is_last_page) in zip(pages, pages_data):
+                        if not import_product_page(run, batch_page, data, options) or is_last_page:
+                            return
+                else:
+                    for batch_page in pages:
+                        meta = {}
+                        data = Product.iter_api_data_page(batch_page, from_cache=from_cache, meta=meta)
+                        if not import_product_page(run, batch_page, data, options) or Product.is_last_page(meta):
+                            return
 
     @staticmethod
-    def set_recovery_state(page: int = 1):
+    def get_shards(first_page: int, last_page: int, nb_workers: int):
         """
-        Store recovery state in file.
-        :param page: actual page
-        :type page: int
+        Split a page range into at most nb_workers contiguous ranges of pages.
+        :param first_page: first page of range
+        :type first_page: int
+        :param last_page: last page of range
+        :type last_page: int
+        :param nb_workers: number of workers
+        :type nb_workers: int
         """
-        if not os.path.exists(settings.LAST_PAGE_HISTORY_PATH):
-            os.makedirs(settings.LAST_PAGE_HISTORY_PATH)
-        last_page_path = os.path.join(settings.LAST_PAGE_HISTORY_PATH, 'last_page.txt')
-
-        with open(last_page_path, 'w') as lp_file:
-            lp_file.write(str(page))
-
-    def handle(self, *args, **options):
+        nb_pages = last_page - first_page + 1
+        shard_size, nb_bigger_shards = divmod(nb_pages, nb_workers)
+        shards = []
+        for index in range(min(nb_workers, nb_pages)):
+            shard_last_page = first_page + shard_size + (1 if index < nb_bigger_shards else 0) - 1
+            shards.append((first_page, shard_last_page))
+            first_page = shard_last_page + 1
+        return shards
+
+    def get_products_with_workers(self, run: ImportRun, nb_workers: int, from_cache: bool = False,
+                                  grumpy_mode: bool = False, filters: dict = None, bulk: bool = False,
+                                  staging_schema: str = None):
         """
-        Allow to get data from api or from cache and insert them into database.
+        Get products of import run pages by several worker processes, each one importing a contiguous part of the
+        pages range from first unfinished page. Return number of products data elements read by workers.
+        :param run: import run, with a last page
+        :param nb_workers: number of worker processes
+        :param from_cache: get data from cache or online
+        :param grumpy_mode: activate strict mode
+        :param filters: filter to apply to products data data
+        :param bulk: insert data with bulk queries
+        :param staging_schema: schema of staging tables written by workers
         """
-
-        # Count initial data
-        LOGGER.info("Nb products before update: %s", Product.objects.all().count())
-        LOGGER.info("Nb categories before update: %s", Category.objects.all().count())
+        first_page = run.get_first_unfinished_page()
+        if first_page > run.last_page:
+            return 0
+        shards = self.get_shards(first_page, run.last_page, nb_workers)
+        shard_options = {'from_cache': from_cache, 'grumpy_mode': grumpy_mode, 'bulk': bulk,
+                         'filters': Product.get_data_filters(filters), 'staging_schema': staging_schema,
+                         'nb_workers': len(shards)}
+
+        # Workers open their own database connection and http session
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(import_products_shard, run.pk, shard_first_page, shard_last_page, shard_options)
+                       for shard_first_page, shard_last_page in shards]
+            return sum(future.result() for future in futures)
+
+    def import_catalogue(self, options: dict, run: ImportRun = None, staging: StagingImport = None):
+        """
+        Get categories, then products pages of import run (or modified products in incremental mode),
+        then clean database.
+        :param options: command options
+        :param run: import run of products pages
+        :param staging: staging import whose tables are written
+        """
+        tables = staging.tables if staging else None
 
         # Case with hard reset
         if options['hard_reset']:
-            self.hard_reset()
+            self.hard_reset(tables=tables)
 
         # Deal with Category
-        self.get_categories(from_cache=options['from_cache'])
+        self.get_categories(from_cache=options['from_cache'], bulk=options['bulk'])
 
         # Deal with Product
         # Define initial variables
         product_filter = {key: options[key] for key in options}
-        data_exists = True
-        start_page = self.get_recovery_state()
-
-        if options['start_page']:
-            start_page = options['start_page']
-        actual_page = start_page
-
-        # Loop on data recovery and integration for Product
-        if options['nb_pages'] > 0 or options['nb_pages'] is None:
-            while data_exists:
-                data_exists = self.get_product(actual_page=actual_page,
-                                               from_cache=options['from_cache'],
-                                               grumpy_mode=options['grumpy_mode'],
-                                               filters=product_filter)
-
-                # Check if loop should continue according to page constraints
-                if data_exists and options['nb_pages'] and actual_page >= start_page + options['nb_pages']:
-                    data_exists = False
+        concurrency = options['concurrency'] or settings.API_CONCURRENCY
+
+        # Incremental data recovery and integration for Product, most recently modified products first
+        if options['incremental']:
+            since = Catalogue.get().products_last_modified
+            data = Product.iter_api_modified_data_list(since=since, nb_pages=options['nb_pages'],
+                                                       from_cache=options['from_cache'])
+            Product.insert_data(data, strict_required_field_mode=options['grumpy_mode'], data_filters=product_filter,
+                                bulk=options['bulk'], incremental=True, since=since)
+            LOGGER.info("Products last modification after update: %s", Catalogue.update_products_last_modified())
+
+        elif run is not None:
+            # Data recovery and integration for Product by several processes
+            if (options['workers'] or 1) > 1:
+                if run.last_page is None:
+                    run.last_page = Product.get_api_nb_pages(from_cache=options['from_cache'])
+                    run.save(update_fields=['last_page'])
+                nb_data_elements = self.get_products_with_workers(
+                    run, options['workers'], from_cache=options['from_cache'], grumpy_mode=options['grumpy_mode'],
+                    filters=product_filter, bulk=options['bulk'], staging_schema=staging.schema if staging else None)
+                LOGGER.info("Nb products data read by workers: %s", nb_data_elements)
+
+            # Pipelined data recovery and integration for Product
+            elif options['pipeline']:
+                ImportPipeline(Product, start_page=run.get_first_unfinished_page(), last_page=run.last_page,
+                               from_cache=options['from_cache'], strict_required_field_mode=options['grumpy_mode'],
+                               data_filters=product_filter, concurrency=concurrency,
+                               on_page_started=run.page_started, on_page_written=run.page_done,
+                               bulk=options['bulk'], skipped_pages=run.get_done_pages()).run()
+
+            # Loop on data recovery and integration for Product
+            else:
+                self.get_products(run, from_cache=options['from_cache'], grumpy_mode=options['grumpy_mode'],
+                                  filters=product_filter, concurrency=concurrency, bulk=options['bulk'])
 
-                # Prepare next page number
-                actual_page += 1
+        # Remove useless Category and Product instances
+        self.database_cleanup(grumpy_mode=options['grumpy_mode'], tables=tables)
 
-                # Save last recoverd page number
-                self.set_recovery_state(page=actual_page - 1)
+    def handle(self, *args, **options):
+        """
+        Allow to get data from api or from cache and insert them into database.
+        """
 
-        # Reset page counter save
-        self.set_recovery_state()
+        # Count initial data
+        LOGGER.info("Nb products before update: %s", Product.objects.all().count())
+        LOGGER.info("Nb categories before update: %s", Category.objects.all().count())
 
-        # Remove useless Category and Product instances
-        self.database_cleanup(grumpy_mode=options['grumpy_mode'])
+        staging = None
+        if options['staging']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--staging needs a PostgreSQL database')
+            staging = StagingImport()
+
+        # Resume last unfinished import of products pages unless a start page is given,
+        # staged pages are lost with staging tables
+        run = None
+        if not options['incremental'] and (options['nb_pages'] is None or options['nb_pages'] > 0):
+            start_page = options['start_page'] or 1
+            last_page = start_page + options['nb_pages'] if options['nb_pages'] else None
+            resume = not options['start_page'] and (staging is None or staging.exists())
+            run = ImportRun.start(start_page=start_page, last_page=last_page, resume=resume,
+                                  staging=staging is not None)
+
+        if staging is None:
+            self.import_catalogue(options, run)
+        else:
+            if run is None or not run.pages.exists():
+                staging.prepare()
+            with staging.use():
+                self.import_catalogue(options, run, staging)
+                staging.build_indexes()
+            nb_deleted = staging.swap()
+            LOGGER.info("Nb rows referencing replaced products or categories deleted: %s", nb_deleted)
+
+        # Drop cached data computed from previous catalogue
+        catalogue = Catalogue.new_version()
+        LOGGER.info("Catalogue version after update: %s", catalogue.version)
+
+        # Next import starts a new pages range, an import failing before is resumed
+        if run is not None:
+            run.finish()
+
+        # Pages downloaded again were appended to ndjson caches
+        self.compact_api_caches()
 
         # Count final data
         LOGGER.info("Nb products after update: %s", Product.objects.all().count())
@@ -0,0 +1,33 @@
+"""
+substitute_finder custom command to build products names suggestions file used by autocomplete api.
+"""
+from django.core.management.base import BaseCommand
+
+from substitute_finder.autocomplete import build_autocomplete_file
+
+
+class Command(BaseCommand):
+    """
+    Custom command to build products names suggestions file
+    """
+    help = 'Compute products names suggestions and store them in file loaded by workers for autocomplete api'
+
+    def add_arguments(self, parser):
+        """
+        define arguments
+        :param parser:
+        :return:
+        """
+        parser.add_argument(
+            '--output',
+            action='store',
+            dest='output',
+            help='path of suggestions file, AUTOCOMPLETE_INDEX_PATH setting by default'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Build suggestions file.
+        """
+        file_path = build_autocomplete_file(options['output'])
+        self.stdout.write("Suggestions written in %s" % file_path)
@@ -0,0 +1,62 @@
+"""
+substitute_finder custom command to delete incomplete products and small categories, as api_to_db does after an import.
+"""
+from django.core.management.base import BaseCommand
+
+from substitute_finder.cleanup import database_cleanup, hard_reset
+
+
+class Command(BaseCommand):
+    """
+    Custom command to clean Product and Category tables
+    """
+    help = 'Delete products and categories like api_to_db cleanup does, favorite and commented products are kept'
+
+    def add_arguments(self, parser):
+        """
+        define arguments
+        :param parser:
+        :return:
+        """
+        parser.add_argument(
+            '--grumpy_mode',
+            action='store_true',
+            dest='grumpy_mode',
+            help='also delete products with missing data'
+        )
+
+        parser.add_argument(
+            '--hard_reset',
+            action='store_true',
+            dest='hard_reset',
+            help='delete categories and products except those registered as favorites or commented'
+        )
+
+        parser.add_argument(
+            '--dry_run',
+            action='store_true',
+            dest='dry_run',
+            help='only report numbers of rows which would be deleted'
+        )
+
+        parser.add_argument(
+            '--batch_size',
+            action='store',
+            dest='batch_size',
+            type=int,
+            default=500,
+            help='number of rows deleted by each query'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Run cleanup steps and report numbers of deleted rows.
+        """
+        if options['hard_reset']:
+            counts = hard_reset(dry_run=options['dry_run'], batch_size=options['batch_size'])
+        else:
+            counts = database_cleanup(grumpy_mode=options['grumpy_mode'], dry_run=options['dry_run'],
+                                      batch_size=options['batch_size'])
+        verb = 'would be deleted' if options['dry_run'] else 'deleted'
+        for name, nb_rows in counts.items():
+            self.stdout.write("%s %s %s" % (nb_rows, name, verb))
@@ -0,0 +1,35 @@
+"""
+substitute_finder custom command to precompute products substitutes displayed on product page.
+"""
+from django.core.management.base import BaseCommand
+
+from substitute_finder.substitutes import compute_substitutes
+
+
+class Command(BaseCommand):
+    """
+    Custom command to precompute products substitutes
+    """
+    help = 'Compute best substitutes of each product and store them in substitutes table (run it after api_to_db)'
+
+    def add_arguments(self, parser):
+        """
+        define arguments
+        :param parser:
+        :return:
+        """
+        parser.add_argument(
+            '--batch_size',
+            action='store',
+            dest='batch_size',
+            type=int,
+            default=500,
+            help='number of products whose substitutes are computed by each query'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Compute substitutes.
+        """
+        nb_substitutes = compute_substitutes(batch_size=options['batch_size'])
+        self.stdout.write("%s substitutes computed" % nb_substitutes)
@@ -0,0 +1,36 @@
+"""
+substitute_finder custom command to convert cached api pages from json format to ndjson format.
+"""
+from django.core.management.base import BaseCommand
+
+from substitute_finder.api_cache import convert_json_cache
+from substitute_finder.models import Category, Product
+
+
+class Command(BaseCommand):
+    """
+    Custom command to convert json api cache to ndjson api cache
+    """
+    help = 'Convert json files of api cache into compressed ndjson cache read when API_CACHE_FORMAT is ndjson'
+
+    def add_arguments(self, parser):
+        """
+        define arguments
+        :param parser:
+        :return:
+        """
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            dest='delete',
+            help='delete json files once converted'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Convert Category and Product caches.
+        """
+        for model in [Category, Product]:
+            nb_pages, json_size, ndjson_size = convert_json_cache(model, delete=options['delete'])
+            self.stdout.write("%s: %s pages converted, %s bytes of json, %s bytes of ndjson" % (
+                model._meta.model_name, nb_pages, json_size, ndjson_size))
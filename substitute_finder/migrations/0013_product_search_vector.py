@@ -0,0 +1,67 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Full text search configuration used by helpers.search_product_fulltext.
+# French snowball stemming; its stop word list already contains helpers.STOP_WORDS.
+CREATE_SEARCH_SQL = [
+    """
+    CREATE TEXT SEARCH CONFIGURATION pur_beurre (COPY = pg_catalog.french);
+    """,
+    """
+    CREATE FUNCTION substitute_finder_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('pur_beurre', coalesce(NEW.product_name, ''));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER substitute_finder_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF product_name ON substitute_finder_product
+    FOR EACH ROW EXECUTE PROCEDURE substitute_finder_product_search_vector_update();
+    """,
+    """
+    UPDATE substitute_finder_product SET search_vector = to_tsvector('pur_beurre', coalesce(product_name, ''));
+    """,
+    """
+    CREATE INDEX substitute_finder_product_search_vector_gin
+    ON substitute_finder_product USING gin (search_vector);
+    """,
+]
+
+DROP_SEARCH_SQL = [
+    "DROP INDEX IF EXISTS substitute_finder_product_search_vector_gin;",
+    "DROP TRIGGER IF EXISTS substitute_finder_product_search_vector_trigger ON substitute_finder_product;",
+    "DROP FUNCTION IF EXISTS substitute_finder_product_search_vector_update();",
+    "DROP TEXT SEARCH CONFIGURATION IF EXISTS pur_beurre;",
+]
+
+
+def run_on_postgresql(statements):
+    """
+    Build a RunPython callable that only executes statements on PostgreSQL (sqlite is used for local tests).
+    """
+
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0012_auto_20190103_1927'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='index de recherche'),
+        ),
+        migrations.RunPython(run_on_postgresql(CREATE_SEARCH_SQL), run_on_postgresql(DROP_SEARCH_SQL)),
+    ]
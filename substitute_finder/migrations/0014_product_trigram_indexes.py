@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# Trigram indexes used by helpers.search_product_trigram similarity operators
+# and by icontains lookups (search, admin search_fields) which django writes as UPPER(field::text) LIKE UPPER(...).
+CREATE_TRIGRAM_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+    """
+    CREATE INDEX IF NOT EXISTS substitute_finder_product_product_name_trgm
+    ON substitute_finder_product USING gin (product_name gin_trgm_ops);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS substitute_finder_product_product_name_upper_trgm
+    ON substitute_finder_product USING gin ((UPPER(product_name::text)) gin_trgm_ops);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS substitute_finder_product_generic_name_upper_trgm
+    ON substitute_finder_product USING gin ((UPPER(generic_name::text)) gin_trgm_ops);
+    """,
+]
+
+DROP_TRIGRAM_SQL = [
+    "DROP INDEX IF EXISTS substitute_finder_product_product_name_trgm;",
+    "DROP INDEX IF EXISTS substitute_finder_product_product_name_upper_trgm;",
+    "DROP INDEX IF EXISTS substitute_finder_product_generic_name_upper_trgm;",
+]
+
+
+def run_with_pg_trgm(statements):
+    """
+    Build a RunPython callable that only executes statements on PostgreSQL servers shipping pg_trgm.
+    """
+
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0013_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_with_pg_trgm(CREATE_TRIGRAM_SQL), run_with_pg_trgm(DROP_TRIGRAM_SQL)),
+    ]
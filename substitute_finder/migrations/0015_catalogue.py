@@ -0,0 +1,25 @@
+# Generated by Django 2.1.15 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0014_product_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Catalogue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='version')),
+                ('last_import', models.DateTimeField(blank=True, null=True, verbose_name='dernier import')),
+            ],
+            options={
+                'verbose_name': 'catalogue',
+                'verbose_name_plural': 'catalogue',
+            },
+        ),
+    ]
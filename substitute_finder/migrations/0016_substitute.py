@@ -0,0 +1,38 @@
+# Generated by Django 2.1.15 on 2026-10-18 09:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0015_catalogue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Substitute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(verbose_name='rang')),
+                ('shared_categories', models.PositiveIntegerField(verbose_name='catégories communes')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='substitutes', to='substitute_finder.Product')),
+                ('substitute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='substitute_of', to='substitute_finder.Product')),
+            ],
+            options={
+                'verbose_name': 'substitut',
+                'verbose_name_plural': 'substituts',
+                'ordering': ['product', 'rank'],
+            },
+        ),
+        migrations.AddField(
+            model_name='catalogue',
+            name='substitutes_updated',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='calcul des substituts'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='substitute',
+            unique_together={('product', 'rank')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.15 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0016_substitute'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogue',
+            name='metadata_updated',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='calcul des métadonnées'),
+        ),
+        migrations.AddField(
+            model_name='catalogue',
+            name='nb_categories',
+            field=models.PositiveIntegerField(default=0, verbose_name='nombre de catégories'),
+        ),
+        migrations.AddField(
+            model_name='catalogue',
+            name='nb_products',
+            field=models.PositiveIntegerField(default=0, verbose_name='nombre de produits'),
+        ),
+        migrations.AddField(
+            model_name='catalogue',
+            name='nutrition_grades',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='nutriscores'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.1.15 on 2026-10-18 09:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0017_catalogue_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchResult',
+            fields=[
+                ('id', models.CharField(max_length=16, primary_key=True, serialize=False, verbose_name='identifiant')),
+                ('terms', models.TextField(verbose_name='recherche')),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='dernière utilisation')),
+            ],
+            options={
+                'verbose_name': 'résultat de recherche',
+                'verbose_name_plural': 'résultats de recherche',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchResultProduct',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='position')),
+                ('weight', models.FloatField(verbose_name='poids')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_results', to='substitute_finder.Product')),
+                ('search', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='substitute_finder.SearchResult')),
+            ],
+            options={
+                'verbose_name': 'produit trouvé',
+                'verbose_name_plural': 'produits trouvés',
+                'ordering': ['search', 'position'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchresultproduct',
+            unique_together={('search', 'position')},
+        ),
+    ]
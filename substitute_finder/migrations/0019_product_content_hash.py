@@ -0,0 +1,28 @@
+# Generated by Django 2.1.15 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0018_search_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogue',
+            name='products_last_modified',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='dernière modification importée'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='empreinte des données'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='source_last_modified',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='dernière modification OpenFoodFacts'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.1.15 on 2026-10-18 10:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0019_product_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportPage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.PositiveIntegerField(verbose_name='page')),
+                ('status', models.CharField(choices=[('running', 'en cours'), ('done', 'terminé')], default='running', max_length=10, verbose_name='état')),
+                ('nb_elements', models.PositiveIntegerField(default=0, verbose_name='éléments importés')),
+                ('duration', models.FloatField(blank=True, null=True, verbose_name='durée (s)')),
+                ('started', models.DateTimeField(default=django.utils.timezone.now, verbose_name='début')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='fin')),
+            ],
+            options={
+                'verbose_name': 'page importée',
+                'verbose_name_plural': 'pages importées',
+                'ordering': ['run', 'page'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_page', models.PositiveIntegerField(default=1, verbose_name='première page')),
+                ('last_page', models.PositiveIntegerField(blank=True, null=True, verbose_name='dernière page')),
+                ('status', models.CharField(choices=[('running', 'en cours'), ('done', 'terminé'), ('abandoned', 'abandonné')], default='running', max_length=10, verbose_name='état')),
+                ('started', models.DateTimeField(auto_now_add=True, verbose_name='début')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='fin')),
+            ],
+            options={
+                'verbose_name': 'import',
+                'verbose_name_plural': 'imports',
+            },
+        ),
+        migrations.AddField(
+            model_name='importpage',
+            name='run',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='substitute_finder.ImportRun', verbose_name='import'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='importpage',
+            unique_together={('run', 'page')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0020_import_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importrun',
+            name='staging',
+            field=models.BooleanField(default=False, verbose_name='tables intermédiaires'),
+        ),
+    ]
@@ -0,0 +1,171 @@
+# Generated by Django 2.1.15 on 2026-10-18 10:15
+
+import math
+import re
+
+from django.db import migrations, models
+
+NUTRIENT_FIELDS = ['energy_100g', 'sugars_100g', 'sodium_100g', 'carbohydrates_100g', 'salt_100g', 'proteins_100g',
+                   'fat_100g', 'fiber_100g', 'saturated_fat_100g']
+UNIT_FIELDS = ['energy_unit', 'sugars_unit', 'carbohydrates_unit', 'salt_unit', 'proteins_unit', 'fat_unit',
+               'fiber_unit', 'saturated_fat_unit']
+
+# Nutrient strings are read like parse_number does, values which aren't numbers are set to NULL before
+# columns type is changed.
+CLEAN_NUTRIENT_SQL = [
+    """
+    UPDATE substitute_finder_product SET {0} = NULLIF(replace(ltrim(btrim({0}), '<>~ '), ',', '.'), '')
+    WHERE {0} IS NOT NULL;
+    """,
+    """
+    UPDATE substitute_finder_product SET {0} = NULL WHERE {0} !~ '^{regex}$';
+    """,
+]
+NUMBER_REGEX = r'[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]{1,3})?'
+
+# Units of NUTRIENT_UNIT_CHOICES by lower case spelling read in data
+NUTRIENT_UNITS = {'g': 'g', 'mg': 'mg', 'µg': 'µg', 'kj': 'kJ', 'kcal': 'kcal', '%': '%', 'μg': 'µg', 'mcg': 'µg',
+                  'ug': 'µg', '% vol': '%'}
+
+
+def parse_number(value):
+    """
+    Return a float read from a value like "12,5" or "< 0.5", None if value isn't a finite number.
+    Copy of models.parse_number when this migration was written.
+    """
+    if isinstance(value, str):
+        value = value.strip().lstrip('<>~ ').replace(',', '.')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def parse_nutrient_unit(value):
+    """
+    Return a unit of NUTRIENT_UNIT_CHOICES read from a value, None if unit is unknown.
+    Copy of models.parse_nutrient_unit when this migration was written.
+    """
+    if not isinstance(value, str):
+        return None
+    return NUTRIENT_UNITS.get(value.strip().lower())
+
+
+def clean_nutrients(apps, schema_editor):
+    """
+    Make nutrient values castable to numbers and normalise units to NUTRIENT_UNIT_CHOICES.
+    """
+    product_model = apps.get_model('substitute_finder', 'Product')
+    if schema_editor.connection.vendor == 'postgresql':
+        for field_name in NUTRIENT_FIELDS:
+            for statement in CLEAN_NUTRIENT_SQL:
+                schema_editor.execute(statement.format(schema_editor.quote_name(field_name), regex=NUMBER_REGEX))
+    else:
+        # Only rows with a value which isn't a plain number are updated
+        for row in product_model.objects.values_list('pk', *NUTRIENT_FIELDS).iterator():
+            if any(value is not None and not re.fullmatch(NUMBER_REGEX, str(value)) for value in row[1:]):
+                product_model.objects.filter(pk=row[0]).update(
+                    **{name: parse_number(value) for name, value in zip(NUTRIENT_FIELDS, row[1:])})
+
+    for field_name in UNIT_FIELDS:
+        units = product_model.objects.exclude(**{field_name: None}).values_list(field_name, flat=True).distinct()
+        for unit in list(units):
+            if parse_nutrient_unit(unit) != unit:
+                product_model.objects.filter(**{field_name: unit}).update(**{field_name: parse_nutrient_unit(unit)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substitute_finder', '0021_importrun_staging'),
+    ]
+
+    operations = [
+        migrations.RunPython(clean_nutrients, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='carbohydrates_100g',
+            field=models.FloatField(blank=True, null=True, verbose_name='Glucides pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='carbohydrates_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité glucides'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='energy_100g',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Valeur énergétique pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='energy_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité valeur énergétique'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='fat_100g',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Matières grasses pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='fat_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité matières grasses'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='fiber_100g',
+            field=models.FloatField(blank=True, null=True, verbose_name='Fibres pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='fiber_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité fibres alimentaires'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='proteins_100g',
+            field=models.FloatField(blank=True, null=True, verbose_name='Protéines pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='proteins_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité protéines'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='salt_100g',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Sel pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='salt_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité sel'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='saturated_fat_100g',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Acides gras saturés pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='saturated_fat_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité acides gras saturés'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='sodium_100g',
+            field=models.FloatField(blank=True, null=True, verbose_name='Sodium pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='sugars_100g',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Sucre pour 100g'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='sugars_unit',
+            field=models.CharField(blank=True, choices=[('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')], max_length=4, null=True, verbose_name='Unité sucre'),
+        ),
+    ]
@@ -2,16 +2,27 @@
 Define substitute_finder models
 """
 
+import hashlib
 import json
 import logging
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from itertools import islice
 
-import requests
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
+from django.db import connection, models, transaction
 from django.db.models import CASCADE
 from django.db.utils import IntegrityError
+from django.utils import timezone
+
+from . import api_client
+from .api_cache import get_list_cache
+from .json_stream import CHUNK_SIZE, iter_json_list
 
 __author__ = 'Tom Gabrièle'
 
@@ -39,6 +50,92 @@ def find_dict_value_for_nested_key(searched_key, container):
                         yield result
 
 
+NUTRIENT_UNIT_CHOICES = [('g', 'g'), ('mg', 'mg'), ('µg', 'µg'), ('kJ', 'kJ'), ('kcal', 'kcal'), ('%', '%')]
+
+# Units read in api data, by lower case spelling
+NUTRIENT_UNITS = {unit.lower(): unit for unit, _ in NUTRIENT_UNIT_CHOICES}
+NUTRIENT_UNITS.update({'μg': 'µg', 'mcg': 'µg', 'ug': 'µg', '% vol': '%'})
+
+
+def parse_number(value):
+    """
+    Return a float read from an api value like 12.5, "12,5" or "< 0.5", None if value isn't a finite number.
+    :param value: api value
+    """
+    if isinstance(value, str):
+        value = value.strip().lstrip('<>~ ').replace(',', '.')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def parse_nutrient_unit(value):
+    """
+    Return a unit of NUTRIENT_UNIT_CHOICES read from an api value, None if unit is unknown.
+    :param value: api value
+    """
+    if not isinstance(value, str):
+        return None
+    return NUTRIENT_UNITS.get(value.strip().lower())
+
+
+class NestedKeysExtractor:
+    """
+    Find values of several keys in nested dictionnaries with a single walk of the container.
+    For each key, found value is the first one yielded by find_dict_value_for_nested_key.
+    """
+
+    def __init__(self, searched_keys: list, renamed_keys: dict = None):
+        """
+        :param searched_keys: the keys used to find values
+        :type searched_keys: list
+        :param renamed_keys: names given to found values of some keys
+        :type renamed_keys: dict
+        """
+        renamed_keys = renamed_keys or {}
+        self.searched_keys = list(dict.fromkeys(searched_keys))
+        self.searched_keys_set = frozenset(self.searched_keys)
+        self.names = [(key, renamed_keys.get(key, key)) for key in self.searched_keys]
+
+    def walk(self, container, found: dict):
+        """
+        Store first value of searched keys in found, depth first like find_dict_value_for_nested_key.
+        Return True once all keys are found.
+        """
+        searched_keys = self.searched_keys_set
+        for key, value in container.items():
+            if key in searched_keys and key not in found:
+                found[key] = value
+                if len(found) == len(searched_keys):
+                    return True
+            # A found key may contain other searched keys
+            if isinstance(value, dict):
+                if self.walk(value, found):
+                    return True
+            elif isinstance(value, list):
+                for data in value:
+                    if hasattr(data, 'items') and self.walk(data, found):
+                        return True
+        return False
+
+    def extract(self, container):
+        """
+        Return a dict of found values by key name, in searched keys order.
+        :param container: object that contains searched keys
+        :type container: dict or list
+        """
+        found = {}
+        if hasattr(container, 'items'):
+            self.walk(container, found)
+        return {name: found[key] for key, name in self.names if key in found}
+
+
+# Field extractors by model and field names
+FIELD_EXTRACTORS = {}
+
+
 class CustomUser(AbstractUser):
     """
     Define a user identified by his/her email address.
@@ -65,6 +162,15 @@ class FromApiUpdateMixin:
         # json dict field : model field name
     }
     strict_required_field = []
+    field_parsers = {
+        # model field name : callable returning stored value from api value
+    }
+
+    # Optional incremental import: paginated data list sorted by last modification from the most recent one,
+    # field storing source last modification timestamp and field storing a hash of imported values
+    modified_list_url_template = ''
+    last_modified_field = None
+    content_hash_field = None
 
     @classmethod
     def get_list_api_url(cls, page: int = 1):
@@ -93,9 +199,154 @@ class FromApiUpdateMixin:
         return None
 
     @classmethod
-    def get_api_data_list(cls, nb_pages: int = None, start_page: int = 1, from_cache: bool = False):
+    def get_list_file_path(cls, custom_suffix: str = ''):
         """
-        Get data list from web api for model according to number of pages and start page constraints.
+        Return path of the cache file of a data list, named like write_api_data does.
+            :param custom_suffix: a suffix to custom file name, page number for paginated data list
+            :type custom_suffix: str
+        """
+        suffix = '_list_%s.json' % custom_suffix if custom_suffix else '_list.json'
+        return os.path.join(settings.JSON_DIR_PATH, "%s%s" % (cls._meta.model_name, suffix))
+
+    @classmethod
+    def get_list_cache(cls):
+        """
+        Return cache of data lists of the model, in API_CACHE_FORMAT setting format.
+        """
+        return get_list_cache(cls)
+
+    @classmethod
+    def iter_cached_data_list(cls, custom_suffix: str = ''):
+        """
+        Yield elements of a cached data list one at a time.
+            :param custom_suffix: a suffix to custom cache file name, page number for paginated data list
+            :type custom_suffix: str
+        """
+        yield from cls.get_list_cache().iter_elements(custom_suffix)
+
+    @classmethod
+    def iter_api_data_list_request(cls, url: str, custom_suffix: str = '', meta: dict = None):
+        """
+        Request a data list from web api and yield its elements while response is read, saving them into cache.
+        When cached data have validators, request is conditional and cached data are yielded if they didn't change.
+        Once all elements are yielded, meta dict contains response validators and pagination data
+        (skip, page_size, count), which are saved with cached data.
+            :param url: data list url
+            :type url: str
+            :param custom_suffix: a suffix to custom cache file name, page number for paginated data list
+            :type custom_suffix: str
+            :param meta: dict receiving response validators and pagination data
+            :type meta: dict
+        """
+        meta = meta if meta is not None else {}
+        cache = cls.get_list_cache()
+        meta.update(cache.get_meta(custom_suffix))
+
+        LOGGER.info("GETTING data for %s from %s", cls._meta.model_name, url)
+        response = api_client.get(url, etag=meta.get('etag'), last_modified=meta.get('last_modified'), stream=True)
+        with closing(response):
+            # Data didn't change since they have been cached
+            if response.status_code == 304:
+                LOGGER.info("NOT MODIFIED data for %s from %s, cache is used", cls._meta.model_name, url)
+                yield from cache.iter_elements(custom_suffix)
+                return
+
+            values = {}
+            response.encoding = response.encoding or 'utf-8'
+            elements = iter_json_list(response.iter_content(CHUNK_SIZE, decode_unicode=True), cls.list_data_key,
+                                      values)
+
+            # Save recovered data into cache as they are read, cache is replaced once all data are read
+            with cache.writer(custom_suffix) as writer:
+                for element in elements:
+                    writer.write(element)
+                    yield element
+
+                meta.clear()
+                meta.update({'etag': response.headers.get('ETag'),
+                             'last_modified': response.headers.get('Last-Modified')})
+                meta.update({key: values[key] for key in ('skip', 'page_size', 'count') if key in values})
+                writer.meta = meta
+
+    @classmethod
+    def request_api_data_list(cls, url: str, custom_suffix: str = ''):
+        """
+        Request a data list from web api and save it into cache with response validators and pagination data,
+        see iter_api_data_list_request. Return data list and a dict of response validators and pagination data.
+            :param url: data list url
+            :type url: str
+            :param custom_suffix: a suffix to custom cache file name, page number for paginated data list
+            :type custom_suffix: str
+        """
+        meta = {}
+        cleaned_data = list(cls.iter_api_data_list_request(url, custom_suffix=custom_suffix, meta=meta))
+        return cleaned_data, meta
+
+    @staticmethod
+    def is_last_page(meta: dict):
+        """
+        Return True if pagination data of a page show there are no more pages after.
+            :param meta: pagination data, see iter_api_data_list_request
+            :type meta: dict
+        """
+        if not meta:
+            return False
+        return meta['skip'] + meta['page_size'] >= meta['count']
+
+    @classmethod
+    def get_api_nb_pages(cls, from_cache: bool = False):
+        """
+        Return number of pages of paginated data list according to pagination data of its first page.
+            :param from_cache: if first page has been already recoverered with its pagination data, they are used
+            :type from_cache: bool
+        """
+        meta = cls.get_list_cache().get_meta(1) if from_cache else {}
+        if 'count' not in meta:
+            meta = {}
+            for _ in cls.iter_api_data_list_request(cls.get_list_api_url(page=1), custom_suffix=1, meta=meta):
+                pass
+        return max(math.ceil(meta['count'] / meta['page_size']), 1)
+
+    @classmethod
+    def iter_api_data_page(cls, page: int, from_cache: bool = False, meta: dict = None):
+        """
+        Yield elements of a page of paginated data list from web api, or from cache when it's possible.
+        Once all elements are yielded, meta dict contains pagination data of requested page, see is_last_page.
+            :param page: index of the page to recover
+            :type page: int
+            :param from_cache: if data have been already recoverered, it's possible to work with cached data
+            :type from_cache: bool
+            :param meta: dict receiving response validators and pagination data
+            :type meta: dict
+        """
+        # Work with cached data when available
+        if from_cache and cls.get_list_cache().exists(page):
+            LOGGER.info("GETTING data for %s from cache for page %s ", cls._meta.model_name, page)
+            yield from cls.iter_cached_data_list(page)
+            return
+
+        # Work with web api
+        yield from cls.iter_api_data_list_request(cls.get_list_api_url(page=page), custom_suffix=page, meta=meta)
+
+    @classmethod
+    def get_api_data_page(cls, page: int, from_cache: bool = False):
+        """
+        Get data of a page of paginated data list from web api, or from cache when it's possible.
+        Return page data and True if there are no more pages after.
+            :param page: index of the page to recover
+            :type page: int
+            :param from_cache: if data have been already recoverered, it's possible to work with cached data
+            :type from_cache: bool
+        """
+        meta = {}
+        cleaned_data = list(cls.iter_api_data_page(page, from_cache=from_cache, meta=meta))
+        return cleaned_data, cls.is_last_page(meta)
+
+    @classmethod
+    def iter_api_data_list(cls, nb_pages: int = None, start_page: int = 1, from_cache: bool = False):
+        """
+        Yield elements of data list from web api one at a time, according to number of pages and start page
+        constraints. Pages are read while elements are consumed: memory use doesn't depend on number of pages.
         Allow to get data from cache when it's possible.
             :param nb_pages : for paginated data list, indicate the max number of page to recover
             :type nb_pages: int
@@ -105,8 +356,6 @@ class FromApiUpdateMixin:
             :type from_cache: bool
         """
 
-        data = []
-
         # Deal with paginated data list
         if cls.paginated_data:
             page = start_page
@@ -114,30 +363,10 @@ class FromApiUpdateMixin:
 
             # Loop until there are no more data or until asked number of pages recovered is raised
             while go_next_page:
-                cleaned_data = []
-                suffix = '_list_%s.json' % page
-                file_path = os.path.join(settings.JSON_DIR_PATH, "%s%s" % (cls._meta.model_name, suffix))
-
-                # Work with cached data when available
-                if from_cache and os.path.exists(file_path):
-                    LOGGER.info("GETTING data for %s from cache for page %s ", cls._meta.model_name, page)
-                    with open(file_path, 'r') as file:
-                        cleaned_data = json.loads(file.read())
-
-                # Work with web api
-                else:
-                    LOGGER.info(
-                        "GETTING data for %s from %s", cls._meta.model_name, cls.get_list_api_url(page=page))
-                    page_data = requests.get(cls.get_list_api_url(page=page))
-                    temp_data = page_data.json()
-                    cleaned_data = temp_data[cls.list_data_key]
-
-                    # Save recovered data into cache
-                    cls.write_api_data(cleaned_data, custom_suffix=page)
-
-                    # check if there are no more pages after.
-                    if temp_data['skip'] + temp_data['page_size'] >= temp_data['count']:
-                        go_next_page = False
+                meta = {}
+                yield from cls.iter_api_data_page(page, from_cache=from_cache, meta=meta)
+                if cls.is_last_page(meta):
+                    go_next_page = False
 
                 # Prepare next page recovery
                 page += 1
@@ -146,33 +375,115 @@ class FromApiUpdateMixin:
                 if nb_pages and page >= nb_pages + start_page:
                     go_next_page = False
 
-                # Add data from the page to data list
-                data += cleaned_data
-
         # Deal with non paginated data list
         else:
-            suffix = '_list.json'
-            file_path = os.path.join(settings.JSON_DIR_PATH, "%s%s" % (cls._meta.model_name, suffix))
-
             # Work with cached data when available
-            if from_cache and os.path.exists(file_path):
+            if from_cache and cls.get_list_cache().exists():
                 LOGGER.info("GETTING data for %s from cache", cls._meta.model_name)
-                with open(file_path, 'r') as file:
-                    cleaned_data = json.loads(file.read())
+                yield from cls.iter_cached_data_list()
 
             # Work with web api
             else:
-                LOGGER.info("GETTING data for %s from %s",
-                            cls._meta.model_name, cls.get_list_api_url())
-                page_data = requests.get(cls.get_list_api_url())
-                temp_data = page_data.json()
-                cleaned_data = temp_data[cls.list_data_key]
+                yield from cls.iter_api_data_list_request(cls.get_list_api_url())
+
+    @classmethod
+    def iter_api_modified_data_list(cls, since: int = None, nb_pages: int = None, from_cache: bool = False):
+        """
+        Yield elements of data list sorted by last modification from the most recent one, page after page until
+        a page holds an element not modified since last incremental import.
+            :param since: source last modification timestamp of last incremental import, all pages by default
+            :type since: int
+            :param nb_pages: indicate the max number of page to recover
+            :type nb_pages: int
+            :param from_cache: if data have been already recoverered, it's possible to work with cached data
+            :type from_cache: bool
+        """
+        last_modified_key = cls.get_last_modified_key()
+        page = 1
+        go_next_page = True
+        while go_next_page:
+            custom_suffix = 'modified_%s' % page
+            meta = {}
+            if from_cache and cls.get_list_cache().exists(custom_suffix):
+                LOGGER.info("GETTING data for %s from cache for page %s ", cls._meta.model_name, custom_suffix)
+                elements = cls.iter_cached_data_list(custom_suffix)
+            else:
+                elements = cls.iter_api_data_list_request(cls.modified_list_url_template.format(page=page),
+                                                          custom_suffix=custom_suffix, meta=meta)
+
+            nb_elements = 0
+            for element in elements:
+                nb_elements += 1
+                last_modified = element.get(last_modified_key)
+                if since is not None and last_modified is not None and int(last_modified) <= since:
+                    go_next_page = False
+                yield element
+
+            page += 1
+            if not nb_elements or cls.is_last_page(meta) or (nb_pages and page > nb_pages):
+                go_next_page = False
+
+    @classmethod
+    def get_api_data_list(cls, nb_pages: int = None, start_page: int = 1, from_cache: bool = False,
+                          concurrency: int = None):
+        """
+        Get data list from web api for model according to number of pages and start page constraints.
+        Allow to get data from cache when it's possible.
+            :param nb_pages : for paginated data list, indicate the max number of page to recover
+            :type nb_pages: int
+            :param start_page: for paginated data list, indicate the index of the page to start recovery from
+            :type start_page: int
+            :param from_cache: if data have been already recoverered, it's possible to work with cached data
+            :type from_cache: bool
+            :param concurrency: for paginated data list, number of pages recovered in parallel,
+            API_CONCURRENCY setting by default
+            :type concurrency: int
+        """
+        if cls.paginated_data:
+            concurrency = concurrency or settings.API_CONCURRENCY
+            if concurrency > 1:
+                return cls.get_api_data_list_concurrently(nb_pages, start_page, from_cache, concurrency)
 
-            # Save recovered data into cache
-            cls.write_api_data(cleaned_data)
+        return list(cls.iter_api_data_list(nb_pages=nb_pages, start_page=start_page, from_cache=from_cache))
 
-            # Add data from the page to data list
-            data += cleaned_data
+    @classmethod
+    def get_api_data_list_concurrently(cls, nb_pages: int = None, start_page: int = 1, from_cache: bool = False,
+                                       concurrency: int = 4):
+        """
+        Get paginated data list like get_api_data_list does, recovering pages by batches of concurrent requests.
+        Pages of a batch following the last one are requested for nothing, their data is ignored.
+            :param nb_pages : indicate the max number of page to recover
+            :type nb_pages: int
+            :param start_page: indicate the index of the page to start recovery from
+            :type start_page: int
+            :param from_cache: if data have been already recoverered, it's possible to work with cached data
+            :type from_cache: bool
+            :param concurrency: number of pages recovered in parallel
+            :type concurrency: int
+        """
+        data = []
+        page = start_page
+        last_page = start_page + nb_pages - 1 if nb_pages else None
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            go_next_page = True
+            while go_next_page:
+                batch_end = page + concurrency - 1
+                if last_page is not None:
+                    batch_end = min(batch_end, last_page)
+                pages = range(page, batch_end + 1)
+
+                # results are returned in pages order
+                for cleaned_data, is_last_page in executor.map(
+                        lambda batch_page: cls.get_api_data_page(batch_page, from_cache=from_cache), pages):
+                    data += cleaned_data
+                    if is_last_page:
+                        go_next_page = False
+                        break
+
+                page = batch_end + 1
+                if last_page is not None and page > last_page:
+                    go_next_page = False
 
         return data
 
@@ -187,9 +498,7 @@ class FromApiUpdateMixin:
         # Check if api url exists for element
         if cls.get_element_api_url(element_id):
             LOGGER.info("GETTING data for %s from %s", cls._meta.model_name, cls.get_element_api_url(element_id))
-            data = requests.get(cls.get_element_api_url(element_id))
-            temp_data = data.json()
-            cleaned_data = temp_data
+            cleaned_data = api_client.get_json(cls.get_element_api_url(element_id))
             return cleaned_data[cls.element_data_key]
         return None
 
@@ -216,8 +525,7 @@ class FromApiUpdateMixin:
             suffix = '_list%s' % suffix_extension
 
         # Check and create storage directory if it doesn't exists
-        if not os.path.exists(settings.JSON_DIR_PATH):
-            os.mkdir(settings.JSON_DIR_PATH)
+        os.makedirs(settings.JSON_DIR_PATH, exist_ok=True)
 
         # Define file path
         file_path = os.path.join(
@@ -229,37 +537,391 @@ class FromApiUpdateMixin:
         return file_path
 
     @classmethod
-    def insert_data(cls, data: list or dict, strict_required_field_mode: bool = False, data_filters: dict = None):
+    def get_data_field_names(cls):
+        """
+        Return names of keys read in data elements: model field names, replaced by their json name when they differ.
+        """
+        field_names = [f.name for f in cls._meta.get_fields()]
+        for key in cls.field_correspondances:
+            field_names.append(key)
+            field_names.remove(cls.field_correspondances[key])
+        return field_names
+
+    @classmethod
+    def get_field_extractor(cls, field_names: list, renamed: bool = True):
+        """
+        Return extractor of field_names values from data elements, built once by model and field names.
+            :param field_names: keys read in data element, see get_data_field_names
+            :type field_names: list
+            :param renamed: if True, values are named by model field names instead of data keys
+            :type renamed: bool
+        """
+        extractor_key = (cls, tuple(field_names), renamed)
+        if extractor_key not in FIELD_EXTRACTORS:
+            FIELD_EXTRACTORS[extractor_key] = NestedKeysExtractor(
+                field_names, cls.field_correspondances if renamed else None)
+        return FIELD_EXTRACTORS[extractor_key]
+
+    @classmethod
+    def project_data_element(cls, data_element: dict):
+        """
+        Return a flat dict of the data element values read by normalize_data_element, keyed by data keys.
+        Projected element is normalised like data element.
+            :param data_element: data of an element from api
+            :type data_element: dict
+        """
+        field_names = cls.get_data_field_names()
+        if cls._meta.pk.name not in field_names:
+            field_names.append(cls._meta.pk.name)
+        projected = cls.get_field_extractor(field_names, renamed=False).extract(data_element)
+        projected[cls._meta.pk.name] = data_element[cls._meta.pk.name]
+        return projected
+
+    @classmethod
+    def normalize_data_element(cls, data_element: dict, field_names: list, strict_required_field_mode: bool = False,
+                               filters: dict = None):
+        """
+        Extract model values from a data element. Return None if element must be ignored,
+        else a tuple of primary key value, fields values dict and list of many to many fields values dicts.
+            :param data_element: data of an element from api
+            :type data_element: dict
+            :param field_names: keys read in data element, see get_data_field_names
+            :type field_names: list
+            :param strict_required_field_mode: if True, a missing required field leads to cancel element insert
+            :type strict_required_field_mode: bool
+            :param filters: a dict of filters to define which elements should be inserted
+            :type filters: dict
+        """
+        filters = filters or {}
+
+        value_dict = cls.get_field_extractor(field_names).extract(data_element)
+        for key, parse in cls.field_parsers.items():
+            if key in value_dict:
+                value_dict[key] = parse(value_dict[key])
+
+        # ignore element if strict mode is activated and value of strict_required_field are not provided
+        if strict_required_field_mode and cls.has_missing_required_field(value_dict):
+            LOGGER.warning("STRICT MODE is activated data for %s : %s will be ignored", cls._meta.model_name,
+                           value_dict)
+            return None
+
+        # Find value of primary key
+        pk_value = data_element[cls._meta.pk.name]
+
+        # Store keys and values from many to many fields
+        many_to_many_data = [{field.name: value_dict.pop(field.name)} for field in cls._meta.many_to_many
+                             if field.name in value_dict]
+
+        if not cls.satisfies_filters(value_dict, many_to_many_data, filters):
+            return None
+
+        if cls.content_hash_field:
+            value_dict[cls.content_hash_field] = cls.get_content_hash(value_dict, many_to_many_data)
+
+        return pk_value, value_dict, many_to_many_data
+
+    @classmethod
+    def has_missing_required_field(cls, value_dict: dict):
+        """
+        Return True if a strict required field value is missing or empty.
+            :param value_dict: fields values extracted from a data element
+            :type value_dict: dict
+        """
+        return any(value is None or value == '' for key, value in value_dict.items()
+                   if key in cls.strict_required_field)
+
+    @classmethod
+    def satisfies_filters(cls, value_dict: dict, many_to_many_data: list, filters: dict):
         """
-        Create as many model instances as needed according to data provided
-            :param data: data collection to insert in database
+        Check element values with data filters. Return False if element must be ignored: many to many values
+        filtered field values don't include any filter value. Unsatisfied filters on other fields are only logged.
+            :param value_dict: fields values extracted from a data element
+            :type value_dict: dict
+            :param many_to_many_data: list of many to many fields values dicts
+            :type many_to_many_data: list
+            :param filters: a dict of filters to define which elements should be inserted
+            :type filters: dict
+        """
+        # check data with data_filters
+        for key, value in value_dict.items():
+            if key in filters and value not in filters[key]:
+                LOGGER.warning("FILTER %s on %s is not satisfied for %s : %s will be ignored", filters[key],
+                               key, cls._meta.model_name, value_dict)
+
+        # check many to many data with data_filters
+        ignore_element = False
+        for many_to_many_element in many_to_many_data:
+            for key, values in many_to_many_element.items():
+                if filters.get(key) is not None:
+                    ignore_element = not any(value in filters[key] for value in values)
+
+        if ignore_element:
+            LOGGER.warning("FILTERS %s on many to many fields are not satisfied for %s : %s will be ignored",
+                           filters, cls._meta.model_name, value_dict)
+        return not ignore_element
+
+    @classmethod
+    def get_content_hash(cls, value_dict: dict, many_to_many_data: list):
+        """
+        Return a hash of imported values of an element, source last modification timestamp excepted.
+            :param value_dict: fields values returned by normalize_data_element
+            :type value_dict: dict
+            :param many_to_many_data: list of many to many fields values dicts
+            :type many_to_many_data: list
+        """
+        values = {key: value for key, value in value_dict.items()
+                  if key not in (cls.last_modified_field, cls.content_hash_field)}
+        for many_to_many_element in many_to_many_data:
+            for key, related_values in many_to_many_element.items():
+                values[key] = sorted(related_values)
+        content = json.dumps(values, sort_keys=True, default=str)
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_last_modified_key(cls):
+        """
+        Return data key of last modification timestamp.
+        """
+        keys = {field: key for key, field in cls.field_correspondances.items()}
+        return keys.get(cls.last_modified_field, cls.last_modified_field)
+
+    @classmethod
+    def filter_changed_elements(cls, elements: list, since: int = None):
+        """
+        Return normalised elements which have changed: elements modified after since timestamp
+        whose content hash differs from the stored one.
+            :param elements: elements returned by normalize_data_element
+            :type elements: list
+            :param since: source last modification timestamp of last incremental import
+            :type since: int
+        """
+        if since is not None and cls.last_modified_field:
+            elements = [element for element in elements if element[1].get(cls.last_modified_field) is None
+                        or int(element[1][cls.last_modified_field]) > since]
+        if cls.content_hash_field and elements:
+            pk_values = {cls._meta.pk.to_python(pk_value) for pk_value, _, _ in elements}
+            stored_hashes = dict(cls.objects.filter(pk__in=pk_values).values_list('pk', cls.content_hash_field))
+            elements = [element for element in elements if stored_hashes.get(cls._meta.pk.to_python(element[0]))
+                        != element[1][cls.content_hash_field]]
+        return elements
+
+    @staticmethod
+    def add_many_to_many_data(element, many_to_many_data: list):
+        """
+        Add many to many fields values to a saved element, ignoring unknown related elements.
+            :param element: saved model instance
+            :param many_to_many_data: list of many to many fields values dicts
+            :type many_to_many_data: list
+        """
+        for many_to_many_element in many_to_many_data:
+            for key, values in many_to_many_element.items():
+                field = getattr(element, key)
+                for value in values:
+                    try:
+                        # a savepoint keeps a surrounding transaction usable after an error
+                        with transaction.atomic():
+                            field.add(value)
+                    except IntegrityError:
+                        LOGGER.error("Error during add of %s in field %s of %s. %s will be ignored.", value, field,
+                                     element, value
+                                     )
+
+    @classmethod
+    def save_data_element(cls, pk_value, value_dict: dict, many_to_many_data: list):
+        """
+        Create or update an element in database from values returned by normalize_data_element.
+            :param pk_value: primary key value
+            :param value_dict: fields values
+            :type value_dict: dict
+            :param many_to_many_data: list of many to many fields values dicts
+            :type many_to_many_data: list
+        """
+        # Create or update element in database
+        new_element, created = cls.objects.update_or_create(pk=pk_value, defaults=value_dict)
+
+        # Add many to many fields values
+        cls.add_many_to_many_data(new_element, many_to_many_data)
+
+        LOGGER.info("JUST %s %s in %s ", "CREATE" if created else "UPDATE", new_element, cls._meta.model_name)
+        return new_element
+
+    @classmethod
+    def get_upsert_sql(cls, columns: list, update_columns: list, nb_rows: int):
+        """
+        Return an INSERT ... ON CONFLICT DO UPDATE query of nb_rows rows, updating some columns of existing rows.
+        Supported by PostgreSQL and SQLite 3.24+.
+            :param columns: inserted columns
+            :type columns: list
+            :param update_columns: columns updated when a row with the same primary key exists
+            :type update_columns: list
+            :param nb_rows: number of inserted rows
+            :type nb_rows: int
+        """
+        quote = connection.ops.quote_name
+        placeholders = '(%s)' % ', '.join(['%s'] * len(columns))
+        sql = 'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) ' % (
+            quote(cls._meta.db_table), ', '.join(quote(column) for column in columns),
+            ', '.join([placeholders] * nb_rows), quote(cls._meta.pk.column))
+        if not update_columns:
+            return sql + 'DO NOTHING'
+        return sql + 'DO UPDATE SET %s' % ', '.join(
+            '%s = EXCLUDED.%s' % (quote(column), quote(column)) for column in update_columns)
+
+    @classmethod
+    def bulk_save_data_elements(cls, elements: list):
+        """
+        Create or update elements returned by normalize_data_element with a few INSERT ... ON CONFLICT queries,
+        in one transaction. Only provided fields of existing elements are updated, like update_or_create does.
+        Return numbers of created and updated elements.
+            :param elements: list of (primary key value, fields values dict, many to many fields values) tuples
+            :type elements: list
+        """
+        # Last element wins when an element is provided twice, like successive update_or_create calls.
+        # Rows are written in primary key order so that concurrent imports lock them in the same order.
+        to_python = cls._meta.pk.to_python
+        elements = sorted({to_python(pk_value): (to_python(pk_value), value_dict, many_to_many_data)
+                           for pk_value, value_dict, many_to_many_data in elements}.values(),
+                          key=lambda element: element[0])
+        if not elements:
+            return 0, 0
+
+        fields = list(cls._meta.concrete_fields)
+        fields_by_name = {field.name: field for field in fields}
+        auto_now_fields = [field for field in fields if getattr(field, 'auto_now', False)]
+        instances = [cls(pk=pk_value, **{key: value for key, value in value_dict.items() if key in fields_by_name})
+                     for pk_value, value_dict, _ in elements]
+
+        # New rows get default values of missing fields but existing rows are only updated with provided fields,
+        # so rows are grouped by provided fields
+        groups = {}
+        for instance, (_, value_dict, _) in zip(instances, elements):
+            update_fields = [fields_by_name[key] for key in sorted(value_dict)
+                             if key in fields_by_name and not fields_by_name[key].primary_key]
+            update_fields += [field for field in auto_now_fields if field not in update_fields]
+            groups.setdefault(tuple(update_fields), []).append(instance)
+
+        with transaction.atomic():
+            existing = set(cls.objects.filter(pk__in=[instance.pk for instance in instances])
+                           .values_list('pk', flat=True))
+            with connection.cursor() as cursor:
+                for update_fields, group in groups.items():
+                    # Query parameters number is only limited on SQLite
+                    batch_size = max(connection.ops.bulk_batch_size(fields, group), 1)
+                    for index in range(0, len(group), batch_size):
+                        batch = group[index:index + batch_size]
+                        params = [field.get_db_prep_save(field.pre_save(instance, add=True), connection)
+                                  for instance in batch for field in fields]
+                        cursor.execute(cls.get_upsert_sql([field.column for field in fields],
+                                                          [field.column for field in update_fields], len(batch)),
+                                       params)
+
+            cls.bulk_set_many_to_many_data([(instance.pk, many_to_many_data)
+                                            for instance, (_, _, many_to_many_data) in zip(instances, elements)])
+
+        nb_updated = 0
+        for instance in instances:
+            updated = instance.pk in existing
+            nb_updated += updated
+            LOGGER.info("JUST %s %s in %s ", "UPDATE" if updated else "CREATE", instance, cls._meta.model_name)
+        LOGGER.info("BULK %s created, %s updated in %s", len(instances) - nb_updated, nb_updated,
+                    cls._meta.model_name)
+        return len(instances) - nb_updated, nb_updated
+
+    @classmethod
+    def bulk_set_many_to_many_data(cls, elements: list):
+        """
+        Set many to many fields values of saved elements with one insert and one delete query per field:
+        links to unknown related elements are ignored and links missing from provided values are removed.
+        Fields without provided values are left unchanged.
+            :param elements: list of (primary key value, list of many to many fields values dicts) tuples
+            :type elements: list
+        """
+        quote = connection.ops.quote_name
+        for field in cls._meta.many_to_many:
+            links = {}
+            for pk_value, many_to_many_data in elements:
+                for many_to_many_element in many_to_many_data:
+                    if field.name in many_to_many_element:
+                        links[pk_value] = set(many_to_many_element[field.name])
+            if not links:
+                continue
+
+            through = field.remote_field.through
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            related_model = field.remote_field.model
+
+            # Links to unknown related elements are ignored
+            values = set().union(*links.values())
+            known = set(related_model.objects.filter(pk__in=values).values_list('pk', flat=True))
+            for pk_value, related_values in links.items():
+                for value in related_values - known:
+                    LOGGER.error("Error during add of %s in field %s of %s. %s will be ignored.", value, field.name,
+                                 pk_value, value)
+                related_values &= known
+
+            # Remove links missing from provided values
+            existing = {(pk_value, value): link_id for link_id, pk_value, value in through.objects.filter(
+                **{'%s__in' % source: list(links)}).values_list('pk', source, target)}
+            wanted = {(pk_value, value) for pk_value, related_values in links.items() for value in related_values}
+            stale = [existing[link] for link in set(existing) - wanted]
+            if stale:
+                through.objects.filter(pk__in=stale).delete()
+
+            # Add new links, ignoring links added meanwhile
+            new_links = sorted(wanted - set(existing))
+            columns = [through._meta.get_field(source).column, through._meta.get_field(target).column]
+            batch_size = max(connection.ops.bulk_batch_size(columns, new_links), 1)
+            with connection.cursor() as cursor:
+                for index in range(0, len(new_links), batch_size):
+                    batch = new_links[index:index + batch_size]
+                    cursor.execute('INSERT INTO %s (%s) VALUES %s ON CONFLICT DO NOTHING' % (
+                        quote(through._meta.db_table), ', '.join(quote(column) for column in columns),
+                        ', '.join(['(%s, %s)'] * len(batch))), [value for link in batch for value in link])
+
+    @classmethod
+    def get_data_filters(cls, data_filters: dict = None, field_names: list = None):
+        """
+        Keep filters on keys read in data elements.
+            :param data_filters: a dict of filters to define which elements should be inserted
+            :type data_filters: dict
+            :param field_names: keys read in data elements, see get_data_field_names
+            :type field_names: list
+        """
+        field_names = field_names or cls.get_data_field_names()
+        if isinstance(data_filters, dict):
+            return {key: value for key, value in data_filters.items() if key in field_names}
+        return dict()
+
+    @classmethod
+    def insert_data(cls, data: list or dict, strict_required_field_mode: bool = False, data_filters: dict = None,
+                    bulk: bool = False, batch_size: int = None, incremental: bool = False, since: int = None):
+        """
+        Create as many model instances as needed according to data provided. Return number of provided elements.
+            :param data: data collection to insert in database, or an iterable of data elements
+            like iter_api_data_list returns
             :type data: list or dict
             :param strict_required_field_mode: if True, a missing required field leads to cancel element insert
             :type strict_required_field_mode: bool
             :param data_filters: a dict of filters to define which elements should be inserted
             :type data_filters: dict
+            :param bulk: if True, elements are written with a few bulk queries, see bulk_save_data_elements
+            :type bulk: bool
+            :param batch_size: number of elements read from data then written at once,
+            IMPORT_BATCH_SIZE setting by default
+            :type batch_size: int
+            :param incremental: if True, unchanged elements are not written, see filter_changed_elements
+            :type incremental: bool
+            :param since: source last modification timestamp of last incremental import
+            :type since: int
         """
 
         LOGGER.info("CREATE/UPDATE data for %s ", cls._meta.model_name)
 
         # Define model field names
-        field_names = [f.name for f in cls._meta.get_fields()]
+        field_names = cls.get_data_field_names()
 
         # clean data_filters
-
-        for key in cls.field_correspondances:
-            field_names.append(key)
-            field_names.remove(cls.field_correspondances[key])
-
-        filters = dict()
-        if isinstance(data_filters, dict):
-            filters = {key: value for key, value in data_filters.items() if key in field_names}
-
-        # Define primary key name
-        primary_key_field_name = cls._meta.pk.name
-
-        # Define many to many field names
-        many_to_many_field_names = [f.name for f in cls._meta.many_to_many]
+        filters = cls.get_data_filters(data_filters, field_names)
 
         data_list = []
 
@@ -269,91 +931,28 @@ class FromApiUpdateMixin:
         else:
             data_list = data
 
-        # Deal with data list
-        for data_element in data_list:
-            value_dict = {}
-            for field in field_names:
-                result = [result for result in find_dict_value_for_nested_key(field, data_element)]
-                if result:
-                    if field in cls.field_correspondances.keys():
-                        new_key = cls.field_correspondances[field]
-                        value_dict[new_key] = result[0][1]
-                    else:
-                        value_dict[field] = result[0][1]
-
-            # ignore element if strict mode is activated and value of strict_required_field are not provided
-            ignore_element = False
-            if strict_required_field_mode:
-
-                empty_value_dict = {key: value for key, value in value_dict.items() if value is None or value == ''}
-                for key in empty_value_dict.keys():
-                    if key in cls.strict_required_field:
-                        ignore_element = True
-
-            if ignore_element:
-                LOGGER.warning("STRICT MODE is activated data for %s : %s will be ignored", cls._meta.model_name,
-                               value_dict)
-                continue
-            # List keys from element in list which are not used by model
-            # unused_keys = [
-            #     key for key in data_element.keys() if key not in field_names]
-
-            # Find value of primary key
-            pk_value = data_element[primary_key_field_name]
-
-            many_to_many_data = []
-
-            # Remove unused keys from element
-            # for key in unused_keys:
-            #     del data_element[key]
-
-            # Store keys and values from many to many fields
-            for key in many_to_many_field_names:
-                if key in value_dict.keys():
-                    many_to_many_data.append({key: value_dict.pop(key)})
-
-            # check data with data_filters
-            for key in value_dict:
-                if key in filters.keys():
-                    if value_dict[key] not in filters[key]:
-                        LOGGER.warning("FILTER %s on %s is not satisfied for %s : %s will be ignored", filters[key],
-                                       key, cls._meta.model_name, value_dict)
-                        continue
-
-            # check many to many data with data_filters
-            for many_to_many_element in many_to_many_data:
-                for key, values in many_to_many_element.items():
-                    if key in filters.keys() and filters[key] is not None:
-                        ignore_element = True
-                        for value in many_to_many_element[key]:
-                            if value in filters[key]:
-                                ignore_element = False
-                                break
-
-            if ignore_element:
-                LOGGER.warning("FILTERS %s on many to many fields are not satisfied for %s : %s will be ignored",
-                               filters, cls._meta.model_name, value_dict)
-                continue
-
-                # if value_dict[key] not in data_filters[key]:
-                #     continue
-
-            # Create or update element in database
-            new_element, created = cls.objects.update_or_create(pk=pk_value, defaults=value_dict)
-
-            # Add many to many fields values
-            for many_to_many_element in many_to_many_data:
-                for key, values in many_to_many_element.items():
-                    field = getattr(new_element, key)
-                    for value in values:
-                        try:
-                            field.add(value)
-                        except IntegrityError:
-                            LOGGER.error("Error during add of %s in field %s of %s. %s will be ignored.", value, field,
-                                         new_element, value
-                                         )
-
-            LOGGER.info("JUST %s %s in %s ", "CREATE" if created else "UPDATE", new_element, cls._meta.model_name)
+        # Deal with data list by batches so that memory use doesn't depend on data size
+        data_iterator = iter(data_list)
+        batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        nb_data_elements = 0
+        while True:
+            batch = list(islice(data_iterator, batch_size))
+            if not batch:
+                return nb_data_elements
+            nb_data_elements += len(batch)
+
+            elements = (cls.normalize_data_element(data_element, field_names, strict_required_field_mode, filters)
+                        for data_element in batch)
+            elements = [element for element in elements if element is not None]
+            if incremental:
+                nb_elements = len(elements)
+                elements = cls.filter_changed_elements(elements, since)
+                LOGGER.info("SKIP %s unchanged elements of %s", nb_elements - len(elements), cls._meta.model_name)
+            if bulk:
+                cls.bulk_save_data_elements(elements)
+            else:
+                for element in elements:
+                    cls.save_data_element(*element)
 
 
 class Product(FromApiUpdateMixin, models.Model):
@@ -365,10 +964,14 @@ class Product(FromApiUpdateMixin, models.Model):
     element_url_template = 'https://fr.openfoodfacts.org/api/v0/produit/{id}.json'
     list_data_key = 'products'
     element_data_key = 'product'
+    modified_list_url_template = list_url_template + '?sort_by=last_modified_t'
     field_correspondances = {
         'saturated-fat_100g': 'saturated_fat_100g',
-        'saturated-fat_unit': 'saturated_fat_unit'
+        'saturated-fat_unit': 'saturated_fat_unit',
+        'last_modified_t': 'source_last_modified',
     }
+    last_modified_field = 'source_last_modified'
+    content_hash_field = 'content_hash'
     strict_required_field = [
         'generic_name', 'energy_100g', 'sugars_100g', 'sodium_100g', 'carbohydrates_100g', 'salt_100g',
         'proteins_100g',
@@ -376,6 +979,12 @@ class Product(FromApiUpdateMixin, models.Model):
         'sodium_100g', 'carbohydrates_100g', 'salt_100g', 'proteins_100g', 'fat_100g', 'fiber_100g',
         'saturated_fat_100g', 'nutrition_grade_fr'
     ]
+    field_parsers = {
+        **dict.fromkeys(['energy_100g', 'sugars_100g', 'sodium_100g', 'carbohydrates_100g', 'salt_100g',
+                         'proteins_100g', 'fat_100g', 'fiber_100g', 'saturated_fat_100g'], parse_number),
+        **dict.fromkeys(['energy_unit', 'sugars_unit', 'carbohydrates_unit', 'salt_unit', 'proteins_unit', 'fat_unit',
+                         'fiber_unit', 'saturated_fat_unit'], parse_nutrient_unit),
+    }
 
     code = models.CharField(
         primary_key=True, verbose_name='identifiant', max_length=300)
@@ -390,36 +999,48 @@ class Product(FromApiUpdateMixin, models.Model):
         verbose_name='score nutritionnel', max_length=1)
     image_front_small_url = models.URLField(verbose_name='url de la miniature', max_length=2000)
     image_url = models.URLField(verbose_name='url de l\'image', max_length=2000)
-    energy_100g = models.CharField(verbose_name="Valeur énergétique pour 100g", blank=True, null=True, max_length=300)
-    sugars_100g = models.CharField(verbose_name="Sucre pour 100g", blank=True, null=True, max_length=300)
-    sodium_100g = models.CharField(verbose_name="Sodium pour 100g", blank=True, null=True, max_length=300)
-    carbohydrates_100g = models.CharField(verbose_name="Glucides pour 100g",
-                                          blank=True, null=True, max_length=300)
-    salt_100g = models.CharField(verbose_name="Sel pour 100g", blank=True, null=True, max_length=300)
-    proteins_100g = models.CharField(verbose_name="Protéines pour 100g", blank=True, null=True, max_length=300)
-    fat_100g = models.CharField(verbose_name="Matières grasses pour 100g", blank=True, null=True, max_length=300)
-    fiber_100g = models.CharField(verbose_name="Fibres pour 100g", blank=True, null=True, max_length=300)
-    saturated_fat_100g = models.CharField(verbose_name="Acides gras saturés pour 100g",
-                                          blank=True, null=True, max_length=300)
-
-    energy_unit = models.CharField(verbose_name="Unité valeur énergétique", blank=True, null=True, max_length=300)
-    sugars_unit = models.CharField(verbose_name="Unité sucre", blank=True, null=True, max_length=300)
-    carbohydrates_unit = models.CharField(verbose_name="Unité glucides",
-                                          blank=True, null=True, max_length=300)
-    salt_unit = models.CharField(verbose_name="Unité sel", blank=True, null=True, max_length=300)
-    proteins_unit = models.CharField(verbose_name="Unité protéines", blank=True, null=True, max_length=300)
-    fat_unit = models.CharField(verbose_name="Unité matières grasses", blank=True, null=True, max_length=300)
-    fiber_unit = models.CharField(verbose_name="Unité fibres alimentaires", blank=True, null=True, max_length=300)
-    saturated_fat_unit = models.CharField(verbose_name="Unité acides gras saturés",
-                                          blank=True, null=True, max_length=300)
+    energy_100g = models.FloatField(verbose_name="Valeur énergétique pour 100g", blank=True, null=True,
+                                    db_index=True)
+    sugars_100g = models.FloatField(verbose_name="Sucre pour 100g", blank=True, null=True, db_index=True)
+    sodium_100g = models.FloatField(verbose_name="Sodium pour 100g", blank=True, null=True)
+    carbohydrates_100g = models.FloatField(verbose_name="Glucides pour 100g", blank=True, null=True)
+    salt_100g = models.FloatField(verbose_name="Sel pour 100g", blank=True, null=True, db_index=True)
+    proteins_100g = models.FloatField(verbose_name="Protéines pour 100g", blank=True, null=True)
+    fat_100g = models.FloatField(verbose_name="Matières grasses pour 100g", blank=True, null=True, db_index=True)
+    fiber_100g = models.FloatField(verbose_name="Fibres pour 100g", blank=True, null=True)
+    saturated_fat_100g = models.FloatField(verbose_name="Acides gras saturés pour 100g", blank=True, null=True,
+                                           db_index=True)
+
+    energy_unit = models.CharField(verbose_name="Unité valeur énergétique", blank=True, null=True, max_length=4,
+                                   choices=NUTRIENT_UNIT_CHOICES)
+    sugars_unit = models.CharField(verbose_name="Unité sucre", blank=True, null=True, max_length=4,
+                                   choices=NUTRIENT_UNIT_CHOICES)
+    carbohydrates_unit = models.CharField(verbose_name="Unité glucides", blank=True, null=True, max_length=4,
+                                          choices=NUTRIENT_UNIT_CHOICES)
+    salt_unit = models.CharField(verbose_name="Unité sel", blank=True, null=True, max_length=4,
+                                 choices=NUTRIENT_UNIT_CHOICES)
+    proteins_unit = models.CharField(verbose_name="Unité protéines", blank=True, null=True, max_length=4,
+                                     choices=NUTRIENT_UNIT_CHOICES)
+    fat_unit = models.CharField(verbose_name="Unité matières grasses", blank=True, null=True, max_length=4,
+                                choices=NUTRIENT_UNIT_CHOICES)
+    fiber_unit = models.CharField(verbose_name="Unité fibres alimentaires", blank=True, null=True, max_length=4,
+                                  choices=NUTRIENT_UNIT_CHOICES)
+    saturated_fat_unit = models.CharField(verbose_name="Unité acides gras saturés", blank=True, null=True,
+                                          max_length=4, choices=NUTRIENT_UNIT_CHOICES)
 
     last_updated = models.DateTimeField(
         verbose_name='dernière mise à jour', auto_now=True)
+    source_last_modified = models.BigIntegerField(verbose_name='dernière modification OpenFoodFacts', blank=True,
+                                                  null=True)
+    content_hash = models.CharField(verbose_name='empreinte des données', max_length=32, blank=True, default='')
     categories_tags = models.ManyToManyField(
         to='Category', verbose_name='categories')
     users = models.ManyToManyField(
         to='CustomUser', related_name='favorite', verbose_name='utilisateurs')
 
+    # Filled by a database trigger on PostgreSQL, see migration 0013
+    search_vector = SearchVectorField(verbose_name='index de recherche', null=True, editable=False)
+
     class Meta:
         verbose_name = 'Produit'
         verbose_name_plural = 'Produits'
@@ -472,3 +1093,281 @@ class Comment(models.Model):
 
     def __str__(self):
         return f'{self.product} : {self.user}'
+
+
+class Substitute(models.Model):
+    """
+    Define a precomputed substitute of a product: a product with a better nutrition grade sharing categories with it.
+    Rank orders substitutes of a product by nutrition grade then number of shared categories.
+    """
+    product = models.ForeignKey('Product', on_delete=CASCADE, related_name='substitutes')
+    substitute = models.ForeignKey('Product', on_delete=CASCADE, related_name='substitute_of')
+    rank = models.PositiveIntegerField(verbose_name='rang')
+    shared_categories = models.PositiveIntegerField(verbose_name='catégories communes')
+
+    class Meta:
+        verbose_name = 'substitut'
+        verbose_name_plural = 'substituts'
+        ordering = ['product', 'rank']
+        unique_together = (('product', 'rank'),)
+
+    def __str__(self):
+        return f'{self.product} : {self.substitute}'
+
+
+class SearchResult(models.Model):
+    """
+    Define a stored search result, shared by users searching same terms until eviction.
+    Its short id, kept in session, is derived from searched terms, search engine and catalogue version.
+    """
+    id = models.CharField(primary_key=True, verbose_name='identifiant', max_length=16)
+    terms = models.TextField(verbose_name='recherche')
+    last_used = models.DateTimeField(verbose_name='dernière utilisation', default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = 'résultat de recherche'
+        verbose_name_plural = 'résultats de recherche'
+
+    def __str__(self):
+        return self.terms
+
+
+class SearchResultProduct(models.Model):
+    """
+    Define a product found by a stored search, with its position and relevancy weight.
+    """
+    search = models.ForeignKey('SearchResult', on_delete=CASCADE, related_name='products')
+    product = models.ForeignKey('Product', on_delete=CASCADE, related_name='search_results')
+    position = models.PositiveIntegerField(verbose_name='position')
+    weight = models.FloatField(verbose_name='poids')
+
+    class Meta:
+        verbose_name = 'produit trouvé'
+        verbose_name_plural = 'produits trouvés'
+        ordering = ['search', 'position']
+        unique_together = (('search', 'position'),)
+
+    def __str__(self):
+        return f'{self.search} : {self.product}'
+
+
+class Catalogue(models.Model):
+    """
+    Define catalogue state, a single row updated at the end of each import.
+    Version is used in cache keys of data computed from products, so that a new import drops them at once.
+    Metadata (nutrition grades, products and categories counts) are computed at import time
+    and read through cache by product page, admin and api.
+    """
+    metadata_cache_key = 'catalogue:metadata'
+
+    version = models.PositiveIntegerField(verbose_name='version', default=0)
+    last_import = models.DateTimeField(verbose_name='dernier import', blank=True, null=True)
+    substitutes_updated = models.DateTimeField(verbose_name='calcul des substituts', blank=True, null=True)
+    nutrition_grades = models.CharField(verbose_name='nutriscores', max_length=20, blank=True, default='')
+    nb_products = models.PositiveIntegerField(verbose_name='nombre de produits', default=0)
+    nb_categories = models.PositiveIntegerField(verbose_name='nombre de catégories', default=0)
+    metadata_updated = models.DateTimeField(verbose_name='calcul des métadonnées', blank=True, null=True)
+    products_last_modified = models.BigIntegerField(verbose_name='dernière modification importée', blank=True,
+                                                    null=True)
+
+    class Meta:
+        verbose_name = 'catalogue'
+        verbose_name_plural = 'catalogue'
+
+    def __str__(self):
+        return f'catalogue v{self.version}'
+
+    @classmethod
+    def get(cls):
+        """
+        Return catalogue state.
+        """
+        return cls.objects.get_or_create(pk=1)[0]
+
+    @classmethod
+    def get_version(cls):
+        """
+        Return catalogue version.
+        """
+        version = cls.objects.filter(pk=1).values_list('version', flat=True).first()
+        return version or 0
+
+    @classmethod
+    def new_version(cls):
+        """
+        Increment catalogue version and compute metadata after an import.
+        """
+        cls.get()
+        cls.objects.filter(pk=1).update(version=models.F('version') + 1, last_import=timezone.now())
+        return cls.update_metadata()
+
+    @classmethod
+    def update_products_last_modified(cls):
+        """
+        Store most recent source last modification of products after an incremental import and return it.
+        """
+        catalogue = cls.get()
+        last_modified = Product.objects.aggregate(last_modified=models.Max('source_last_modified'))['last_modified']
+        if last_modified is not None:
+            catalogue.products_last_modified = max(last_modified, catalogue.products_last_modified or 0)
+            catalogue.save(update_fields=['products_last_modified'])
+        return catalogue.products_last_modified
+
+    @classmethod
+    def update_metadata(cls):
+        """
+        Compute catalogue metadata from products and categories.
+        """
+        catalogue = cls.get()
+        grades = Product.objects.order_by().values_list('nutrition_grade_fr', flat=True).distinct()
+        catalogue.nutrition_grades = ''.join(sorted(grade for grade in grades if grade))
+        catalogue.nb_products = Product.objects.count()
+        catalogue.nb_categories = Category.objects.count()
+        catalogue.metadata_updated = timezone.now()
+        catalogue.save(update_fields=['nutrition_grades', 'nb_products', 'nb_categories', 'metadata_updated'])
+        cache.delete(cls.metadata_cache_key)
+        return catalogue
+
+    @classmethod
+    def get_metadata(cls):
+        """
+        Return catalogue metadata dict, kept in cache CATALOGUE_METADATA_CACHE_TIMEOUT seconds.
+        """
+        metadata = cache.get(cls.metadata_cache_key)
+        if metadata is None:
+            catalogue = cls.get()
+            if catalogue.metadata_updated is None:
+                catalogue = cls.update_metadata()
+            metadata = {
+                'version': catalogue.version,
+                'last_import': catalogue.last_import,
+                'substitutes_updated': catalogue.substitutes_updated,
+                'nutrition_grades': list(catalogue.nutrition_grades),
+                'nb_products': catalogue.nb_products,
+                'nb_categories': catalogue.nb_categories,
+            }
+            cache.set(cls.metadata_cache_key, metadata, settings.CATALOGUE_METADATA_CACHE_TIMEOUT)
+        return metadata
+
+
+class ImportRun(models.Model):
+    """
+    Define an api_to_db run importing a range of products pages. Each page is checkpointed once written,
+    so that an interrupted run is resumed at its first unfinished page.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    ABANDONED = 'abandoned'
+    STATUS_CHOICES = [(RUNNING, 'en cours'), (DONE, 'terminé'), (ABANDONED, 'abandonné')]
+
+    start_page = models.PositiveIntegerField(verbose_name='première page', default=1)
+    last_page = models.PositiveIntegerField(verbose_name='dernière page', blank=True, null=True)
+    status = models.CharField(verbose_name='état', max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    staging = models.BooleanField(verbose_name='tables intermédiaires', default=False)
+    started = models.DateTimeField(verbose_name='début', auto_now_add=True)
+    finished = models.DateTimeField(verbose_name='fin', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'import'
+        verbose_name_plural = 'imports'
+
+    def __str__(self):
+        return f'import {self.pk} (pages {self.start_page} - {self.last_page or "..."})'
+
+    @classmethod
+    def start(cls, start_page: int = 1, last_page: int = None, resume: bool = True, staging: bool = False):
+        """
+        Return last unfinished run written in the same tables when resume is True and there is one, else a new run.
+        Other unfinished runs are abandoned.
+            :param start_page: first page of new run
+            :type start_page: int
+            :param last_page: last page of new run, pages are imported until last api page by default
+            :type last_page: int
+            :param resume: resume last unfinished run
+            :type resume: bool
+            :param staging: run writes into staging tables, see staging module
+            :type staging: bool
+        """
+        run = None
+        if resume:
+            run = cls.objects.filter(status=cls.RUNNING, staging=staging).order_by('-pk').first()
+        if run is None:
+            run = cls.objects.create(start_page=start_page, last_page=last_page, staging=staging)
+        else:
+            LOGGER.info("RESUME %s from page %s", run, run.get_first_unfinished_page())
+        cls.objects.filter(status=cls.RUNNING).exclude(pk=run.pk).update(status=cls.ABANDONED,
+                                                                         finished=timezone.now())
+        return run
+
+    def get_done_pages(self):
+        """
+        Return set of written pages.
+        """
+        return set(self.pages.filter(status=ImportPage.DONE).values_list('page', flat=True))
+
+    def get_first_unfinished_page(self):
+        """
+        Return first page of run which hasn't been written.
+        """
+        done_pages = self.get_done_pages()
+        page = self.start_page
+        while page in done_pages:
+            page += 1
+        return page
+
+    def page_started(self, page: int):
+        """
+        Checkpoint a page whose import starts.
+            :param page: page number
+            :type page: int
+        """
+        ImportPage.objects.update_or_create(run=self, page=page, defaults={
+            'status': ImportPage.RUNNING, 'nb_elements': 0, 'duration': None, 'started': timezone.now(),
+            'finished': None})
+
+    def page_done(self, page: int, nb_elements: int, duration: float):
+        """
+        Checkpoint a written page.
+            :param page: page number
+            :type page: int
+            :param nb_elements: number of imported elements
+            :type nb_elements: int
+            :param duration: import duration in seconds
+            :type duration: float
+        """
+        ImportPage.objects.update_or_create(run=self, page=page, defaults={
+            'status': ImportPage.DONE, 'nb_elements': nb_elements, 'duration': duration, 'finished': timezone.now()})
+
+    def finish(self):
+        """
+        Mark run as done: next run starts a new pages range.
+        """
+        self.status = self.DONE
+        self.finished = timezone.now()
+        self.save(update_fields=['status', 'finished'])
+
+
+class ImportPage(models.Model):
+    """
+    Define import state of a page in an api_to_db run.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [(RUNNING, 'en cours'), (DONE, 'terminé')]
+
+    run = models.ForeignKey(to=ImportRun, on_delete=CASCADE, related_name='pages', verbose_name='import')
+    page = models.PositiveIntegerField(verbose_name='page')
+    status = models.CharField(verbose_name='état', max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    nb_elements = models.PositiveIntegerField(verbose_name='éléments importés', default=0)
+    duration = models.FloatField(verbose_name='durée (s)', blank=True, null=True)
+    started = models.DateTimeField(verbose_name='début', default=timezone.now)
+    finished = models.DateTimeField(verbose_name='fin', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'page importée'
+        verbose_name_plural = 'pages importées'
+        unique_together = ('run', 'page')
+        ordering = ['run', 'page']
+
+    def __str__(self):
+        return f'page {self.page} ({self.status})'
@@ -0,0 +1,235 @@
+"""
+Pipelined import of paginated api data: fetch, normalise and write stages run concurrently,
+connected by bounded queues so that a slow stage slows down the previous ones instead of piling up pages in memory.
+
+Fetch and normalise stages run in threads, write stage runs in calling thread which owns the database connection.
+An error in any stage stops the other ones and is raised by run().
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+# Put into a queue by a stage when it has no more items for next stage
+END = object()
+
+
+class StageCounter:
+    """
+    Count items and pages processed by a stage and time spent processing them.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.nb_pages = 0
+        self.nb_items = 0
+        self.busy_time = 0.0
+
+    def add(self, nb_items: int, busy_time: float):
+        """
+        Count a processed page.
+        """
+        self.nb_pages += 1
+        self.nb_items += nb_items
+        self.busy_time += busy_time
+
+    def __str__(self):
+        rate = self.nb_items / self.busy_time if self.busy_time else 0
+        return "%s: %s pages, %s items, %.2fs busy, %.1f items/s" % (
+            self.name, self.nb_pages, self.nb_items, self.busy_time, rate)
+
+
+class StopPipeline(Exception):
+    """
+    Raised in a stage when another stage failed.
+    """
+
+
+class ImportPipeline:
+    """
+    Import pages of a FromApiUpdateMixin model from start_page until last page (or last_page) through three stages.
+    """
+
+    def __init__(self, model, start_page: int = 1, last_page: int = None, from_cache: bool = False,
+                 strict_required_field_mode: bool = False, data_filters: dict = None, concurrency: int = 1,
+                 queue_size: int = 4, on_page_started=None, on_page_written=None, bulk: bool = False,
+                 skipped_pages: set = None):
+        """
+        :param model: model using FromApiUpdateMixin with paginated data
+        :param start_page: first page to import
+        :type start_page: int
+        :param last_page: last page to import, pages are imported until the last api page by default
+        :type last_page: int
+        :param from_cache: get data from cache when it's possible
+        :type from_cache: bool
+        :param strict_required_field_mode: if True, a missing required field leads to cancel element insert
+        :type strict_required_field_mode: bool
+        :param data_filters: a dict of filters to define which elements should be inserted
+        :type data_filters: dict
+        :param concurrency: number of pages fetched in parallel
+        :type concurrency: int
+        :param queue_size: max number of pages waiting between two stages
+        :type queue_size: int
+        :param on_page_started: callable called with page number before a page is written
+        :param on_page_written: callable called with page number, number of fetched elements of page and write
+        duration once a page has been written
+        :param bulk: write each page with a few bulk queries
+        :type bulk: bool
+        :param skipped_pages: pages which aren't imported, like pages already written by an interrupted run
+        :type skipped_pages: set
+        """
+        self.model = model
+        self.start_page = start_page
+        self.last_page = last_page
+        self.from_cache = from_cache
+        self.strict_required_field_mode = strict_required_field_mode
+        self.field_names = model.get_data_field_names()
+        self.filters = model.get_data_filters(data_filters, self.field_names)
+        self.concurrency = max(concurrency or 1, 1)
+        self.on_page_started = on_page_started
+        self.on_page_written = on_page_written
+        self.bulk = bulk
+        self.skipped_pages = skipped_pages or set()
+
+        self.fetched = queue.Queue(maxsize=queue_size)
+        self.normalized = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.errors = []
+        self.counters = {name: StageCounter(name) for name in ('fetch', 'normalise', 'write')}
+
+    def put(self, item_queue: queue.Queue, item):
+        """
+        Put item in queue, waiting for room unless pipeline is stopped.
+        """
+        while not self.stop.is_set():
+            try:
+                item_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise StopPipeline()
+
+    def get(self, item_queue: queue.Queue):
+        """
+        Get item from queue, waiting for one unless pipeline is stopped.
+        """
+        while not self.stop.is_set():
+            try:
+                return item_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise StopPipeline()
+
+    def run_stage(self, stage, output_queue: queue.Queue):
+        """
+        Run a threaded stage, then tell next stage there are no more items, or stop pipeline on error.
+        """
+        try:
+            stage()
+            self.put(output_queue, END)
+        except StopPipeline:
+            pass
+        except Exception as exc:  # pylint: disable=broad-except
+            LOGGER.exception("PIPELINE stage failed")
+            self.errors.append(exc)
+            self.stop.set()
+
+    def fetch_pages(self):
+        """
+        Fetch stage: get pages data by batches of concurrent requests, in pages order. Skipped pages aren't fetched.
+        """
+        counter = self.counters['fetch']
+
+        def fetch(page):
+            start = time.perf_counter()
+            data, is_last_page = self.model.get_api_data_page(page, from_cache=self.from_cache)
+            return page, data, is_last_page, time.perf_counter() - start
+
+        page = self.start_page
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while self.last_page is None or page <= self.last_page:
+                batch_end = page + self.concurrency - 1
+                if self.last_page is not None:
+                    batch_end = min(batch_end, self.last_page)
+                pages = [number for number in range(page, batch_end + 1) if number not in self.skipped_pages]
+                for fetched_page, data, is_last_page, busy_time in executor.map(fetch, pages):
+                    # concurrent requests share stage time
+                    counter.add(len(data), busy_time / self.concurrency)
+                    if data:
+                        self.put(self.fetched, (fetched_page, data))
+                    if is_last_page or not data:
+                        return
+                page = batch_end + 1
+
+    def normalize_pages(self):
+        """
+        Normalise stage: extract model values from elements of fetched pages.
+        """
+        counter = self.counters['normalise']
+        while True:
+            item = self.get(self.fetched)
+            if item is END:
+                return
+            page, data = item
+            start = time.perf_counter()
+            elements = [self.model.normalize_data_element(element, self.field_names, self.strict_required_field_mode,
+                                                          self.filters) for element in data]
+            elements = [element for element in elements if element is not None]
+            counter.add(len(elements), time.perf_counter() - start)
+            self.put(self.normalized, (page, elements, len(data)))
+
+    def write_pages(self):
+        """
+        Write stage: save normalised elements into database.
+        """
+        counter = self.counters['write']
+        while True:
+            item = self.get(self.normalized)
+            if item is END:
+                return
+            page, elements, nb_fetched = item
+            if self.on_page_started:
+                self.on_page_started(page)
+            start = time.perf_counter()
+            if self.bulk:
+                self.model.bulk_save_data_elements(elements)
+            else:
+                for element in elements:
+                    self.model.save_data_element(*element)
+            busy_time = time.perf_counter() - start
+            counter.add(len(elements), busy_time)
+            if self.on_page_written:
+                self.on_page_written(page, nb_fetched, busy_time)
+
+    def run(self):
+        """
+        Run pipeline until all pages are written, log stages counters and return number of written pages.
+        """
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self.run_stage, args=(self.fetch_pages, self.fetched), name='pipeline-fetch'),
+            threading.Thread(target=self.run_stage, args=(self.normalize_pages, self.normalized),
+                             name='pipeline-normalise'),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            self.write_pages()
+        except StopPipeline:
+            pass
+        except Exception:
+            self.stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            LOGGER.info("PIPELINE %s in %.2fs", self.model._meta.model_name, time.perf_counter() - start)
+            for counter in self.counters.values():
+                LOGGER.info("PIPELINE %s", counter)
+
+        if self.errors:
+            raise self.errors[0]
+        return self.counters['write'].nb_pages
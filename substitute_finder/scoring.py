@@ -0,0 +1,131 @@
+"""
+Nutrient based substitutes: products of the same categories with no more sugars, salt and saturated fat than the
+substituted product, ranked by their weighted distance to it so that closest alternatives come first.
+
+Nutrient values of products of a category are loaded into a matrix (one row by product, one column by nutrient of
+SUBSTITUTE_NUTRIENT_WEIGHTS), kept in cache under the catalogue version so that an import drops it. Candidates are
+filtered and scored for a whole matrix at once.
+"""
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Catalogue, Product
+
+LOGGER = logging.getLogger(__name__)
+
+# Nutrients whose value of a healthier alternative can't be higher, other weighted nutrients (energy) only have to be
+# close.
+LOWER_IS_HEALTHIER = ['sugars_100g', 'salt_100g', 'saturated_fat_100g']
+
+
+def get_nutrients():
+    """
+    Return names of nutrient fields used for scoring, in matrices column order.
+    """
+    return sorted(settings.SUBSTITUTE_NUTRIENT_WEIGHTS)
+
+
+def get_matrix_cache_key(version: int, category_id: str):
+    """
+    Return cache key of nutrient matrix of a category.
+        :param version: catalogue version
+        :type version: int
+        :param category_id: category primary key
+        :type category_id: str
+    """
+    return 'nutrients:%s:%s:%s' % (version, ','.join(get_nutrients()), category_id)
+
+
+def load_nutrient_matrix(category_id: str):
+    """
+    Return (codes, matrix, scales) of products of a category whose scored nutrients are all known: an array of
+    product codes, a float matrix of their nutrient values, and the standard deviation of each nutrient column
+    (1 where values don't vary) used to compare nutrients of different magnitudes.
+        :param category_id: category primary key
+        :type category_id: str
+    """
+    nutrients = get_nutrients()
+    products = Product.objects.filter(categories_tags=category_id, **{'%s__isnull' % name: False
+                                                                      for name in nutrients})
+    rows = list(products.order_by('pk').values_list('pk', *nutrients))
+    codes = np.array([row[0] for row in rows], dtype=object)
+    matrix = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), len(nutrients))
+    scales = matrix.std(axis=0) if rows else np.ones(len(nutrients))
+    scales[scales == 0] = 1
+    return codes, matrix, scales
+
+
+def get_nutrient_matrices(category_ids: list):
+    """
+    Return nutrient matrices of categories by category like load_nutrient_matrix returns them, read from cache with
+    a single query and kept in cache NUTRIENT_MATRIX_CACHE_TIMEOUT seconds.
+        :param category_ids: categories primary keys
+        :type category_ids: list
+    """
+    version = Catalogue.get_version()
+    keys = {get_matrix_cache_key(version, category_id): category_id for category_id in category_ids}
+    cached = cache.get_many(list(keys))
+    missing = {key: load_nutrient_matrix(category_id) for key, category_id in keys.items() if key not in cached}
+    if missing:
+        cache.set_many(missing, settings.NUTRIENT_MATRIX_CACHE_TIMEOUT)
+        cached.update(missing)
+    return {keys[key]: matrices for key, matrices in cached.items()}
+
+
+def score_candidates(vector, matrix, scales, weights, lower_columns):
+    """
+    Return weighted distances of matrix rows to a nutrient vector, infinite for rows which aren't healthier: rows
+    with a higher value in a lower_columns column, or without any lower value in these columns.
+        :param vector: nutrient values of substituted product
+        :param matrix: nutrient values of candidates, one row by candidate
+        :param scales: divisor of each column differences
+        :param weights: weight of each column
+        :param lower_columns: boolean mask of columns whose value can't be higher
+    """
+    differences = (matrix - vector) / scales
+    lower = differences[:, lower_columns]
+    healthier = (lower <= 0).all(axis=1) & (lower < 0).any(axis=1)
+    distances = np.sqrt((weights * differences ** 2).sum(axis=1))
+    distances[~healthier] = np.inf
+    return distances
+
+
+def get_healthier_alternatives(product: Product, limit: int = None, category_ids: list = None):
+    """
+    Return closest healthier alternatives of a product found in its categories, closest first.
+        :param product: substituted product
+        :type product: Product
+        :param limit: max number of alternatives, HEALTHIER_ALTERNATIVES_MAX setting by default
+        :type limit: int
+        :param category_ids: primary keys of product categories when they are already known
+        :type category_ids: list
+    """
+    limit = limit or settings.HEALTHIER_ALTERNATIVES_MAX
+    nutrients = get_nutrients()
+    vector = np.array([getattr(product, name) for name in nutrients], dtype=float)
+    if np.isnan(vector).any():
+        return []
+    weights = np.array([settings.SUBSTITUTE_NUTRIENT_WEIGHTS[name] for name in nutrients], dtype=float)
+    lower_columns = np.array([name in LOWER_IS_HEALTHIER for name in nutrients])
+
+    start = time.perf_counter()
+    best = {}
+    if category_ids is None:
+        category_ids = product.categories_tags.values_list('pk', flat=True)
+    for codes, matrix, scales in get_nutrient_matrices(category_ids).values():
+        if not codes.size:
+            continue
+        distances = score_candidates(vector, matrix, scales, weights, lower_columns)
+        closest = np.argpartition(distances, limit)[:limit] if len(distances) > limit else np.arange(len(codes))
+        for code, distance in zip(codes[closest], distances[closest]):
+            if np.isfinite(distance) and code != product.pk and distance < best.get(code, np.inf):
+                best[code] = distance
+
+    codes = sorted(best, key=lambda code: (best[code], code))[:limit]
+    products = Product.objects.in_bulk(codes)
+    LOGGER.debug("ALTERNATIVES %s of %s found in %.3fs", len(codes), product.pk, time.perf_counter() - start)
+    return [products[code] for code in codes if code in products]
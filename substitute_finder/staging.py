@@ -0,0 +1,268 @@
+"""
+Staging imports on PostgreSQL: catalogue tables (categories, products and their links) are copied into a staging
+schema, an import writes into them while the site keeps reading live tables, then staging tables replace live ones
+in one short transaction.
+
+Staging tables are found before live ones through connection search_path, so that models write into them unchanged.
+Favorites and comments are never staged: products they reference are copied back into staging tables before swap
+and their foreign keys are moved to new tables. Other rows referencing a product or a category which isn't in
+new tables, like substitutes, are deleted.
+"""
+import logging
+import re
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+
+from .cleanup import get_referencing_columns
+from .models import Category, Comment, Product
+
+LOGGER = logging.getLogger(__name__)
+
+
+def quote(name: str):
+    """
+    Return quoted schema, table or column name.
+    """
+    return connection.ops.quote_name(name)
+
+
+def get_staged_models():
+    """
+    Return models whose tables are staged, referenced models first.
+    """
+    return [Category, Product, Product.categories_tags.through]
+
+
+def get_kept_models():
+    """
+    Return models whose rows referencing products are never deleted by a staging import.
+    """
+    return [Product.users.through, Comment]
+
+
+def fetchall(sql: str, params: list = None):
+    """
+    Execute a query and return its rows.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def execute(*statements: str):
+    """
+    Execute statements in order.
+    """
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+@contextmanager
+def use_schema(schema: str):
+    """
+    Context manager making tables of a schema hide tables of the same name for queries of current connection,
+    and of connections opened meanwhile.
+        :param schema: schema name
+        :type schema: str
+    """
+    previous = fetchall("SHOW search_path")[0][0]
+    statement = "SET search_path TO %s, %s" % (quote(schema), previous)
+
+    def set_search_path(connection, **kwargs):  # pylint: disable=redefined-outer-name,unused-argument
+        with connection.cursor() as cursor:
+            cursor.execute(statement)
+
+    connection_created.connect(set_search_path, weak=False)
+    execute(statement)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(set_search_path)
+        execute("SET search_path TO %s" % previous)
+
+
+class StagingImport:
+    """
+    Copy, index and swap staging tables of catalogue models.
+    """
+
+    def __init__(self, schema: str = None):
+        """
+        :param schema: staging schema name, IMPORT_STAGING_SCHEMA setting by default
+        :type schema: str
+        """
+        self.schema = schema or settings.IMPORT_STAGING_SCHEMA
+        self.replaced_schema = '%s_replaced' % self.schema
+        self.live_schema = fetchall("SELECT current_schema()")[0][0]
+        self.tables = [model._meta.db_table for model in get_staged_models()]
+
+    def live(self, table: str):
+        """
+        Return qualified name of a live table.
+        """
+        return '%s.%s' % (quote(self.live_schema), quote(table))
+
+    def staged(self, table: str):
+        """
+        Return qualified name of a staging table.
+        """
+        return '%s.%s' % (quote(self.schema), quote(table))
+
+    def exists(self):
+        """
+        Return True if staging schema exists.
+        """
+        return bool(fetchall("SELECT 1 FROM pg_namespace WHERE nspname = %s", [self.schema]))
+
+    def use(self):
+        """
+        Context manager making queries of current connection read and write staging tables.
+        """
+        return use_schema(self.schema)
+
+    def get_definitions(self, sql: str, table: str):
+        """
+        Return definitions of objects of a live table read by sql, where live table name is replaced by staging one.
+            :param sql: query of definitions of table objects, with table oid as parameter
+            :type sql: str
+            :param table: live table name
+            :type table: str
+        """
+        table_regex = re.compile(r' ON (ONLY )?("?%s"?\.)?"?%s"? ' % (re.escape(self.live_schema), re.escape(table)))
+        return [table_regex.sub(' ON %s ' % self.staged(table), row[0], count=1)
+                for row in fetchall(sql, [self.live(table)])]
+
+    def get_constraints(self, table: str, types: str):
+        """
+        Return (name, definition) pairs of constraints of a live table.
+            :param table: live table name
+            :type table: str
+            :param types: constraint types, like 'pu' for primary key and unique constraints
+            :type types: str
+        """
+        return fetchall("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                        "WHERE conrelid = %s::regclass AND contype = ANY(%s) ORDER BY conname",
+                        [self.live(table), list(types)])
+
+    def add_constraints(self, types: str):
+        """
+        Add constraints of live tables to staging tables. Referenced tables are staging ones when they are staged.
+            :param types: constraint types, see get_constraints
+            :type types: str
+        """
+        # Definitions are read before staging tables hide live ones, so that referenced tables aren't qualified
+        statements = ["ALTER TABLE %s ADD CONSTRAINT %s %s" % (self.staged(table), quote(name), definition)
+                      for table in self.tables for name, definition in self.get_constraints(table, types)]
+        with self.use():
+            execute(*statements)
+
+    def prepare(self):
+        """
+        Replace staging schema with copies of live tables and of their rows, with their primary keys and unique
+        constraints used by imports. Triggers are copied too.
+        """
+        start = time.perf_counter()
+        execute("DROP SCHEMA IF EXISTS %s CASCADE" % quote(self.schema), "CREATE SCHEMA %s" % quote(self.schema))
+        for table in self.tables:
+            execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)" % (self.staged(table), self.live(table)),
+                    "INSERT INTO %s SELECT * FROM %s" % (self.staged(table), self.live(table)))
+            execute(*self.get_definitions("SELECT pg_get_triggerdef(oid) FROM pg_trigger "
+                                          "WHERE tgrelid = %s::regclass AND NOT tgisinternal", table))
+        self.add_constraints('pu')
+        LOGGER.info("STAGING tables copied into %s in %.3fs", self.schema, time.perf_counter() - start)
+
+    def build_indexes(self):
+        """
+        Add indexes, checks and foreign keys of live tables to staging tables, then analyze them.
+        """
+        start = time.perf_counter()
+        for table in self.tables:
+            execute(*self.get_definitions(
+                "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i WHERE i.indrelid = %s::regclass "
+                "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid "
+                "AND c.conrelid = i.indrelid AND c.contype IN ('p', 'u', 'x'))", table))
+        self.add_constraints('cf')
+        execute(*["ANALYZE %s" % self.staged(table) for table in self.tables])
+        LOGGER.info("STAGING indexes built in %.3fs", time.perf_counter() - start)
+
+    def get_references(self):
+        """
+        Return (referenced model, table, column, constraint name, constraint definition, kept) tuples of foreign keys
+        of tables which aren't staged referencing staged tables, kept being True for tables of get_kept_models.
+        """
+        kept_tables = {model._meta.db_table for model in get_kept_models()}
+        references = []
+        for model in get_staged_models()[:2]:
+            for table, column in get_referencing_columns(model):
+                if table in self.tables:
+                    continue
+                rows = fetchall("SELECT c.conname, pg_get_constraintdef(c.oid) FROM pg_constraint c "
+                                "INNER JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1] "
+                                "WHERE c.contype = 'f' AND c.conrelid = %s::regclass "
+                                "AND c.confrelid = %s::regclass AND a.attname = %s",
+                                [self.live(table), self.live(model._meta.db_table), column])
+                for name, definition in rows:
+                    references.append((model, table, column, name, definition, table in kept_tables))
+        return references
+
+    def swap(self):
+        """
+        Replace live tables with staging ones in one transaction, then drop replaced tables.
+        Return number of deleted rows referencing products or categories missing from new tables.
+        """
+        start = time.perf_counter()
+        nb_deleted = 0
+        execute("DROP SCHEMA IF EXISTS %s CASCADE" % quote(self.replaced_schema))
+        with transaction.atomic():
+            # Deferred foreign key checks would prevent dropping foreign keys
+            execute("SET CONSTRAINTS ALL IMMEDIATE")
+            references = self.get_references()
+            for _, table, _, name, _, _ in references:
+                execute("ALTER TABLE %s DROP CONSTRAINT %s" % (self.live(table), quote(name)))
+
+            # Products of favorites and comments are kept
+            product_table, product_pk = Product._meta.db_table, quote(Product._meta.pk.column)
+            kept_conditions = ["EXISTS (SELECT 1 FROM %s k WHERE k.%s = p.%s)" % (self.live(table), quote(column),
+                                                                                  product_pk)
+                               for model, table, column, _, _, kept in references if kept and model is Product]
+            if kept_conditions:
+                execute("INSERT INTO %s SELECT * FROM %s p WHERE NOT EXISTS (SELECT 1 FROM %s s WHERE s.%s = p.%s) "
+                        "AND (%s)" % (self.staged(product_table), self.live(product_table),
+                                      self.staged(product_table), product_pk, product_pk, ' OR '.join(kept_conditions)))
+
+            sequences = fetchall("SELECT pg_get_serial_sequence(t, a.attname), t, a.attname "
+                                 "FROM unnest(%s::text[]) t INNER JOIN pg_attribute a ON a.attrelid = t::regclass "
+                                 "WHERE a.attnum > 0 AND NOT a.attisdropped "
+                                 "AND pg_get_serial_sequence(t, a.attname) IS NOT NULL",
+                                 [[self.live(table) for table in self.tables]])
+            execute("CREATE SCHEMA %s" % quote(self.replaced_schema))
+            execute(*["ALTER SEQUENCE %s OWNED BY NONE" % sequence for sequence, _, _ in sequences])
+            execute(*["ALTER TABLE %s SET SCHEMA %s" % (self.live(table), quote(self.replaced_schema))
+                      for table in self.tables])
+            execute(*["ALTER TABLE %s SET SCHEMA %s" % (self.staged(table), quote(self.live_schema))
+                      for table in self.tables])
+            execute(*["ALTER SEQUENCE %s OWNED BY %s.%s" % (sequence, table, quote(column))
+                      for sequence, table, column in sequences])
+
+            with connection.cursor() as cursor:
+                for model, table, column, name, definition, kept in references:
+                    if not kept:
+                        cursor.execute("DELETE FROM {table} t WHERE t.{column} IS NOT NULL AND NOT EXISTS "
+                                       "(SELECT 1 FROM {referenced} r WHERE r.{pk} = t.{column})".format(
+                                           table=self.live(table), column=quote(column),
+                                           referenced=self.live(model._meta.db_table),
+                                           pk=quote(model._meta.pk.column)))
+                        nb_deleted += cursor.rowcount
+                    cursor.execute("ALTER TABLE %s ADD CONSTRAINT %s %s NOT VALID" % (
+                        self.live(table), quote(name), definition))
+        LOGGER.info("STAGING tables swapped in %.3fs", time.perf_counter() - start)
+
+        execute("DROP SCHEMA %s CASCADE" % quote(self.replaced_schema), "DROP SCHEMA %s" % quote(self.schema))
+        execute(*["ALTER TABLE %s VALIDATE CONSTRAINT %s" % (self.live(table), quote(name))
+                  for _, table, _, name, _, _ in references])
+        return nb_deleted
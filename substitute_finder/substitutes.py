@@ -0,0 +1,126 @@
+"""
+Precomputed substitutes: for each product, products with a better nutrition grade sharing at least one category,
+ranked by nutrition grade then number of shared categories.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Catalogue, Product, Substitute
+
+LOGGER = logging.getLogger(__name__)
+
+# One query per batch of products: shared categories are counted by joining categories table with itself.
+INSERT_SUBSTITUTES_SQL = """
+INSERT INTO {substitute_table} (product_id, substitute_id, shared_categories, rank)
+SELECT product_id, substitute_id, shared_categories, rank FROM (
+    SELECT pc.product_id AS product_id,
+           sc.product_id AS substitute_id,
+           COUNT(*) AS shared_categories,
+           ROW_NUMBER() OVER (
+               PARTITION BY pc.product_id
+               ORDER BY sp.nutrition_grade_fr, COUNT(*) DESC, sc.product_id
+           ) AS rank
+    FROM {categories_table} pc
+    INNER JOIN {product_table} pp ON pp.code = pc.product_id
+    INNER JOIN {categories_table} sc ON sc.category_id = pc.category_id AND sc.product_id <> pc.product_id
+    INNER JOIN {product_table} sp ON sp.code = sc.product_id
+    WHERE pc.product_id IN ({placeholders})
+      AND sp.nutrition_grade_fr <> ''
+      AND sp.nutrition_grade_fr < pp.nutrition_grade_fr
+    GROUP BY pc.product_id, sc.product_id, sp.nutrition_grade_fr
+) ranked
+WHERE rank <= %s
+"""
+
+
+def get_insert_substitutes_sql(nb_products: int):
+    """
+    Return substitutes insert query for a batch of products.
+        :param nb_products: number of products in batch
+        :type nb_products: int
+    """
+    quote = connection.ops.quote_name
+    return INSERT_SUBSTITUTES_SQL.format(
+        substitute_table=quote(Substitute._meta.db_table),
+        categories_table=quote(Product.categories_tags.through._meta.db_table),
+        product_table=quote(Product._meta.db_table),
+        placeholders=', '.join(['%s'] * nb_products),
+    )
+
+
+def compute_substitutes(batch_size: int = 500, max_substitutes: int = None):
+    """
+    Replace substitutes table content with substitutes computed from current products and categories.
+        :param batch_size: number of products whose substitutes are computed by each query
+        :type batch_size: int
+        :param max_substitutes: max number of substitutes of a product, SUBSTITUTES_MAX_PER_PRODUCT setting by default
+        :type max_substitutes: int
+    """
+    max_substitutes = max_substitutes or settings.SUBSTITUTES_MAX_PER_PRODUCT
+    start = time.perf_counter()
+    codes = list(Product.objects.exclude(nutrition_grade_fr='').order_by('pk').values_list('pk', flat=True))
+
+    with transaction.atomic():
+        Substitute.objects.all().delete()
+        with connection.cursor() as cursor:
+            for index in range(0, len(codes), batch_size):
+                batch = codes[index:index + batch_size]
+                cursor.execute(get_insert_substitutes_sql(len(batch)), batch + [max_substitutes])
+        catalogue = Catalogue.get()
+        catalogue.substitutes_updated = timezone.now()
+        catalogue.save(update_fields=['substitutes_updated'])
+    cache.delete(Catalogue.metadata_cache_key)
+
+    nb_substitutes = Substitute.objects.count()
+    LOGGER.info("SUBSTITUTES %s substitutes of %s products computed in %.3fs", nb_substitutes, len(codes),
+                time.perf_counter() - start)
+    return nb_substitutes
+
+
+def get_substitutes_queryset(product: Product):
+    """
+    Return substitutes of a product computed by a single aggregated query, ranked like precomputed substitutes.
+    Shared categories are counted by grouping the product categories join on candidate product.
+        :param product: substituted product
+        :type product: Product
+    """
+    through = Product.categories_tags.through
+    product_categories = through.objects.filter(product_id=product.pk).values('category_id')
+    substitutes = Product.objects.filter(categories_tags__in=product_categories,
+                                         nutrition_grade_fr__lt=product.nutrition_grade_fr)
+    substitutes = substitutes.exclude(nutrition_grade_fr='').exclude(pk=product.pk)
+    substitutes = substitutes.annotate(shared_categories=Count('categories_tags'))
+    return substitutes.order_by('nutrition_grade_fr', '-shared_categories', 'pk')
+
+
+def substitutes_are_computed():
+    """
+    Return True if substitutes table has been filled since last catalogue update.
+    """
+    metadata = Catalogue.get_metadata()
+    if metadata['substitutes_updated'] is None:
+        return False
+    return metadata['last_import'] is None or metadata['substitutes_updated'] >= metadata['last_import']
+
+
+def get_substitutes(product: Product):
+    """
+    Return substitutes of a product displayed on its page: precomputed ones when they are up to date and complete,
+    else the ones found by aggregated query. Precomputed substitutes of a product reaching
+    SUBSTITUTES_MAX_PER_PRODUCT may be truncated, so all its substitutes are found by aggregated query.
+        :param product: substituted product
+        :type product: Product
+    """
+    if substitutes_are_computed():
+        truncated = Substitute.objects.filter(product=product, rank__gte=settings.SUBSTITUTES_MAX_PER_PRODUCT)
+        if not truncated.exists():
+            return Product.objects.filter(substitute_of__product=product).order_by('substitute_of__rank')
+        LOGGER.debug("SUBSTITUTES %s precomputed substitutes of %s may be truncated",
+                     settings.SUBSTITUTES_MAX_PER_PRODUCT, product.pk)
+    return get_substitutes_queryset(product)
@@ -12,13 +12,14 @@ from selenium.webdriver.support import ui
 from substitute_finder.models import Product, Category
 
 
-def get_products_data_with_mock(fake_data_path: str, file_name: str, nb_files=1, nb_pages=None):
+def get_products_data_with_mock(fake_data_path: str, file_name: str, nb_files=1, nb_pages=None, concurrency=None):
     """
     Get products data with mock.
     :param fake_data_path:
     :param file_name:
     :param nb_files:
     :param nb_pages:
+    :param concurrency:
     :return:
     """
     file_name_list = ["%s%s.json" % (file_name, file_num) for file_num in range(1, nb_files + 1)]
@@ -31,9 +32,9 @@ def get_products_data_with_mock(fake_data_path: str, file_name: str, nb_files=1,
         for index, fake_data in enumerate(fake_data_products):
             mock.get(Product.get_list_api_url(index + 1), text=fake_data)
         if not nb_pages:
-            data = Product.get_api_data_list()
+            data = Product.get_api_data_list(concurrency=concurrency)
         else:
-            data = Product.get_api_data_list(nb_pages=nb_pages)
+            data = Product.get_api_data_list(nb_pages=nb_pages, concurrency=concurrency)
 
     return data
 
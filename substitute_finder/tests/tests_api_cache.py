@@ -0,0 +1,152 @@
+"""
+Api data lists caches tests.
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
+import requests_mock
+from django.core.management import call_command
+from django.forms.models import model_to_dict
+from django.test import TestCase, override_settings
+
+from substitute_finder.api_cache import NdjsonListCache
+from substitute_finder.models import Category, Product
+from substitute_finder.tests.test_helpers import get_categories_data_with_mock, get_products_data_with_mock
+
+FAKE_DATA_PATH = os.path.join(os.path.dirname(__file__), 'fake_data')
+
+
+def write_cache_page(cache_path: str, page: int):
+    """
+    Write a page of fake products into ndjson cache, run by worker processes.
+        :param cache_path: cache directory
+        :type cache_path: str
+        :param page: page number
+        :type page: int
+    """
+    with override_settings(JSON_DIR_PATH=cache_path):
+        with NdjsonListCache(Product).writer(page) as writer:
+            for index in range(50):
+                writer.write({'code': '%s-%s' % (page, index)})
+
+
+class NdjsonCacheTestCase(TestCase):
+    """
+    Test compressed cache of projected fields.
+    """
+
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.settings_override = override_settings(JSON_DIR_PATH=self.cache_path, API_CACHE_FORMAT='ndjson')
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_path)
+
+    def get_products(self):
+        """
+        Return inserted products values.
+        """
+        return [model_to_dict(product, exclude=['last_updated', 'categories_tags'])
+                for product in Product.objects.order_by('pk')]
+
+    def test_replay(self):
+        """
+        Test products inserted from cache are the same as products inserted from api data.
+        """
+        Category.insert_data(get_categories_data_with_mock(FAKE_DATA_PATH, 'categories_short'))
+        data = get_products_data_with_mock(FAKE_DATA_PATH, 'products', nb_files=3)
+        Product.insert_data(data)
+        expected = self.get_products()
+
+        cache = NdjsonListCache(Product)
+        self.assertEqual(sorted(cache.read_index()), ['1', '2', '3'])
+        cached_data = list(Product.iter_api_data_list(from_cache=True, nb_pages=3))
+        self.assertEqual([element['code'] for element in cached_data], [element['code'] for element in data])
+        self.assertLess(len(cached_data[0]), len(data[0]))
+
+        Product.objects.all().delete()
+        Product.insert_data(cached_data)
+        self.assertEqual(self.get_products(), expected)
+        self.assertEqual(Category.objects.count(), len(list(Category.iter_api_data_list(from_cache=True))))
+
+    def test_conditional_request(self):
+        """
+        Test page validators are stored in index and page is replaced when it changes.
+        """
+        with open(os.path.join(FAKE_DATA_PATH, 'products1.json'), 'r') as file:
+            fake_data = file.read()
+        url = Product.get_list_api_url(1)
+        with requests_mock.Mocker() as mock:
+            mock.get(url, text=fake_data, headers={'ETag': '"v1"'})
+            data = Product.get_api_data_list(nb_pages=1)
+            mock.get(url, status_code=304)
+            self.assertEqual(Product.get_api_data_list(nb_pages=1), [Product.project_data_element(element)
+                                                                     for element in data])
+            self.assertEqual(mock.last_request.headers['If-None-Match'], '"v1"')
+
+            mock.get(url, text='{"count": 1, "skip": 0, "page_size": 20, "products": [{"code": "1"}]}')
+            self.assertEqual(Product.get_api_data_list(nb_pages=1), [{'code': '1'}])
+
+        cache = NdjsonListCache(Product)
+        self.assertEqual(cache.get_meta(1), {'etag': None, 'last_modified': None, 'count': 1, 'skip': 0,
+                                             'page_size': 20})
+        size = os.path.getsize(cache.data_path)
+        self.assertLess(cache.compact(), size)
+        self.assertEqual(list(cache.iter_elements(1)), [{'code': '1'}])
+
+    def test_compact_after_import(self):
+        """
+        Test pages written again are dropped from data file at the end of an import.
+        """
+        get_categories_data_with_mock(FAKE_DATA_PATH, 'categories_short')
+        get_products_data_with_mock(FAKE_DATA_PATH, 'products', nb_files=3)
+        cache = NdjsonListCache(Product)
+        self.assertEqual(cache.get_dead_size(), 0)
+        get_products_data_with_mock(FAKE_DATA_PATH, 'products', nb_files=1, nb_pages=1)
+        size = os.path.getsize(cache.data_path)
+        self.assertGreater(cache.get_dead_size(), 0)
+
+        call_command('api_to_db', stdout=StringIO(), nb_pages=2, from_cache=True)
+        self.assertLess(os.path.getsize(cache.data_path), size)
+        self.assertEqual(cache.get_dead_size(), 0)
+        self.assertEqual(len(list(cache.iter_elements(1))), 20)
+
+    def test_append_from_processes(self):
+        """
+        Test pages written at the same time by several processes are all indexed at their own offset.
+        """
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(write_cache_page, [self.cache_path] * 24, range(1, 25)))
+
+        cache = NdjsonListCache(Product)
+        self.assertEqual(sorted(cache.read_index(), key=int), [str(page) for page in range(1, 25)])
+        for page in range(1, 25):
+            self.assertEqual([element['code'] for element in cache.iter_elements(page)],
+                             ['%s-%s' % (page, index) for index in range(50)])
+
+    def test_convert_command(self):
+        """
+        Test json cache is converted to a smaller ndjson cache.
+        """
+        with override_settings(API_CACHE_FORMAT='json'):
+            categories = get_categories_data_with_mock(FAKE_DATA_PATH, 'categories_short')
+            products = get_products_data_with_mock(FAKE_DATA_PATH, 'products', nb_files=3)
+
+        out = StringIO()
+        call_command('convert_api_cache', '--delete', stdout=out)
+        self.assertIn('product: 3 pages converted', out.getvalue())
+        self.assertIn('category: 1 pages converted', out.getvalue())
+        self.assertFalse([file_name for file_name in os.listdir(self.cache_path) if file_name.endswith('.json')
+                          and 'index' not in file_name])
+
+        cached_products = list(Product.iter_api_data_list(from_cache=True, nb_pages=3))
+        self.assertEqual(cached_products, [Product.project_data_element(element) for element in products])
+        self.assertEqual(list(Category.iter_api_data_list(from_cache=True)),
+                         [Category.project_data_element(element) for element in categories])
+        json_size = int(out.getvalue().split('product: 3 pages converted, ')[1].split(' ')[0])
+        self.assertLess(os.path.getsize(NdjsonListCache(Product).data_path) * 10, json_size)
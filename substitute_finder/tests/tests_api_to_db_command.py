@@ -5,10 +5,17 @@ import json
 import os
 from django.conf import settings
 from django.core.management import call_command
-from django.test import TestCase, override_settings
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from io import StringIO
+from unittest import mock, skipUnless
 
-from substitute_finder.models import Category, Product, Comment, CustomUser
+from substitute_finder.management.commands.api_to_db import Command
+
+from substitute_finder.models import Catalogue, Category, ImportPage, ImportRun, Product, Comment, CustomUser, \
+    Substitute
+from substitute_finder.pipeline import ImportPipeline
+from substitute_finder.staging import StagingImport
 
 TEST_JSON_CACHE_DATA_PATH = os.path.join(os.path.dirname(__file__), settings.JSON_DIR_NAME)
 
@@ -96,6 +103,173 @@ class ApiToDbTestCase(TestCase):
         call_command('api_to_db', stdout=out, **options)
         self.assertNotEqual(Category.objects.count(), 0)
         self.assertNotEqual(Product.objects.count(), 0)
+        self.assertEqual(Catalogue.get_version(), 1)
+
+    def test_api_to_db_with_concurrency(self):
+        """
+        Test api_to_db command recovering pages in parallel gets the same products.
+        :return:
+        """
+        out = StringIO()
+        options = {
+            'start_page': 1,
+            'nb_pages': 2,
+            'from_cache': True,
+            'grumpy_mode': False
+        }
+        call_command('api_to_db', stdout=out, **options)
+        expected = set(Product.objects.values_list('pk', flat=True))
+        Product.objects.all().delete()
+
+        call_command('api_to_db', stdout=out, concurrency=2, **options)
+        self.assertEqual(set(Product.objects.values_list('pk', flat=True)), expected)
+
+    def test_api_to_db_with_pipeline(self):
+        """
+        Test pipelined api_to_db command gets the same products.
+        :return:
+        """
+        out = StringIO()
+        options = {
+            'start_page': 1,
+            'nb_pages': 2,
+            'from_cache': True,
+            'grumpy_mode': True
+        }
+        call_command('api_to_db', stdout=out, **options)
+        expected = set(Product.objects.values_list('pk', flat=True))
+        Product.objects.all().delete()
+
+        call_command('api_to_db', stdout=out, pipeline=True, concurrency=2, **options)
+        self.assertEqual(set(Product.objects.values_list('pk', flat=True)), expected)
+
+        Product.objects.all().delete()
+        call_command('api_to_db', stdout=out, pipeline=True, bulk=True, **options)
+        self.assertEqual(set(Product.objects.values_list('pk', flat=True)), expected)
+
+    def test_api_to_db_incremental(self):
+        """
+        Test incremental api_to_db command only writes changed products and stores last modification.
+        :return:
+        """
+        out = StringIO()
+        data = list(Product.iter_api_data_list(nb_pages=3, from_cache=True))
+        with mock.patch.object(Product, 'iter_api_modified_data_list', return_value=iter(data)) as modified_data:
+            call_command('api_to_db', stdout=out, incremental=True, from_cache=True)
+        modified_data.assert_called_once_with(since=None, nb_pages=None, from_cache=True)
+        last_modified = Catalogue.get().products_last_modified
+        self.assertEqual(last_modified, max(element['last_modified_t'] for element in data
+                                            if element['code'] in set(Product.objects.values_list('pk', flat=True))))
+        last_updated = dict(Product.objects.values_list('pk', 'last_updated'))
+
+        with mock.patch.object(Product, 'iter_api_modified_data_list', return_value=iter(data)) as modified_data:
+            call_command('api_to_db', stdout=out, incremental=True, from_cache=True, bulk=True)
+        modified_data.assert_called_once_with(since=last_modified, nb_pages=None, from_cache=True)
+        self.assertEqual(dict(Product.objects.values_list('pk', 'last_updated')), last_updated)
+
+    def test_api_to_db_resume(self):
+        """
+        Test api_to_db command interrupted by an error is resumed from its first unfinished page.
+        :return:
+        """
+        out = StringIO()
+        iter_api_data_page = Product.iter_api_data_page
+
+        def fail_on_page_2(page, from_cache=False, meta=None):
+            if page == 2:
+                raise ConnectionError('connection lost')
+            yield from iter_api_data_page(page, from_cache=from_cache, meta=meta)
+
+        with mock.patch.object(Product, 'iter_api_data_page', side_effect=fail_on_page_2):
+            with self.assertRaisesMessage(ConnectionError, 'connection lost'):
+                call_command('api_to_db', stdout=out, nb_pages=2, from_cache=True)
+        run = ImportRun.objects.get()
+        self.assertEqual(run.status, ImportRun.RUNNING)
+        self.assertEqual(list(run.pages.values_list('page', 'status', 'nb_elements')),
+                         [(1, ImportPage.DONE, 20), (2, ImportPage.RUNNING, 0)])
+        self.assertEqual(run.get_first_unfinished_page(), 2)
+
+        with mock.patch.object(Product, 'iter_api_data_page', side_effect=iter_api_data_page) as data_page:
+            call_command('api_to_db', stdout=out, nb_pages=2, from_cache=True)
+        self.assertEqual([call[0][0] for call in data_page.call_args_list], [2, 3])
+        run.refresh_from_db()
+        self.assertEqual(run.status, ImportRun.DONE)
+        self.assertEqual(run.get_done_pages(), {1, 2, 3})
+        self.assertTrue(all(page.duration is not None for page in run.pages.all()))
+
+        # A finished run isn't resumed
+        call_command('api_to_db', stdout=out, nb_pages=0, from_cache=True)
+        call_command('api_to_db', stdout=out, start_page=2, nb_pages=1, from_cache=True)
+        self.assertEqual(ImportRun.objects.count(), 2)
+        self.assertEqual(ImportRun.objects.latest('pk').get_done_pages(), {2, 3})
+
+    def test_pipeline_resume(self):
+        """
+        Test pipelined api_to_db command checkpoints pages and resumes an unfinished run.
+        :return:
+        """
+        out = StringIO()
+        run = ImportRun.start(start_page=1, last_page=3)
+        run.page_done(1, 20, 0.1)
+        run.page_done(3, 20, 0.1)
+        with mock.patch.object(Product, 'get_api_data_page', wraps=Product.get_api_data_page) as data_page:
+            call_command('api_to_db', stdout=out, pipeline=True, nb_pages=2, from_cache=True)
+        # Pages done after the first unfinished one aren't imported again
+        self.assertEqual([call[0][0] for call in data_page.call_args_list], [2])
+        run.refresh_from_db()
+        self.assertEqual(run.status, ImportRun.DONE)
+        self.assertEqual(list(run.pages.values_list('page', 'nb_elements')), [(1, 20), (2, 20), (3, 20)])
+        self.assertIsNotNone(run.pages.get(page=2).started)
+
+    def test_pipeline_pages_started(self):
+        """
+        Test pipelined api_to_db command checkpoints a page before writing it, so that an interrupted page is
+        recorded as running.
+        :return:
+        """
+        out = StringIO()
+        with mock.patch.object(Product, 'save_data_element', side_effect=ValueError('write error')):
+            with self.assertRaisesMessage(ValueError, 'write error'):
+                call_command('api_to_db', stdout=out, pipeline=True, nb_pages=1, from_cache=True)
+        run = ImportRun.objects.get()
+        self.assertEqual(run.status, ImportRun.RUNNING)
+        self.assertEqual(list(run.pages.values_list('page', 'status')), [(1, ImportPage.RUNNING)])
+        self.assertEqual(run.get_first_unfinished_page(), 1)
+
+    def test_run_finished_after_cleanup(self):
+        """
+        Test an import run interrupted after its pages import, during database cleanup, isn't finished.
+        :return:
+        """
+        out = StringIO()
+        with mock.patch.object(Command, 'database_cleanup', side_effect=ConnectionError('connection lost')):
+            with self.assertRaisesMessage(ConnectionError, 'connection lost'):
+                call_command('api_to_db', stdout=out, nb_pages=1, from_cache=True)
+        self.assertEqual(ImportRun.objects.get().status, ImportRun.RUNNING)
+
+        call_command('api_to_db', stdout=out, nb_pages=1, from_cache=True)
+        self.assertEqual(ImportRun.objects.get().status, ImportRun.DONE)
+
+    def test_pipeline_errors(self):
+        """
+        Test an error in a pipeline stage stops the pipeline and is raised.
+        :return:
+        """
+        Category.insert_data(Category.get_api_data_list(from_cache=True))
+        pipeline = ImportPipeline(Product, start_page=1, last_page=3, from_cache=True, queue_size=1)
+        with mock.patch.object(Product, 'get_api_data_page', side_effect=ValueError('fetch error')):
+            with self.assertRaisesMessage(ValueError, 'fetch error'):
+                pipeline.run()
+
+        pipeline = ImportPipeline(Product, start_page=1, last_page=3, from_cache=True, queue_size=1)
+        with mock.patch.object(Product, 'save_data_element', side_effect=ValueError('write error')):
+            with self.assertRaisesMessage(ValueError, 'write error'):
+                pipeline.run()
+        self.assertEqual(pipeline.counters['write'].nb_pages, 0)
+
+        pipeline = ImportPipeline(Product, start_page=1, last_page=3, from_cache=True, queue_size=1)
+        self.assertEqual(pipeline.run(), 3)
+        self.assertEqual(pipeline.counters['fetch'].nb_items, 60)
 
     def test_api_to_db_with_grumpy_mode(self):
         """
@@ -172,3 +346,123 @@ class ApiToDbTestCase(TestCase):
         call_command('api_to_db', stdout=out, **options)
         nb_prod = Product.objects.count()
         self.assertEqual(nb_prod, 2)
+
+
+@override_settings(JSON_DIR_PATH=TEST_JSON_CACHE_DATA_PATH)
+class ApiToDbWorkersTestCase(TransactionTestCase):
+    """
+    Test api_to_db command with several worker processes.
+    """
+
+    def test_shards(self):
+        """
+        Test pages range is split into contiguous ranges.
+        :return:
+        """
+        self.assertEqual(Command.get_shards(1, 10, 3), [(1, 4), (5, 7), (8, 10)])
+        self.assertEqual(Command.get_shards(3, 4, 3), [(3, 3), (4, 4)])
+        self.assertEqual(Command.get_shards(5, 5, 1), [(5, 5)])
+
+    @skipUnless(connection.vendor == 'postgresql', 'workers need a database shared between processes')
+    def test_api_to_db_with_workers(self):
+        """
+        Test api_to_db command with workers gets the same products as a single process.
+        :return:
+        """
+        out = StringIO()
+        options = {
+            'start_page': 1,
+            'nb_pages': 2,
+            'from_cache': True,
+            'grumpy_mode': False
+        }
+        call_command('api_to_db', stdout=out, **options)
+        expected = set(Product.objects.values_list('pk', flat=True))
+        expected_categories = Category.objects.count()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+
+        for bulk in [False, True]:
+            call_command('api_to_db', stdout=out, workers=2, bulk=bulk, **options)
+            self.assertEqual(set(Product.objects.values_list('pk', flat=True)), expected)
+            self.assertEqual(Category.objects.count(), expected_categories)
+            run = ImportRun.objects.latest('pk')
+            self.assertEqual(run.status, ImportRun.DONE)
+            self.assertEqual(run.get_done_pages(), {1, 2, 3})
+
+
+@override_settings(JSON_DIR_PATH=TEST_JSON_CACHE_DATA_PATH)
+@skipUnless(connection.vendor == 'postgresql', 'staging tables are swapped with PostgreSQL schemas')
+class ApiToDbStagingTestCase(TestCase):
+    """
+    Test api_to_db command writing into staging tables.
+    """
+    fixtures = ['test_users.json', ]
+
+    def setUp(self):
+        self.options = {'start_page': 1, 'nb_pages': 2, 'from_cache': True, 'grumpy_mode': False}
+        call_command('api_to_db', stdout=StringIO(), **self.options)
+        self.imported = set(Product.objects.values_list('pk', flat=True))
+        user = CustomUser.objects.first()
+        self.favorite = Product.objects.create(code='favorite', product_name='favori', nutrition_grade_fr='a')
+        self.favorite.users.add(user)
+        self.commented = Product.objects.create(code='commented', product_name='commenté', nutrition_grade_fr='a')
+        Comment.objects.create(product=self.commented, user=user, comment_text="texte du commentaire")
+        self.removed = Product.objects.create(code='removed', product_name='supprimé', nutrition_grade_fr='a')
+        Substitute.objects.create(product=self.removed, substitute=Product.objects.get(pk=min(self.imported)),
+                                  shared_categories=1, rank=1)
+
+    @staticmethod
+    def schema_exists(schema):
+        """
+        Return True if a schema exists.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_namespace WHERE nspname = %s", [schema])
+            return bool(cursor.fetchall())
+
+    def test_staging_swap(self):
+        """
+        Test staging tables replace live ones, favorites and comments are kept.
+        :return:
+        """
+        with mock.patch.object(StagingImport, 'build_indexes', autospec=True,
+                               side_effect=StagingImport.build_indexes) as build_indexes:
+            call_command('api_to_db', stdout=StringIO(), staging=True, **self.options)
+        build_indexes.assert_called_once()
+        self.assertEqual(set(Product.objects.values_list('pk', flat=True)),
+                         self.imported | {self.favorite.pk, self.commented.pk})
+        self.assertEqual(list(self.favorite.users.all()), [CustomUser.objects.first()])
+        self.assertEqual(Comment.objects.get().product_id, self.commented.pk)
+        self.assertFalse(Substitute.objects.exists())
+        self.assertFalse(self.schema_exists(settings.IMPORT_STAGING_SCHEMA))
+        self.assertEqual(ImportRun.objects.latest('pk').staging, True)
+
+        # New tables have triggers, indexes and constraints of replaced ones
+        product = Product.objects.create(code='new', product_name='nouveau produit', nutrition_grade_fr='a')
+        product.categories_tags.add(Category.objects.first())
+        self.assertIsNotNone(Product.objects.get(pk='new').search_vector)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_constraint WHERE contype = 'f' AND NOT convalidated")
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE tablename = %s", [Product._meta.db_table])
+            self.assertGreater(cursor.fetchone()[0], 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Comment.objects.create(product_id='missing', user=CustomUser.objects.first(), comment_text="texte")
+            connection.check_constraints()
+
+    def test_live_tables_until_swap(self):
+        """
+        Test live tables are not written before swap, an import failing before swap can be run again.
+        :return:
+        """
+        with mock.patch.object(StagingImport, 'swap', side_effect=ValueError('swap error')):
+            with self.assertRaisesMessage(ValueError, 'swap error'):
+                call_command('api_to_db', stdout=StringIO(), staging=True, hard_reset=True, **self.options)
+        self.assertIn(self.removed.pk, set(Product.objects.values_list('pk', flat=True)))
+        self.assertTrue(Substitute.objects.exists())
+        self.assertTrue(self.schema_exists(settings.IMPORT_STAGING_SCHEMA))
+
+        call_command('api_to_db', stdout=StringIO(), staging=True, hard_reset=True, **self.options)
+        self.assertEqual(set(Product.objects.values_list('pk', flat=True)),
+                         self.imported | {self.favorite.pk, self.commented.pk})
@@ -2,9 +2,18 @@
 Auto completion tests.
 """
 import os
-from django.test import TestCase
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from io import StringIO
 
-from substitute_finder.helpers import create_corpus, get_unigrams, get_ngrams
+from substitute_finder.autocomplete import MAX_PREFIX_SUGGESTIONS, AutocompleteIndex, autocomplete, \
+    count_suggestions, get_autocomplete_index, write_autocomplete_file
+from substitute_finder.helpers import CountMinSketch, TopNgramsCounter, create_corpus, get_ngrams, get_top_ngrams, \
+    get_unigrams, iter_corpus
 from substitute_finder.models import Category, Product
 from substitute_finder.tests.test_helpers import get_categories_data_with_mock, get_products_data_with_mock
 
@@ -34,5 +43,219 @@ class AutoCompletionTestCase(TestCase):
         """
         corpus = create_corpus()
         self.assertIsInstance(corpus, list)
-        get_unigrams(corpus)
-        get_ngrams(corpus, 3)
+        unigrams = get_unigrams(corpus)
+        ngrams = get_ngrams(corpus, 3)
+        self.assertGreater(len(unigrams), 0)
+        self.assertGreater(len(ngrams), 0)
+        frequencies = list(unigrams.values())
+        self.assertEqual(frequencies, sorted(frequencies, reverse=True))
+
+    def test_iter_corpus(self):
+        """
+        Test streamed corpus is the same as corpus.
+        """
+        self.assertEqual(list(iter_corpus(chunk_size=7)), create_corpus())
+
+    def test_top_ngrams(self):
+        """
+        Test bounded ngrams counter keeps the most frequent ngrams with their exact frequency.
+        """
+        corpus = create_corpus()
+        expected = dict(get_unigrams(corpus))
+        for n in [2, 3]:
+            for ngram, frequency in get_ngrams(corpus, n).items():
+                expected[ngram] = expected.get(ngram, 0) + frequency
+        expected = {ngram: frequency for ngram, frequency in expected.items() if '' not in ngram.split(' ')}
+
+        top_ngrams = get_top_ngrams(iter_corpus(), 3, 10)
+        self.assertEqual(len(top_ngrams), 10)
+        min_top_frequency = min(top_ngrams.values())
+        for ngram, frequency in top_ngrams.items():
+            self.assertEqual(frequency, expected[ngram])
+        self.assertFalse([ngram for ngram, frequency in expected.items()
+                          if frequency > min_top_frequency and ngram not in top_ngrams])
+
+
+class TopNgramsCounterTestCase(TestCase):
+    """
+    Test bounded counters.
+    """
+
+    def test_count_min_sketch_never_under_estimates(self):
+        """
+        Test count-min sketch estimates are upper bounds, even with a lot of collisions.
+        """
+        sketch = CountMinSketch(width=16, depth=2)
+        counts = {}
+        for i in range(200):
+            item = 'item%s' % (i % 37)
+            counts[item] = counts.get(item, 0) + 1
+            sketch.add(item)
+        for item, count in counts.items():
+            self.assertGreaterEqual(sketch.estimate(item), count)
+
+    def test_count_min_sketch_independent_rows(self):
+        """
+        Test items colliding in a row of count-min sketch don't collide in the other rows.
+        """
+        sketch = CountMinSketch(width=2 ** 12, depth=4)
+        items = ['item%s' % i for i in range(200)]
+        for item in items:
+            sketch.add(item)
+        self.assertEqual([item for item in items if sketch.estimate(item) != 1], [])
+
+    def test_bounded_size(self):
+        """
+        Test counter keeps a bounded number of items and finds heavy hitters.
+        """
+        counter = TopNgramsCounter(5)
+        for i in range(1000):
+            counter.add('rare%s' % i)
+            if i % 2:
+                counter.add('frequent')
+            if i % 3 == 0:
+                counter.add('common')
+        self.assertEqual(len(counter.top), 5)
+        self.assertEqual(len(counter.heap), 5)
+        self.assertEqual(counter.most_common()[:2], [('frequent', 500), ('common', 334)])
+
+
+class AutocompleteIndexTestCase(TestCase):
+    """
+    Test suggestions file.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'autocomplete.idx')
+        corpus = ['coca cola', 'coca cola light', 'coca cola zéro', 'cocacola zero', 'confiture de fraises',
+                  'compote de pommes', 'coca  cola']
+        self.suggestions = count_suggestions(corpus, 2, 100)
+        write_autocomplete_file(self.file_path, self.suggestions, 3, 2)
+        self.index = AutocompleteIndex(self.file_path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def check_suggestions(self, text, limit):
+        """
+        Compare index suggestions to a full scan of suggestions.
+        """
+        expected = sorted(((suggestion, frequency) for suggestion, frequency in self.suggestions.items()
+                           if suggestion.startswith(text)), key=lambda x: (-x[1], x[0]))[:limit]
+        self.assertEqual(self.index.suggest(text, limit), expected)
+
+    def test_count_suggestions(self):
+        """
+        Test n-grams frequencies, n-grams with empty words are ignored.
+        """
+        self.assertEqual(self.suggestions['coca'], 4)
+        self.assertEqual(self.suggestions['coca cola'], 3)
+        self.assertNotIn('coca ', self.suggestions)
+        self.assertNotIn('', self.suggestions)
+
+    def test_suggest(self):
+        """
+        Test short (precomputed) and long prefixes suggestions.
+        """
+        for text in ['c', 'co', 'coc', 'coca', 'coca c', 'coca cola z', 'comp', 'x', 'xyzt']:
+            for limit in [1, 2, 3]:
+                self.check_suggestions(text, limit)
+
+    def test_suggest_clean_text(self):
+        """
+        Test typed text is cleaned.
+        """
+        self.assertEqual(self.index.suggest('  COCA   cola  ', 3), self.index.suggest('coca cola', 3))
+        self.assertEqual(self.index.suggest('  ', 3), [])
+        self.assertEqual(self.index.suggest('cola zé', 3), [('cola zéro', 1)])
+
+    def test_many_suggestions(self):
+        """
+        Test a cached prefix keeps more than 255 suggestions, and more than MAX_PREFIX_SUGGESTIONS are refused.
+        """
+        suggestions = {'coca %03d' % number: number for number in range(300)}
+        write_autocomplete_file(self.file_path, suggestions, 300, 2)
+        index = AutocompleteIndex(self.file_path)
+        self.assertEqual(len(index.suggest('co', 300)), 300)
+        self.assertEqual(index.suggest('co', 1), [('coca 299', 299)])
+        index.close()
+        with self.assertRaises(ValueError):
+            write_autocomplete_file(self.file_path, suggestions, MAX_PREFIX_SUGGESTIONS + 1, 2)
+
+    def test_file_mode(self):
+        """
+        Test suggestions file can be read by workers running as another user.
+        """
+        self.assertEqual(os.stat(self.file_path).st_mode & 0o777, 0o644)
+
+
+class AutocompleteApiTestCase(TestCase):
+    """
+    Test autocomplete api and build_autocomplete_index command.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            AUTOCOMPLETE_INDEX_PATH=os.path.join(self.directory, 'autocomplete.idx'))
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def test_build_command(self):
+        """
+        Test command writes suggestions file and api uses it.
+        """
+        call_command('build_autocomplete_index', stdout=StringIO())
+        self.assertEqual(autocomplete('coca cola l')[0], ('coca cola light', 2))
+        index = get_autocomplete_index()
+
+        # rebuilt file is reloaded, replaced index stays readable by threads still using it
+        Product.objects.filter(product_name__icontains='light').update(product_name='Coca Cola Lemon')
+        call_command('build_autocomplete_index', stdout=StringIO())
+        self.assertEqual(autocomplete('coca cola l')[0], ('coca cola lemon', 2))
+        self.assertIsNot(get_autocomplete_index(), index)
+        self.assertEqual(index.suggest('coca cola l', 1), [('coca cola light', 2)])
+
+    def test_invalid_file(self):
+        """
+        Test no suggestion is served from a file which isn't an autocomplete file of this version.
+        """
+        with open(settings.AUTOCOMPLETE_INDEX_PATH, 'wb') as file:
+            file.write(b'PBAC0001' + bytes(64))
+        with self.assertLogs('substitute_finder.autocomplete', 'WARNING'):
+            self.assertEqual(autocomplete('coca'), [])
+        self.assertEqual(autocomplete('coca'), [])
+
+        call_command('build_autocomplete_index', stdout=StringIO())
+        self.assertEqual(autocomplete('coca')[0], ('coca', 4))
+
+    def test_missing_file(self):
+        """
+        Test no suggestion is served and file isn't built by requests before build_autocomplete_index command.
+        """
+        response = self.client.get(reverse('substitute_finder:autocomplete'), {'q': 'Coca'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        self.assertFalse(os.path.exists(settings.AUTOCOMPLETE_INDEX_PATH))
+
+    def test_api(self):
+        """
+        Test api response, negative limit gives one suggestion.
+        """
+        call_command('build_autocomplete_index', stdout=StringIO())
+        response = self.client.get(reverse('substitute_finder:autocomplete'), {'q': 'Coca', 'limit': -3})
+        self.assertEqual(response.json(), [{'text': 'coca', 'frequency': 4}])
+
+        response = self.client.get(reverse('substitute_finder:autocomplete'), {'q': 'Coca', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'text': 'coca', 'frequency': 4}, {'text': 'coca cola', 'frequency': 4}])
+
+        response = self.client.get(reverse('substitute_finder:autocomplete'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
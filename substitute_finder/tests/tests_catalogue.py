@@ -0,0 +1,69 @@
+"""
+Catalogue metadata tests.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from substitute_finder.models import Catalogue, Product
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogueMetadataTestCase(TestCase):
+    """
+    Test catalogue metadata computation and cache.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_metadata(self):
+        """
+        Test metadata are computed from products and categories.
+        """
+        metadata = Catalogue.get_metadata()
+        grades = {grade for grade in Product.objects.values_list('nutrition_grade_fr', flat=True) if grade}
+        self.assertEqual(metadata['nutrition_grades'], sorted(grades))
+        self.assertEqual(metadata['nb_products'], 9)
+        self.assertGreater(metadata['nb_categories'], 0)
+
+    def test_cached_metadata(self):
+        """
+        Test metadata are read from cache and refreshed by a new catalogue version.
+        """
+        Catalogue.get_metadata()
+        with self.assertNumQueries(0):
+            Catalogue.get_metadata()
+        Product.objects.filter(nutrition_grade_fr='e').delete()
+        self.assertIn('e', Catalogue.get_metadata()['nutrition_grades'])
+        Catalogue.new_version()
+        metadata = Catalogue.get_metadata()
+        self.assertNotIn('e', metadata['nutrition_grades'])
+        self.assertEqual(metadata['version'], 1)
+
+    def test_product_page_grades(self):
+        """
+        Test product page grades come from metadata.
+        """
+        response = self.client.get(reverse('substitute_finder:product', kwargs={'pk': '3174780000288'}))
+        self.assertEqual(response.context['grades'], Catalogue.get_metadata()['nutrition_grades'])
+
+    def test_api(self):
+        """
+        Test catalogue api.
+        """
+        response = self.client.get(reverse('substitute_finder:catalogue'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['nb_products'], 9)
+
+    def test_admin_grade_filter(self):
+        """
+        Test admin products nutrition grade filter.
+        """
+        user = get_user_model().objects.create_superuser('admin', 'admin@purbeurre.fr', 'password')
+        self.client.force_login(user)
+        response = self.client.get(reverse('admin:substitute_finder_product_changelist'), {'nutrition_grade_fr': 'b'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, Product.objects.filter(nutrition_grade_fr='b').count())
@@ -0,0 +1,133 @@
+"""
+Set-based database cleanup tests.
+"""
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from substitute_finder.cleanup import database_cleanup, hard_reset
+from substitute_finder.models import Category, Comment, CustomUser, Product, Substitute
+from substitute_finder.substitutes import compute_substitutes
+
+
+class DatabaseCleanupTestCase(TestCase):
+    """
+    Test cleanup deletes the same rows as model instances deletion, favorite and commented products excepted.
+    """
+    fixtures = ['test_users.json', 'test_categories.json', 'test_products.json']
+
+    def setUp(self):
+        products = list(Product.objects.order_by('pk'))
+        products[0].nutrition_grade_fr = ''
+        products[0].save()
+        products[1].nutrition_grade_fr = ''
+        products[1].save()
+        products[2].fiber_100g = None
+        products[2].save()
+        self.incomplete = products[2]
+        products[3].categories_tags.clear()
+        self.favorite = products[1]
+        self.favorite.users.add(CustomUser.objects.first())
+        self.commented = products[3]
+        Comment.objects.create(product=self.commented, user=CustomUser.objects.first(), comment_text="texte")
+        compute_substitutes()
+        self.initial_state = self.get_state()
+
+    @staticmethod
+    def get_state():
+        """
+        Return primary keys of products and categories.
+        """
+        return set(Product.objects.values_list('pk', flat=True)), set(Category.objects.values_list('pk', flat=True))
+
+    def get_model_cleanup_state(self, grumpy_mode: bool = False):
+        """
+        Return state after a cleanup with model instances deletion, which is rolled back.
+        """
+        with transaction.atomic():
+            deletable = Product.objects.filter(users=None, comment__isnull=True)
+            if grumpy_mode:
+                missing = Q()
+                for name in set(Product.strict_required_field):
+                    missing |= Q(**{name: None})
+                    if Product._meta.get_field(name).get_internal_type() == 'CharField':
+                        missing |= Q(**{name: ''})
+                deletable.filter(missing).delete()
+            deletable.filter(nutrition_grade_fr='').delete()
+            Category.objects.annotate(product_count=Count('product')).filter(product_count__lte=1).delete()
+            deletable.filter(categories_tags=None).delete()
+            state = self.get_state()
+            transaction.set_rollback(True)
+        return state
+
+    def assert_cleanup(self, expected: tuple):
+        """
+        Assert database state after a cleanup, and that no row references a deleted one.
+        """
+        products, categories = self.get_state()
+        self.assertEqual((products, categories), expected)
+        self.assertIn(self.favorite.pk, products)
+        self.assertIn(self.commented.pk, products)
+        self.assertFalse(Substitute.objects.exclude(product__in=products).exists())
+        self.assertFalse(Substitute.objects.exclude(substitute__in=products).exists())
+        self.assertFalse(Product.categories_tags.through.objects.exclude(category__in=categories).exists())
+
+    def test_database_cleanup(self):
+        """
+        Test cleanup by batches deletes rows deleted by model cleanup.
+        :return:
+        """
+        expected = self.get_model_cleanup_state()
+        counts = database_cleanup(batch_size=2)
+        self.assert_cleanup(expected)
+        self.assertEqual(list(counts), ['products without nutrition grade', 'categories of less than two products',
+                                        'products without category'])
+        self.assertEqual(counts['products without nutrition grade'], 1)
+
+    def test_database_cleanup_with_grumpy_mode(self):
+        """
+        Test grumpy cleanup also deletes products with a missing strict required field.
+        :return:
+        """
+        expected = self.get_model_cleanup_state(grumpy_mode=True)
+        counts = database_cleanup(grumpy_mode=True, batch_size=2)
+        self.assert_cleanup(expected)
+        self.assertNotIn(self.incomplete.pk, expected[0])
+        self.assertGreater(counts['incomplete products'], 0)
+
+    def test_dry_run(self):
+        """
+        Test dry run reports numbers of rows to delete and doesn't delete anything.
+        :return:
+        """
+        state = self.get_state()
+        with CaptureQueriesContext(connection) as queries:
+            expected = database_cleanup(grumpy_mode=True, dry_run=True, batch_size=2)
+        # only temporary tables are written
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if query['sql'].startswith(('DELETE', 'UPDATE'))])
+        self.assertEqual(self.get_state(), state)
+        self.assertEqual(database_cleanup(grumpy_mode=True), expected)
+        self.assertEqual(hard_reset(dry_run=True), hard_reset())
+
+        Product.objects.bulk_create([Product(code='%013d' % number, product_name='produit') for number in range(3)])
+        state = self.get_state()
+        out = StringIO()
+        call_command('clean_database', '--hard_reset', '--dry_run', stdout=out)
+        self.assertIn('%s products would be deleted' % (len(state[0]) - 2), out.getvalue())
+        self.assertEqual(self.get_state(), state)
+
+    def test_hard_reset(self):
+        """
+        Test hard reset only keeps favorite and commented products, and their categories.
+        :return:
+        """
+        counts = hard_reset(batch_size=2)
+        products, categories = self.get_state()
+        self.assertEqual(products, {self.favorite.pk, self.commented.pk})
+        self.assertEqual(categories, set(self.favorite.categories_tags.values_list('pk', flat=True)))
+        self.assertEqual(counts['products'], len(self.initial_state[0]) - 2)
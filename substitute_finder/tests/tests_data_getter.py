@@ -2,13 +2,20 @@
 Tests for data getter tools.
 """
 import json
+import math
 import os
+import time
+import requests
 import requests_mock
 from django.conf import settings
-from django.test import TestCase
-
-from substitute_finder.models import (Category, Product,
-                                      find_dict_value_for_nested_key)
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from substitute_finder import api_client
+from substitute_finder.api_client import RateLimiter
+from substitute_finder.models import (Category, NestedKeysExtractor, Product,
+                                      find_dict_value_for_nested_key, parse_number, parse_nutrient_unit)
 # get a data source urls for a model
 #   - for a list
 #   - for an element
@@ -101,6 +108,127 @@ class DataGetterTestCase(TestCase):
         data = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3)
         self.assertEqual(len(data), 60)
 
+    def test_get_data_for_product_list_concurrently(self):
+        """
+        Test concurrent data getters for product list return pages data in order.
+        :return:
+        """
+        expected = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3)
+
+        data = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3, concurrency=2)
+        self.assertEqual([product['code'] for product in data], [product['code'] for product in expected])
+
+        data = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3, nb_pages=2, concurrency=4)
+        self.assertEqual([product['code'] for product in data], [product['code'] for product in expected[:40]])
+
+    def test_conditional_request(self):
+        """
+        Test unchanged page is requested with its validators and read from cache.
+        :return:
+        """
+        with open(os.path.join(self.fake_data_path, 'products1.json'), 'r') as file:
+            fake_data = file.read()
+        url = Product.get_list_api_url(1)
+        with requests_mock.Mocker() as mock:
+            mock.get(url, text=fake_data, headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jul 2019 10:00:00 GMT'})
+            data = Product.get_api_data_list(nb_pages=1)
+
+            mock.get(url, status_code=304)
+            self.assertEqual(Product.get_api_data_list(nb_pages=1), data)
+            self.assertEqual(mock.last_request.headers['If-None-Match'], '"v1"')
+            self.assertEqual(mock.last_request.headers['If-Modified-Since'], 'Mon, 01 Jul 2019 10:00:00 GMT')
+
+    def test_iter_data_list(self):
+        """
+        Test data list elements are yielded while pages are read and cached like get_api_data_list does.
+        :return:
+        """
+        expected = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3)
+        with requests_mock.Mocker() as mock:
+            for page in range(1, 4):
+                with open(os.path.join(self.fake_data_path, 'products%s.json' % page), 'r') as file:
+                    mock.get(Product.get_list_api_url(page), text=file.read())
+            data = Product.iter_api_data_list()
+            self.assertEqual(next(data), expected[0])
+            self.assertEqual(mock.call_count, 1)
+            self.assertEqual(list(data), expected[1:])
+            self.assertEqual(mock.call_count, 3)
+
+        # stopped iteration doesn't replace cached page
+        with requests_mock.Mocker() as mock:
+            mock.get(Product.get_list_api_url(1), text='{"products": [{"code": "1"}, {"code": "2"}]}')
+            data = Product.iter_api_data_list(nb_pages=1)
+            next(data)
+            data.close()
+        self.assertEqual(list(Product.iter_api_data_list(from_cache=True, nb_pages=3)), expected)
+
+    def test_iter_modified_data_list(self):
+        """
+        Test pages sorted by last modification are read until a page holds an element modified before a timestamp.
+        :return:
+        """
+        elements = []
+        for page in range(1, 4):
+            with open(os.path.join(self.fake_data_path, 'products%s.json' % page), 'r') as file:
+                elements.extend(json.loads(file.read())['products'])
+        elements.sort(key=lambda element: element['last_modified_t'], reverse=True)
+        pages = [elements[index:index + 20] for index in range(0, len(elements), 20)]
+
+        with requests_mock.Mocker() as mock:
+            for page, page_elements in enumerate(pages, start=1):
+                mock.get(Product.modified_list_url_template.format(page=page), text=json.dumps(
+                    {'count': len(elements), 'skip': (page - 1) * 20, 'page_size': 20, 'products': page_elements}))
+
+            self.assertEqual(list(Product.iter_api_modified_data_list()), elements)
+            self.assertEqual(mock.call_count, len(pages))
+            self.assertIn('sort_by=last_modified_t', mock.last_request.url)
+
+            since = pages[1][-1]['last_modified_t']
+            data = list(Product.iter_api_modified_data_list(since=since))
+            self.assertEqual(data, pages[0] + pages[1])
+            self.assertEqual(mock.call_count, len(pages) + 2)
+
+    def test_session(self):
+        """
+        Test api requests share a session which retries failed requests and raises error status.
+        :return:
+        """
+        session = api_client.get_session()
+        self.assertIs(api_client.get_session(), session)
+        self.assertEqual(session.get_adapter(Product.get_list_api_url(1)).max_retries.total, settings.API_MAX_RETRIES)
+        with requests_mock.Mocker() as mock:
+            mock.get(Product.get_element_api_url(self.product_id), status_code=404)
+            with self.assertRaises(requests.HTTPError):
+                Product.get_api_data_element(self.product_id)
+
+    def test_rate_limiter(self):
+        """
+        Test rate limiter spaces out requests.
+        :return:
+        """
+        rate_limiter = RateLimiter(max_per_second=50)
+        start = time.monotonic()
+        for _ in range(4):
+            rate_limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.06)
+
+    @override_settings(API_MAX_REQUESTS_PER_SECOND=10)
+    def test_init_process(self):
+        """
+        Test a worker process gets its own session and a share of hosts rate limits.
+        :return:
+        """
+        url = Product.get_list_api_url(1)
+        session = api_client.get_session()
+        api_client.get_rate_limiter(url)
+        try:
+            api_client.init_process(4)
+            self.assertIsNot(api_client.get_session(), session)
+            self.assertAlmostEqual(api_client.get_rate_limiter(url).interval, 0.4)
+        finally:
+            api_client.init_process()
+        self.assertAlmostEqual(api_client.get_rate_limiter(url).interval, 0.1)
+
     def test_get_data_for_product_element(self):
         """
         Test data getters for product element.
@@ -204,6 +332,34 @@ class DataInsertTestCase(TestCase):
             found_value.append(value)
         self.assertEqual(expected_result, found_value[0][1])
 
+    def get_products_elements(self):
+        """
+        Return products elements of fake data files.
+        """
+        elements = []
+        for file_num in range(1, 4):
+            with open(os.path.join(self.fake_data_path, 'products%s.json' % file_num)) as file:
+                elements.extend(json.loads(file.read())['products'])
+        with open(os.path.join(self.fake_data_path, self.product_id + '.json')) as file:
+            elements.append(json.loads(file.read()))
+        return elements
+
+    def test_nested_keys_extractor(self):
+        """
+        Test extractor finds the first value found by key finder for each key.
+        :return:
+        """
+        field_names = Product.get_data_field_names() + ['code', 'nutriments', 'unknown_key']
+        extractor = NestedKeysExtractor(field_names, {'nutriments': 'renamed_nutriments'})
+        for element in self.get_products_elements():
+            expected_result = {}
+            for field in field_names:
+                found_value = [value for value in find_dict_value_for_nested_key(field, element)]
+                if found_value:
+                    expected_result['renamed_nutriments' if field == 'nutriments' else field] = found_value[0][1]
+            self.assertEqual(extractor.extract(element), expected_result)
+        self.assertEqual(extractor.extract(['code']), {})
+
     def test_insert_category_list(self):
         """
         Test insert category list.
@@ -239,6 +395,116 @@ class DataInsertTestCase(TestCase):
         new_nb_elements_after = Product.objects.count()
         self.assertEqual(new_nb_elements_after, nb_elements_after)
 
+    def test_bulk_insert_product_list(self):
+        """
+        Test bulk insert of products list gives the same products as per element insert.
+        :return:
+        """
+        Category.insert_data(get_categories_data_with_mock(self.fake_data_path, 'categories_short'))
+        data = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3)
+
+        Product.insert_data(data)
+        fields = [field.name for field in Product._meta.concrete_fields if field.name != 'last_updated']
+        expected = list(Product.objects.order_by('pk').values_list(*fields))
+        expected_categories = set(Product.categories_tags.through.objects.values_list('product_id', 'category_id'))
+        Product.objects.all().delete()
+
+        # test create
+        nb_created, nb_updated = Product.bulk_save_data_elements(
+            [Product.normalize_data_element(element, Product.get_data_field_names()) for element in data])
+        self.assertEqual((nb_created, nb_updated), (len(expected), 0))
+        self.assertEqual(list(Product.objects.order_by('pk').values_list(*fields)), expected)
+        self.assertEqual(set(Product.categories_tags.through.objects.values_list('product_id', 'category_id')),
+                         expected_categories)
+
+        # test update keeps fields missing from data
+        product = Product.objects.order_by('pk').first()
+        Product.objects.filter(pk=product.pk).update(image_url='https://example.org/image.jpg')
+        for element in data:
+            element.pop('image_url', None)
+            element['product_name'] = element.get('product_name', '') + ' updated'
+        Product.insert_data(data, bulk=True)
+        self.assertEqual(Product.objects.count(), len(expected))
+        self.assertEqual(Product.objects.get(pk=product.pk).image_url, 'https://example.org/image.jpg')
+        self.assertEqual(Product.objects.get(pk=product.pk).product_name, product.product_name + ' updated')
+
+    def test_bulk_insert_batch_size(self):
+        """
+        Test bulk insert only splits upsert queries under the database parameters limit.
+        :return:
+        """
+        element = {'code': '0', 'product_name': 'produit', 'nutrition_grade_fr': 'a', 'nutriments': {'fat_100g': 1}}
+        elements = [Product.normalize_data_element(dict(element, code=str(code)), Product.get_data_field_names())
+                    for code in range(60)]
+        batch_size = connection.ops.bulk_batch_size(Product._meta.concrete_fields, elements)
+        with CaptureQueriesContext(connection) as queries:
+            Product.bulk_save_data_elements(elements)
+        upserts = [query for query in queries if query['sql'].startswith('INSERT INTO "substitute_finder_product"')]
+        self.assertEqual(len(upserts), math.ceil(len(elements) / batch_size))
+        if connection.vendor == 'postgresql':
+            self.assertEqual(len(upserts), 1)
+        self.assertEqual(Product.objects.count(), len(elements))
+
+    def test_insert_data_by_batches(self):
+        """
+        Test data elements provided by an iterator are inserted by batches.
+        :return:
+        """
+        Category.insert_data(get_categories_data_with_mock(self.fake_data_path, 'categories_short'))
+        data = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3)
+        for bulk in [False, True]:
+            Product.objects.all().delete()
+            self.assertEqual(Product.insert_data(iter(data), bulk=bulk, batch_size=7), len(data))
+            self.assertEqual(Product.objects.count(), len({element['code'] for element in data}))
+
+    def test_incremental_insert(self):
+        """
+        Test incremental insert only writes elements modified since last import whose content changed.
+        :return:
+        """
+        Category.insert_data(get_categories_data_with_mock(self.fake_data_path, 'categories_short'))
+        data = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3)
+        Product.insert_data(data, incremental=True)
+        self.assertFalse(Product.objects.filter(content_hash='').exists())
+        self.assertTrue(Product.objects.filter(source_last_modified=data[0]['last_modified_t']).exists())
+        last_updated = dict(Product.objects.values_list('pk', 'last_updated'))
+
+        for bulk in [False, True]:
+            with self.assertNumQueries(1):
+                Product.insert_data(data, incremental=True, bulk=bulk)
+        self.assertEqual(dict(Product.objects.values_list('pk', 'last_updated')), last_updated)
+
+        changed, modified_before, touched = data[0], data[1], data[2]
+        changed['product_name'] += ' changed'
+        changed['last_modified_t'] += 1
+        modified_before['product_name'] += ' changed'
+        touched['last_modified_t'] += 1
+        since = modified_before['last_modified_t']
+        Product.insert_data([changed, modified_before, touched], incremental=True, since=since, bulk=True)
+        self.assertEqual(Product.objects.get(pk=changed['code']).product_name, changed['product_name'])
+        self.assertNotEqual(Product.objects.get(pk=modified_before['code']).product_name,
+                            modified_before['product_name'])
+        self.assertEqual(Product.objects.get(pk=touched['code']).last_updated, last_updated[touched['code']])
+
+    def test_bulk_set_categories(self):
+        """
+        Test bulk insert adds known categories and removes categories missing from data.
+        :return:
+        """
+        Category.insert_data(get_categories_data_with_mock(self.fake_data_path, 'categories_short'))
+        data = get_products_data_with_mock(self.fake_data_path, 'products', nb_files=3)
+        Product.insert_data(data, bulk=True)
+
+        element = next(element for element in data if len(element.get('categories_tags', [])) > 1)
+        product = Product.objects.get(pk=element['code'])
+        removed = element['categories_tags'].pop()
+        element['categories_tags'].append('en:unknown-category')
+        with self.assertNumQueries(7):
+            Product.insert_data([element], bulk=True)
+        categories = set(product.categories_tags.values_list('pk', flat=True))
+        self.assertEqual(categories, set(element['categories_tags']) - {'en:unknown-category'})
+        self.assertNotIn(removed, categories)
+
     def test_insert_product_list_with_strict_mode(self):
         """
         Test insert products list with strict mode.
@@ -290,6 +556,37 @@ class DataInsertTestCase(TestCase):
         new_nb_elements_after = Product.objects.count()
         self.assertEqual(new_nb_elements_after, nb_elements_after)
 
+    def test_parse_nutrients(self):
+        """
+        Test nutrient values and units parsing.
+        :return:
+        """
+        self.assertEqual(parse_number(12), 12.0)
+        self.assertEqual(parse_number("12,5"), 12.5)
+        self.assertEqual(parse_number(" < 0.5 "), 0.5)
+        for value in ["", "traces", "nan", "inf", None, [1]]:
+            self.assertIsNone(parse_number(value))
+        self.assertEqual(parse_nutrient_unit(" KJ"), "kJ")
+        self.assertEqual(parse_nutrient_unit("mcg"), "µg")
+        for value in ["", "cup", None]:
+            self.assertIsNone(parse_nutrient_unit(value))
+
+    def test_insert_typed_nutrients(self):
+        """
+        Test inserted nutrient values are numbers, unknown values being None.
+        :return:
+        """
+        element = {'code': '1', 'product_name': 'produit', 'nutrition_grade_fr': 'a',
+                   'nutriments': {'sugars_100g': '4,2', 'sugars_unit': 'G', 'salt_100g': 'traces',
+                                  'energy_100g': '', 'energy_unit': 'kcal', 'fat_100g': 3}}
+        Product.insert_data([element])
+        product = Product.objects.get(code='1')
+        self.assertEqual((product.sugars_100g, product.sugars_unit), (4.2, 'g'))
+        self.assertEqual((product.energy_100g, product.energy_unit), (None, 'kcal'))
+        self.assertIsNone(product.salt_100g)
+        self.assertEqual(product.fat_100g, 3.0)
+        self.assertEqual(Product.objects.filter(sugars_100g__lt=5).get(), product)
+
     def test_short_cat(self):
         """
         test that categories_short.json file used to mock api call contains only the categories used
@@ -0,0 +1,72 @@
+"""
+Incremental json parsing tests.
+"""
+import io
+import json
+import os
+
+from django.test import TestCase
+
+from substitute_finder.json_stream import iter_file_chunks, iter_json_list
+
+
+def split(text: str, chunk_size: int):
+    """
+    Split text in chunks of chunk_size characters.
+    """
+    return [text[index:index + chunk_size] for index in range(0, len(text), chunk_size)]
+
+
+class JsonStreamTestCase(TestCase):
+    """
+    Test json lists are decoded item by item from chunks.
+    """
+
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), 'fake_data', 'products1.json'), 'r') as file:
+            self.document = file.read()
+
+    def test_object_list(self):
+        """
+        Test list of a json object and other object members are decoded whatever chunks size is.
+        """
+        expected = json.loads(self.document)
+        for chunk_size in [1, 7, 4096, len(self.document)]:
+            values = {}
+            items = list(iter_json_list(split(self.document, chunk_size), 'products', values))
+            self.assertEqual(items, expected['products'])
+            self.assertEqual(values, {key: value for key, value in expected.items() if key != 'products'})
+
+    def test_list(self):
+        """
+        Test json list items are decoded, numbers split between chunks included.
+        """
+        document = json.dumps([123456, {'a': [1, 2]}, 'text', 1.5e10, None, [], 789])
+        for chunk_size in [1, 2, 3, 5]:
+            self.assertEqual(list(iter_json_list(split(document, chunk_size))), json.loads(document))
+        self.assertEqual(list(iter_json_list([' [ ] '])), [])
+        self.assertEqual(list(iter_json_list(['{"count": 0, "products": []}'], 'products')), [])
+        self.assertEqual(list(iter_json_list(iter_file_chunks(io.StringIO(document), 4))), json.loads(document))
+
+    def test_lazy_decoding(self):
+        """
+        Test items are decoded as chunks are read.
+        """
+        read_chunks = []
+
+        def chunks():
+            for chunk in split(self.document, 1024):
+                read_chunks.append(chunk)
+                yield chunk
+
+        items = iter_json_list(chunks(), 'products')
+        next(items)
+        self.assertLess(sum(len(chunk) for chunk in read_chunks), len(self.document) / 2)
+
+    def test_invalid_document(self):
+        """
+        Test invalid or truncated documents raise ValueError.
+        """
+        for document in ['{"products": [{"a": 1}, {"b"', '{"products": [1 2]}', '[1, 2', '"products"']:
+            with self.assertRaises(ValueError):
+                list(iter_json_list(split(document, 3), 'products' if 'products' in document else None))
@@ -0,0 +1,76 @@
+"""
+Nutrient based substitutes scoring tests.
+"""
+import math
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from substitute_finder.models import Catalogue, Product
+from substitute_finder.scoring import get_healthier_alternatives, score_candidates
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HealthierAlternativesTestCase(TestCase):
+    """
+    Test healthier alternatives are found in product categories and ranked by distance.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.get(pk='3174780000288')
+
+    def test_score_candidates(self):
+        """
+        Test candidates with a higher value of a lower is healthier nutrient, or without any lower one, are excluded.
+        """
+        vector = np.array([100., 5., 1.])
+        matrix = np.array([[100., 4., 1.], [140., 2., 0.], [100., 6., 0.], [100., 5., 1.]])
+        distances = score_candidates(vector, matrix, np.ones(3), np.array([0.5, 1., 1.]),
+                                     np.array([False, True, True]))
+        self.assertEqual(distances[0], 1)
+        self.assertAlmostEqual(distances[1], math.sqrt(0.5 * 40 ** 2 + 3 ** 2 + 1))
+        self.assertEqual(list(np.isinf(distances)), [False, False, True, True])
+
+    def test_alternatives(self):
+        """
+        Test alternatives share a category with product, have no more sugars, salt and saturated fat, and are
+        ranked closest first.
+        """
+        alternatives = get_healthier_alternatives(self.product, limit=10)
+        self.assertEqual(alternatives[0].pk, '5449000061294')
+        categories = set(self.product.categories_tags.values_list('pk', flat=True))
+        for alternative in alternatives:
+            self.assertTrue(alternative.categories_tags.filter(pk__in=categories).exists())
+            for name in ['sugars_100g', 'salt_100g', 'saturated_fat_100g']:
+                self.assertLessEqual(getattr(alternative, name), getattr(self.product, name))
+        self.assertNotIn('5449000214843', [alternative.pk for alternative in alternatives])
+        self.assertEqual(len(get_healthier_alternatives(self.product, limit=2)), 2)
+
+        self.product.sugars_100g = None
+        self.assertEqual(get_healthier_alternatives(self.product), [])
+
+    def test_cached_matrices(self):
+        """
+        Test nutrient matrices are read from cache until a new catalogue version.
+        """
+        expected = get_healthier_alternatives(self.product)
+        # catalogue version, product categories and alternatives
+        with self.assertNumQueries(3):
+            self.assertEqual(get_healthier_alternatives(self.product), expected)
+
+        Product.objects.filter(pk='5449000061294').update(sugars_100g=50)
+        self.assertEqual(get_healthier_alternatives(self.product), expected)
+        Catalogue.new_version()
+        self.assertNotIn('5449000061294', [product.pk for product in get_healthier_alternatives(self.product)])
+
+    def test_product_view(self):
+        """
+        Test product page shows healthier alternatives.
+        """
+        response = self.client.get(reverse('substitute_finder:product', kwargs={'pk': self.product.pk}))
+        self.assertEqual(response.context['alternatives'], get_healthier_alternatives(self.product))
+        self.assertContains(response, "Alternatives plus saines les plus proches")
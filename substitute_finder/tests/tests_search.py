@@ -0,0 +1,334 @@
+"""
+Product search engines tests.
+"""
+import threading
+from array import array
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from substitute_finder.helpers import SEARCH_CONFIG, PhraseSearchQuery, PrefixSearchQuery, evict_search_results, \
+    pg_trgm_is_installed, search_product, search_product_fulltext, search_product_icontains, \
+    search_product_inverted_index, search_product_trigram, store_search_result
+from substitute_finder.inverted_index import PRODUCT_INDEX, intersect_sorted
+from substitute_finder.models import Catalogue, CustomUser, Product, SearchResult
+
+
+class IcontainsSearchTestCase(TestCase):
+    """
+    Test default search engine.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def test_search_product_use_setting(self):
+        """
+        Test search_product uses engine defined in settings.
+        """
+        with override_settings(SEARCH_ENGINE='icontains'):
+            self.assertEqual(search_product('coca light'), search_product_icontains('coca light'))
+
+    def test_phrase_is_better_ranked(self):
+        """
+        Test products containing exact terms are ranked first.
+        """
+        result = search_product_icontains('coca cola light')
+        self.assertEqual(result[0][1], 6)
+        self.assertIn('Coca Cola Light', result[0][0].product_name)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SearchCacheTestCase(TestCase):
+    """
+    Test search results cache.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_result(self):
+        """
+        Test same normalised terms search returns cached result with only two queries.
+        """
+        result = search_product('Coca  Cola')
+        with self.assertNumQueries(2):
+            cached_result = search_product(' coca cola ')
+        self.assertEqual(cached_result, result)
+
+    def test_new_catalogue_version(self):
+        """
+        Test a new catalogue version drops cached results.
+        """
+        search_product('coca')
+        Product.objects.filter(product_name__icontains='light').update(product_name='Pepsi')
+        self.assertEqual(len(search_product('coca')), 8)
+        Catalogue.new_version()
+        self.assertEqual(len(search_product('coca')), 6)
+
+    def test_deleted_products(self):
+        """
+        Test deleted products are removed from cached results.
+        """
+        search_product('coca')
+        Product.objects.filter(product_name__icontains='light').delete()
+        self.assertEqual(len(search_product('coca')), 6)
+
+
+class SearchResultTestCase(TestCase):
+    """
+    Test search results stored in database and referenced by session.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def test_store_search_result(self):
+        """
+        Test a search result is stored once for same normalised terms.
+        """
+        result = search_product('coca')
+        search_result = store_search_result('coca', result)
+        self.assertEqual(len(search_result.pk), 16)
+        self.assertEqual(list(search_result.products.values_list('product_id', flat=True)),
+                         [product.pk for product, _ in result])
+        with self.assertNumQueries(2):
+            self.assertEqual(store_search_result(' Coca', result).pk, search_result.pk)
+        self.assertEqual(SearchResult.objects.count(), 1)
+        self.assertNotEqual(store_search_result('cola', search_product('cola')).pk, search_result.pk)
+
+    def test_eviction(self):
+        """
+        Test unused search results are deleted.
+        """
+        store_search_result('coca', search_product('coca'))
+        with override_settings(SEARCH_RESULT_TIMEOUT=-1):
+            self.assertEqual(evict_search_results(), 1)
+        self.assertEqual(SearchResult.objects.count(), 0)
+
+    def test_session_holds_search_id(self):
+        """
+        Test session only holds search id and results page keeps search ranking.
+        """
+        response = self.client.post(reverse('substitute_finder:search'), {'product': 'coca cola light'})
+        session = self.client.session
+        self.assertNotIn('last_products', session)
+        self.assertTrue(SearchResult.objects.filter(pk=session['last_search_id']).exists())
+        response = self.client.get(reverse('substitute_finder:search'))
+        products = [product.pk for product in response.context['products']]
+        self.assertEqual(products, [product.pk for product, _ in search_product('coca cola light')][:len(products)])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'full text search needs PostgreSQL')
+class FulltextSearchTestCase(TestCase):
+    """
+    Test PostgreSQL full text search engine.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def test_empty_search(self):
+        """
+        Test empty search or search with only stop words returns nothing.
+        """
+        self.assertEqual(search_product_fulltext(''), [])
+        self.assertEqual(search_product_fulltext('de la'), [])
+
+    def test_no_result(self):
+        """
+        Test search without matching products.
+        """
+        self.assertEqual(search_product_fulltext('tarte au fromage'), [])
+
+    def test_weights(self):
+        """
+        Test best ranked products and weights are the icontains search engine ones.
+        """
+        result = search_product_fulltext('coca cola light')
+        weights = [weight for _, weight in result]
+        self.assertEqual(weights, sorted(weights, reverse=True))
+        best = {product.pk for product, weight in result if weight == 6}
+        icontains_best = {product.pk for product, weight in search_product_icontains('coca cola light') if weight == 6}
+        self.assertEqual(best, icontains_best)
+
+    def test_same_products_as_icontains(self):
+        """
+        Test both engines find the same products for a simple search.
+        """
+        fulltext = {product.pk for product, _ in search_product_fulltext('coca')}
+        icontains = {product.pk for product, _ in search_product_icontains('coca')}
+        self.assertEqual(fulltext, icontains)
+
+    def test_stemming(self):
+        """
+        Test french stemming: plural matches singular.
+        """
+        result = search_product_fulltext('volailles')
+        self.assertEqual(len(result), 1)
+
+    def test_query_functions(self):
+        """
+        Test phrase and prefix queries are parsed by their tsquery function.
+        """
+        sql, params = Product.objects.filter(search_vector=PhraseSearchQuery('coca cola', config=SEARCH_CONFIG)) \
+            .query.sql_with_params()
+        self.assertIn('phraseto_tsquery(', sql)
+        self.assertIn('coca cola', params)
+        self.assertEqual(Product.objects.filter(search_vector=~PhraseSearchQuery('cola coca', config=SEARCH_CONFIG))
+                         .count(), Product.objects.count())
+
+        sql, params = Product.objects.filter(search_vector=PrefixSearchQuery('coca-cola')).query.sql_with_params()
+        self.assertIn('to_tsquery(', sql)
+        self.assertNotIn('plainto_tsquery(', sql)
+        self.assertIn('coca:* & cola:*', params)
+
+
+class TrigramSearchTestCase(TestCase):
+    """
+    Test trigram similarity search engine.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def skip_without_pg_trgm(self):
+        """
+        Skip a test of trigram similarity when pg_trgm 1.2 extension isn't installed, search falls back to icontains.
+        """
+        if not pg_trgm_is_installed():
+            self.skipTest('pg_trgm 1.2 extension is not installed')
+
+    def test_empty_search(self):
+        """
+        Test empty search returns nothing.
+        """
+        self.assertEqual(search_product_trigram(' '), [])
+
+    @skipUnless(connection.vendor != 'postgresql', 'fallback is only used without PostgreSQL')
+    def test_fallback(self):
+        """
+        Test icontains search engine is used without PostgreSQL.
+        """
+        self.assertEqual(search_product_trigram('coca light'), search_product_icontains('coca light'))
+
+    def test_fallback_without_pg_trgm(self):
+        """
+        Test icontains search engine is used when pg_trgm extension isn't installed.
+        """
+        with mock.patch('substitute_finder.helpers.PG_TRGM_INSTALLED', {connection.settings_dict['NAME']: False}):
+            self.assertEqual(search_product_trigram('coca colla'), search_product_icontains('coca colla'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'trigram search needs PostgreSQL')
+    def test_misspelt_search(self):
+        """
+        Test misspelt terms still find products, best match first.
+        """
+        self.skip_without_pg_trgm()
+        result = search_product_trigram('coca colla lite')
+        self.assertGreater(len(result), 0)
+        self.assertIn('Light', result[0][0].product_name)
+        weights = [weight for _, weight in result]
+        self.assertEqual(weights, sorted(weights, reverse=True))
+
+    @skipUnless(connection.vendor == 'postgresql', 'trigram search needs PostgreSQL')
+    def test_substring_search(self):
+        """
+        Test substring search finds the same products as icontains search engine.
+        """
+        self.skip_without_pg_trgm()
+        trigram = {product.pk for product, _ in search_product_trigram('coca')}
+        icontains = {product.pk for product, _ in search_product_icontains('coca')}
+        self.assertTrue(icontains.issubset(trigram))
+
+
+@override_settings(SEARCH_INDEX_REFRESH_INTERVAL=0)
+class InvertedIndexSearchTestCase(TestCase):
+    """
+    Test in memory inverted index search engine.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def setUp(self):
+        PRODUCT_INDEX.build()
+
+    def assertSameResult(self, terms):
+        """
+        Check inverted index and icontains search engines give the same products with the same weights.
+        """
+        expected = {(product.pk, weight) for product, weight in search_product_icontains(terms)}
+        result = search_product_inverted_index(terms)
+        self.assertEqual({(product.pk, weight) for product, weight in result}, expected)
+        weights = [weight for _, weight in result]
+        self.assertEqual(weights, sorted(weights, reverse=True))
+
+    def test_intersect_sorted(self):
+        """
+        Test sorted arrays intersection.
+        """
+        self.assertEqual(intersect_sorted(array('I', [1, 3, 5, 9]), array('I', [0, 3, 4, 9, 12])), array('I', [3, 9]))
+        self.assertEqual(intersect_sorted(array('I', [1]), array('I', [])), array('I'))
+
+    def test_same_result_as_icontains(self):
+        """
+        Test weights are the icontains search engine ones.
+        """
+        for terms in ['', 'coca', 'CocaCola', 'coca cola light', 'cola zero', 'blanquette de volaille', 'la',
+                      'tarte au fromage', 'ola', 'ocacol', 'ght', 'c', 'aill']:
+            self.assertSameResult(terms)
+
+    def test_search_waits_for_refresh(self):
+        """
+        Test index reads wait for a refresh holding the index lock in another thread.
+        """
+        expected = PRODUCT_INDEX.phrase_matches('coca')
+        result = []
+        with PRODUCT_INDEX.lock:
+            reader = threading.Thread(target=lambda: result.append(PRODUCT_INDEX.phrase_matches('coca')))
+            reader.start()
+            reader.join(0.1)
+            self.assertTrue(reader.is_alive())
+        reader.join()
+        self.assertEqual(result, [expected])
+
+    def test_incremental_refresh(self):
+        """
+        Test created, renamed and deleted products are taken into account.
+        """
+        product = Product.objects.get(pk='0000000274722')
+        product.product_name = 'Blanquette de Dinde'
+        product.save()
+        new_product = Product.objects.get(pk='3174780000288')
+        new_product.pk = '0000000000001'
+        new_product.product_name = 'Dinde aux marrons'
+        new_product.save()
+        Product.objects.filter(pk='5449000214812').delete()
+
+        self.assertSameResult('volaille')
+        self.assertSameResult('dinde')
+        self.assertSameResult('inde')
+        self.assertSameResult('light')
+        self.assertEqual(len(search_product_inverted_index('dinde')), 2)
+
+        # n-grams only reference indexed tokens
+        tokens = {token for tokens in PRODUCT_INDEX.ngrams.values() for token in tokens}
+        self.assertEqual(tokens, {token for token in PRODUCT_INDEX.postings if len(token) >= 3})
+
+    def test_metrics(self):
+        """
+        Test index metrics.
+        """
+        metrics = PRODUCT_INDEX.metrics()
+        self.assertEqual(metrics['nb_products'], Product.objects.exclude(nutrition_grade_fr='').count())
+        self.assertGreater(metrics['nb_tokens'], 0)
+        self.assertGreater(metrics['memory_bytes'], 0)
+        self.assertGreaterEqual(metrics['build_time'], 0)
+
+    def test_metrics_api(self):
+        """
+        Test index metrics are exposed to admin users.
+        """
+        url = reverse('substitute_finder:search_index')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['nb_products'], PRODUCT_INDEX.metrics()['nb_products'])
+        self.assertEqual(response.json()['nb_ngrams'], len(PRODUCT_INDEX.ngrams))
@@ -0,0 +1,147 @@
+"""
+Precomputed substitutes tests.
+"""
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from substitute_finder.helpers import store_search_result
+from substitute_finder.models import Catalogue, Product, Substitute
+from substitute_finder.substitutes import compute_substitutes, get_substitutes_queryset, substitutes_are_computed
+
+
+class ComputeSubstitutesTestCase(TestCase):
+    """
+    Test substitutes computation.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def test_command(self):
+        """
+        Test compute_substitutes command fills substitutes table.
+        """
+        self.assertFalse(substitutes_are_computed())
+        out = StringIO()
+        call_command('compute_substitutes', '--batch_size', '2', stdout=out)
+        self.assertIn('%s substitutes computed' % Substitute.objects.count(), out.getvalue())
+        self.assertTrue(substitutes_are_computed())
+
+    def test_substitutes(self):
+        """
+        Test substitutes have a better nutrition grade, share categories with product and are ranked.
+        """
+        compute_substitutes()
+        self.assertGreater(Substitute.objects.count(), 0)
+        for product in Product.objects.exclude(nutrition_grade_fr=''):
+            substitutes = list(product.substitutes.select_related('substitute'))
+            categories = set(product.categories_tags.values_list('pk', flat=True))
+            expected = Product.objects.filter(categories_tags__in=categories,
+                                              nutrition_grade_fr__lt=product.nutrition_grade_fr)
+            expected = set(expected.exclude(nutrition_grade_fr='').values_list('pk', flat=True))
+            self.assertEqual({substitute.substitute.pk for substitute in substitutes}, expected)
+            self.assertEqual([substitute.rank for substitute in substitutes], list(range(1, len(substitutes) + 1)))
+            ranking = [(substitute.substitute.nutrition_grade_fr, -substitute.shared_categories)
+                       for substitute in substitutes]
+            self.assertEqual(ranking, sorted(ranking))
+            for substitute in substitutes:
+                shared = substitute.substitute.categories_tags.filter(pk__in=categories).count()
+                self.assertEqual(substitute.shared_categories, shared)
+
+    def test_max_substitutes(self):
+        """
+        Test number of substitutes of a product is limited.
+        """
+        compute_substitutes(max_substitutes=1)
+        self.assertEqual(Substitute.objects.filter(rank__gt=1).count(), 0)
+        self.assertGreater(Substitute.objects.count(), 0)
+
+    def test_same_ranking_as_aggregated_query(self):
+        """
+        Test substitutes found by aggregated query are ranked like precomputed ones.
+        """
+        compute_substitutes()
+        for product in Product.objects.exclude(nutrition_grade_fr=''):
+            expected = [(substitute.substitute_id, substitute.shared_categories)
+                        for substitute in product.substitutes.all()]
+            with self.assertNumQueries(1):
+                result = [(substitute.pk, substitute.shared_categories)
+                          for substitute in get_substitutes_queryset(product)]
+            self.assertEqual(result, expected)
+
+    def test_new_import(self):
+        """
+        Test substitutes are not used anymore after a new catalogue import.
+        """
+        compute_substitutes()
+        Catalogue.new_version()
+        self.assertFalse(substitutes_are_computed())
+
+
+class ProductViewSubstitutesTestCase(TestCase):
+    """
+    Test product_view with precomputed substitutes.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def get_product_page(self, code, last_products):
+        """
+        Return product page response for given last search result.
+        """
+        session = self.client.session
+        search_result = [(product, 1) for product in Product.objects.filter(pk__in=last_products)]
+        session['last_search_id'] = store_search_result(' '.join(last_products), search_result).pk
+        session.save()
+        return self.client.get(reverse('substitute_finder:product', kwargs={'pk': code}))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_same_substitutes_as_aggregated_query(self):
+        """
+        Test precomputed substitutes are the ones found by aggregated query.
+        Nutrient matrices of healthier alternatives are read from cache filled by first page.
+        """
+        cache.clear()
+        last_products = ['5449000053565', '5000112600186']
+        expected = self.get_product_page('3174780000288', last_products)
+        compute_substitutes()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_product_page('3174780000288', last_products)
+        # product categories are only read to be displayed
+        categories_queries = [query for query in queries if 'product_categories_tags' in query['sql']]
+        self.assertEqual(len(categories_queries), 1)
+        self.assertEqual({product.pk for product in response.context['products']},
+                         {product.pk for product in expected.context['products']})
+        self.assertEqual({product.pk for product in response.context['others']},
+                         {product.pk for product in expected.context['others']})
+        grades = [product.nutrition_grade_fr for product in response.context['products']]
+        self.assertEqual(grades, sorted(grades))
+
+    def test_truncated_substitutes(self):
+        """
+        Test all substitutes are displayed when precomputed ones reach SUBSTITUTES_MAX_PER_PRODUCT.
+        """
+        expected = self.get_product_page('3174780000288', [])
+        self.assertGreater(expected.context['others'].paginator.count, 1)
+        with override_settings(SUBSTITUTES_MAX_PER_PRODUCT=1):
+            compute_substitutes()
+            response = self.get_product_page('3174780000288', [])
+        self.assertTrue(substitutes_are_computed())
+        self.assertEqual(Substitute.objects.filter(product_id='3174780000288').count(), 1)
+        self.assertEqual(response.context['others'].paginator.count, expected.context['others'].paginator.count)
+        self.assertEqual(list(response.context['others']), list(expected.context['others']))
+
+    def test_paginated_aggregated_query(self):
+        """
+        Test substitutes page is limited by database without precomputed substitutes.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_product_page('3174780000288', [])
+        self.assertFalse(substitutes_are_computed())
+        substitutes = list(get_substitutes_queryset(Product.objects.get(pk='3174780000288')))
+        self.assertEqual(list(response.context['others']), substitutes[:len(response.context['others'])])
+        self.assertEqual(response.context['others'].paginator.count, len(substitutes))
+        self.assertTrue(any('GROUP BY' in query['sql'] and 'LIMIT' in query['sql'] for query in queries))
@@ -6,6 +6,7 @@ from django.contrib.sessions.models import Session
 from django.test import TestCase
 from django.urls import reverse
 
+from substitute_finder.helpers import store_search_result
 from substitute_finder.models import Product, CustomUser
 
 
@@ -270,7 +271,7 @@ class ProductViewTestCase(TestCase):
         If substitutes exist, test they have better nutrition grade than product
         """
         session = self.client.session
-        session['last_products'] = [product.pk for product in Product.objects.all()]
+        session['last_search_id'] = store_search_result('all', [(product, 1) for product in Product.objects.all()]).pk
         session.save()
         response = self.client.get(reverse('substitute_finder:product', kwargs={'pk': '3174780000288'}))
         self.assertEqual(response.status_code, 200)
@@ -281,6 +282,26 @@ class ProductViewTestCase(TestCase):
             self.assertGreater(product_grade, grade)
 
 
+class ProductApiViewTestCase(TestCase):
+    """
+    Test products rest api.
+    """
+    fixtures = ['test_categories.json', 'test_products.json']
+
+    def test_nutrient_filters(self):
+        """
+        Test products are filtered on nutrient values, invalid values being ignored.
+        """
+        response = self.client.get('/api/products/', {'sugars_100g__lt': '5', 'fat_100g__gte': '0,5'})
+        self.assertEqual(response.status_code, 200)
+        expected = Product.objects.filter(sugars_100g__lt=5, fat_100g__gte=0.5)
+        self.assertTrue(expected.exists())
+        self.assertEqual({product['code'] for product in response.json()}, {product.code for product in expected})
+
+        response = self.client.get('/api/products/', {'sugars_100g__lt': 'peu', 'unknown__lt': '1'})
+        self.assertEqual(len(response.json()), Product.objects.count())
+
+
 # Favorites
 # add a favorites to database
 
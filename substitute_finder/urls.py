@@ -8,7 +8,8 @@ from rest_framework import routers
 
 from substitute_finder.views import comment_list_view
 from substitute_finder.viewsets import CommentApiViewSet, CategoryApiViewSet, ProductApiViewSet, CustomUserApiViewSet
-from substitute_finder.viewsets import CommentsByProductApiView
+from substitute_finder.viewsets import AutocompleteApiView, CatalogueApiView, CommentsByProductApiView, \
+    SearchIndexApiView
 from .views import account_view, search_view, product_view, create_account_view, index_view, login_view, \
     logout_view, add_favorite_view, favorites_view, legal_view
 
@@ -25,6 +26,9 @@ urlpatterns = [
     path('search', search_view, name='search'),
     path('product/<pk>', product_view, name='product'),
     path('product/<pk>/comments', comment_list_view, name='comments'),
+    path('api/autocomplete', AutocompleteApiView.as_view(), name='autocomplete'),
+    path('api/catalogue', CatalogueApiView.as_view(), name='catalogue'),
+    path('api/search-index', SearchIndexApiView.as_view(), name='search_index'),
     url(r'^api/', include(router.urls)),
     url('products/(?P<pk>\d+)/comments-list/$', CommentsByProductApiView.as_view(), name='comments_list'),
 
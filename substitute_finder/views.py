@@ -1,8 +1,6 @@
 """
 substitute_finder app views module
 """
-from itertools import chain
-
 import logging
 from django.conf import settings
 from django.contrib import messages
@@ -14,8 +12,10 @@ from django.shortcuts import redirect, render
 
 from .forms import (AccountCreateForm, CustomLoginForm, ParagraphErrorList,
                     ProductsSearchForm)
-from .helpers import search_product
-from .models import Product
+from .helpers import search_product, store_search_result
+from .models import Catalogue, Product
+from .scoring import get_healthier_alternatives
+from .substitutes import get_substitutes
 
 # Create your views here.
 LOGGER = logging.getLogger(__name__)
@@ -113,7 +113,8 @@ def search_view(request):
 
             context['products'] = paginator.get_page(1)
 
-            request.session['last_products'] = [product[0].pk for product in result]
+            request.session['last_search_id'] = store_search_result(search, result).pk
+            request.session.pop('last_products', None)
             if len(result) == 1:
                 context['product'] = [product[0] for product in result][0]
                 context['products'] = []
@@ -128,8 +129,9 @@ def search_view(request):
 
         return redirect("/")
 
-    if 'last_products' and 'last_search' in request.session:
-        products = Product.objects.filter(pk__in=request.session['last_products'])
+    if 'last_search_id' in request.session and 'last_search' in request.session:
+        products = Product.objects.filter(search_results__search_id=request.session['last_search_id'])
+        products = products.order_by('search_results__position')
         paginator = Paginator(products, settings.MAX_RESULT_PER_PAGE)
         page = request.GET.get('page')
         context['products'] = paginator.get_page(page)
@@ -144,32 +146,28 @@ def product_view(request, **kwargs):
     Product page view.
     """
     product = Product.objects.get(pk=kwargs['pk'])
-    categories = product.categories_tags.all()
-    last_products = []
-    if 'last_products' in request.session:
-        last_products = request.session['last_products']
-    products_query_list = []
-    for category in categories:
-        products_query_list.append(category.product_set.filter(nutrition_grade_fr__lt=product.nutrition_grade_fr,
-                                                               pk__in=last_products).exclude(nutrition_grade_fr=''))
-    products = sorted(list(set(chain(*products_query_list))), key=lambda x: x.nutrition_grade_fr)
-
-    queryset_list = []
-    for category in categories:
-        queryset_list.append(category.product_set.filter(nutrition_grade_fr__lt=product.nutrition_grade_fr).exclude(
-            pk__in=last_products).exclude(nutrition_grade_fr=''))
-    others = sorted(list(set(chain(*queryset_list))), key=lambda x: x.nutrition_grade_fr)
+    categories = list(product.categories_tags.all())
+    substitutes = get_substitutes(product)
+    # substitutes found by last search are joined to its stored result
+    last_search_id = request.session.get('last_search_id')
+    if last_search_id is None:
+        products = []
+        others = substitutes
+    else:
+        products = list(substitutes.filter(search_results__search_id=last_search_id))
+        others = substitutes.exclude(search_results__search_id=last_search_id)
 
     paginator = Paginator(others, settings.MAX_RESULT_PER_PAGE)
     page = request.GET.get('page')
 
-    grades = sorted([value['nutrition_grade_fr'] for value in Product.objects.values('nutrition_grade_fr').distinct()])
+    grades = Catalogue.get_metadata()['nutrition_grades']
 
     context = {
         'product': product,
         'products': products,
         'others': paginator.get_page(page),
         'categories': categories,
+        'alternatives': get_healthier_alternatives(product, category_ids=[category.pk for category in categories]),
         'grades': grades,
         "form": ProductsSearchForm(),
     }
@@ -2,9 +2,15 @@
 Web api.
 """
 from rest_framework import generics
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from substitute_finder.models import Comment, CustomUser, Category, Product
+from substitute_finder.autocomplete import autocomplete
+from substitute_finder.inverted_index import PRODUCT_INDEX
+
+from substitute_finder.models import Catalogue, Comment, CustomUser, Category, Product, parse_number
 from substitute_finder.permissions import CommentCustomPermission
 from substitute_finder.serializers import CommentSerializer, CustomUserSerializer, CategorySerializer, \
     ProductSerializer
@@ -21,9 +27,27 @@ class CategoryApiViewSet(ModelViewSet):
 class ProductApiViewSet(ModelViewSet):
     """
     View that exposes Products through rest api.
+    Products can be filtered on nutrient values with parameters like sugars_100g__lt=5, lookups being lt, lte, gt
+    and gte.
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    nutrient_lookups = ['lt', 'lte', 'gt', 'gte']
+
+    def get_queryset(self):
+        """
+        Return products filtered by nutrient parameters, invalid values are ignored.
+        :return:
+        """
+        queryset = super().get_queryset()
+        for name, parse in Product.field_parsers.items():
+            if parse is not parse_number:
+                continue
+            for lookup in self.nutrient_lookups:
+                value = parse_number(self.request.query_params.get('%s__%s' % (name, lookup)))
+                if value is not None:
+                    queryset = queryset.filter(**{'%s__%s' % (name, lookup): value})
+        return queryset
 
 
 class CustomUserApiViewSet(ModelViewSet):
@@ -59,3 +83,51 @@ class CommentsByProductApiView(generics.ListAPIView):
         :return:
         """
         return Comment.objects.filter(product_id=self.kwargs['pk'])
+
+
+class AutocompleteApiView(APIView):
+    """
+    View that exposes products names suggestions for typed text (q parameter) through rest api.
+    """
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        """
+        Return most frequent suggestions, limit parameter allows to get less suggestions.
+        :return:
+        """
+        try:
+            limit = int(request.query_params.get('limit', 0))
+        except ValueError:
+            limit = 0
+        suggestions = autocomplete(request.query_params.get('q', ''), limit=limit)
+        return Response([{'text': text, 'frequency': frequency} for text, frequency in suggestions])
+
+
+class CatalogueApiView(APIView):
+    """
+    View that exposes catalogue metadata (nutrition grades, products and categories counts) through rest api.
+    """
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        """
+        Return cached catalogue metadata.
+        :return:
+        """
+        return Response(Catalogue.get_metadata())
+
+
+class SearchIndexApiView(APIView):
+    """
+    View that exposes metrics of the in memory products search index of the worker answering through rest api,
+    to admin users.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        """
+        Return index size and build time metrics, the index isn't built by this request.
+        :return:
+        """
+        return Response(PRODUCT_INDEX.metrics())